@@ -1,13 +1,25 @@
 import streamlit as st
 from streamlit import fragment
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 from datetime import datetime
 import time
 import hashlib
-import json
+import hmac
 import os
 from pathlib import Path
 
+import lite
+import metrics
+import poll_history
+import polls
+import refresh
+import rooms
+import styles
+import telemetry
+from chat_render import message_html
+from storage import CHAT_DELETED_KEY, CHAT_KEY
+
 # Configuración de la página
 st.set_page_config(
     page_title="Stream Interactivo - Aula Virtual",
@@ -19,114 +31,316 @@ st.set_page_config(
 DATA_DIR = Path("shared_data")
 DATA_DIR.mkdir(exist_ok=True)
 
+# Mensajes de chat visibles en cada sesión (y tamaño de cada página de "anteriores")
+CHAT_WINDOW = int(os.environ.get('AULA_CHAT_WINDOW', 50))
+
+# Mensajes que se mantienen en vivo; los anteriores se archivan comprimidos
+CHAT_HOT_WINDOW = int(os.environ.get('AULA_CHAT_HOT', 2000))
+
+# Segundos sin actividad tras los que un estudiante deja de contar como conectado
+PRESENCE_TTL = 30
+
+# Cada cuántos segundos se recalcula el "hace Ns" de la lista de estudiantes
+ROSTER_REFRESH = 15
+
+# Cada cuántos segundos se redibujan los gráficos de participación del maestro
+ENGAGEMENT_REFRESH = 5
+
+# Segundos sin accesos ni estudiantes tras los que se liberan los recursos de una sala
+ROOM_IDLE_SECONDS = int(os.environ.get('AULA_ROOM_IDLE', 900))
+
+# Ejecuciones de fragmentos por segundo que se permiten en todo el proceso:
+# con más sesiones conectadas los refrescos se espacian para no superarlo
+REFRESH_BUDGET = float(os.environ.get('AULA_REFRESH_BUDGET', 200))
+
+# Tope opcional en segundos para cualquier intervalo de refresco
+REFRESH_MAX = float(os.environ['AULA_REFRESH_MAX']) if os.environ.get('AULA_REFRESH_MAX') else None
+
+# Segundos mínimos entre reprogramaciones de una sesión para espaciar sus
+# fragmentos y para acercarlos (esto último además dentro del cupo de la sala)
+REFRESH_BACKOFF_EVERY = 20
+REFRESH_TIGHTEN_EVERY = 5
+
+# Puerto del modo liviano para estudiantes (HTTP/JSON y SSE); vacío lo desactiva
+LITE_PORT = int(os.environ['AULA_LITE_PORT']) if os.environ.get('AULA_LITE_PORT') else None
+
+# Claves cuyo cambio relanza al instante la página de los estudiantes
+WATCHED_KEYS = ('polls', 'vdo_link')
+
+# Lo único que cada sesión guarda por su cuenta
+SESSION_IDENTITY = ('user_type', 'username', 'user_id', 'room_id')
+
 # Funciones para manejo de datos compartidos
+@st.cache_resource
+def get_rooms():
+    """Salas abiertas en este proceso, compartidas por todas las sesiones
+    (y con el modo liviano, si está activado)"""
+    registry = rooms.RoomRegistry(
+        DATA_DIR,
+        presence_ttl=PRESENCE_TTL,
+        idle_seconds=ROOM_IDLE_SECONDS,
+        refresh_options={'budget': REFRESH_BUDGET, 'max_interval': REFRESH_MAX}
+    )
+    if LITE_PORT:
+        try:
+            lite.start(registry, port=LITE_PORT, chat_window=CHAT_WINDOW, hot_window=CHAT_HOT_WINDOW)
+        except OSError:
+            # Otro worker ya atiende el modo liviano en ese puerto
+            metrics.inc('lite_start_errors_total')
+    return registry
+
+@st.cache_resource
+def get_teacher_password_hash():
+    """Hash de la contraseña del maestro, leída de los secrets una vez por
+    proceso (``None`` si no está configurada)"""
+    try:
+        secret = st.secrets["teacher_password"]
+    except (KeyError, FileNotFoundError):
+        return None
+    return hashlib.sha256(str(secret).encode()).digest()
+
+def check_teacher_password(password):
+    digest = hashlib.sha256((password or '').encode()).digest()
+    return hmac.compare_digest(digest, get_teacher_password_hash())
+
+def measure_session():
+    """Tamaño del session_state de esta sesión (al final de cada ejecución completa)"""
+    ctx = get_script_run_ctx()
+    if ctx is None or not metrics.ENABLED:
+        return
+    state = {key: st.session_state[key] for key in st.session_state}
+    metrics.sessions.update(ctx.session_id, metrics.deep_sizeof(state))
+
+def current_room():
+    """Sala de la sesión actual: todo el estado compartido vive dentro de ella"""
+    return get_rooms().get(st.session_state.get('room_id') or rooms.DEFAULT_ROOM)
+
+def get_store():
+    """Backend de almacenamiento de la sala actual"""
+    return current_room().store
+
+@metrics.timed('shared_data_seconds', op='save')
 def save_shared_data(key, data):
-    """Guardar datos compartidos en archivo JSON"""
-    file_path = DATA_DIR / f"{key}.json"
-    with open(file_path, 'w') as f:
-        json.dump(data, f)
+    """Guardar datos compartidos en el backend"""
+    get_store().put(key, data)
+
+def get_shared_cache():
+    """Caché de datos decodificados de la sala, compartida por sus sesiones"""
+    return current_room().cache
 
+@metrics.timed('shared_data_seconds', op='load')
 def load_shared_data(key, default=None):
-    """Cargar datos compartidos desde archivo JSON"""
-    file_path = DATA_DIR / f"{key}.json"
-    if file_path.exists():
-        try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except:
-            return default
-    return default
+    """Cargar datos compartidos (solo lectura: el objeto se comparte entre sesiones)"""
+    return get_shared_cache().get(key, default)
 
 def clear_all_shared_data():
-    """Limpiar todos los archivos de datos compartidos"""
-    if DATA_DIR.exists():
-        for file in DATA_DIR.glob("*.json"):
-            try:
-                file.unlink()
-            except:
-                pass
-
-# CSS personalizado
-st.markdown("""
-<style>
-    .chat-message {
-        padding: 10px;
-        border-radius: 10px;
-        margin: 5px 0;
-        background-color: rgba(240, 242, 246, 0.1);
-        border: 1px solid rgba(128, 128, 128, 0.2);
-        color: inherit;
-    }
-    .teacher-message {
-        background-color: rgba(33, 150, 243, 0.15);
-        border-left: 4px solid #2196f3;
-        color: inherit;
-    }
-    .chat-message strong {
-        color: inherit;
-    }
-    .chat-message small {
-        color: rgba(128, 128, 128, 0.8);
-    }
-    .poll-option {
-        padding: 10px;
-        margin: 5px 0;
-        border-radius: 5px;
-        background-color: rgba(232, 234, 240, 0.1);
-    }
-    .stButton>button {
-        width: 100%;
-    }
-    .user-badge {
-        display: inline-block;
-        padding: 2px 8px;
-        border-radius: 12px;
-        font-size: 0.8em;
-        font-weight: bold;
-    }
-    .teacher-badge {
-        background-color: #ff9800;
-        color: white;
-    }
-    .student-badge {
-        background-color: #4caf50;
-        color: white;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Inicializar session state
-if 'user_type' not in st.session_state:
-    st.session_state.user_type = None
-if 'username' not in st.session_state:
-    st.session_state.username = None
-if 'user_id' not in st.session_state:
-    st.session_state.user_id = None
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-if 'polls' not in st.session_state:
-    st.session_state.polls = []
-if 'current_poll' not in st.session_state:
-    st.session_state.current_poll = None
-if 'poll_votes' not in st.session_state:
-    st.session_state.poll_votes = {}  # {user_id: {poll_id: option_voted}}
-if 'vdo_link' not in st.session_state:
-    st.session_state.vdo_link = ""
-if 'teacher_password' not in st.session_state:
-    # Cargar contraseña SOLO desde secrets de Streamlit
+    """Limpiar todos los datos compartidos de la sala actual (las demás no se tocan)"""
+    # Las encuestas abiertas pasan antes al historial
+    for poll in open_polls():
+        archive_poll(poll)
+    current_room().clear()
+
+def archive_poll(poll):
+    """Agregar una encuesta y sus votos al historial de la sala (una sola vez)"""
+    if not poll:
+        return
+    room = current_room()
+    usernames = {user_id: username for user_id, username, _ in room.presence.snapshot()}
+    # Las respuestas cortas definen sus opciones al votar: se guardan las del conteo
+    poll = {**poll, 'options': room.polls.tally(poll).labels}
+    with metrics.timer('poll_history_seconds', op='record'):
+        room.history.record_poll(
+            poll,
+            room.store.get_vote_records(poll['id']),
+            usernames,
+            students_present=room.presence.active_count()
+        )
+
+def get_presence():
+    """Registro de presencia en memoria de la sala actual"""
+    return current_room().presence
+
+@metrics.timed('dashboard_seconds')
+def get_dashboard():
+    """Snapshot del tablero de la sala: estudiantes, encuestas abiertas con sus
+    resultados, link y offset del chat en un solo objeto (compartido: no modificar)"""
+    return current_room().dashboard.snapshot()
+
+def register_activity():
+    """Heartbeat O(1) del estudiante actual (solo toca disco al entrar)"""
+    get_presence().touch(st.session_state.user_id, st.session_state.username)
+
+# Refrescos adaptativos de los fragmentos
+def refresh_interval(channel, version=None, hot=False):
+    """Intervalo ideal del fragmento según la actividad de la sala y la carga del proceso"""
+    scheduler = current_room().refresh
+    if version is not None:
+        scheduler.observe(channel, version)
+    return scheduler.interval(channel, get_rooms().active_sessions(), hot=hot)
+
+def schedule_fragment(channel, hot=False):
+    """run_every con el que se define el fragmento en esta ejecución completa"""
+    interval = refresh_interval(channel, hot=hot)
+    st.session_state.setdefault('refresh', {})[channel] = interval
+    metrics.registry.set_gauge('refresh_interval_seconds', interval, fragment=channel)
+    return interval
+
+def reschedule_if_needed(channel, version=None, hot=False):
+    """Al final de cada ejecución del fragmento: si su intervalo ideal cambió
+    bastante, relanzar la app para que se vuelva a definir con el nuevo"""
+    desired = refresh_interval(channel, version, hot)
+    ctx = get_script_run_ctx()
+    if ctx is None or not ctx.fragment_ids_this_run:
+        # En una ejecución completa el fragmento se acaba de definir
+        return
+    registered = st.session_state.get('refresh', {}).get(channel)
+    if not refresh.needs_reschedule(registered, desired):
+        return
+    now = time.time()
+    if desired > registered:
+        # Espaciar no es urgente: no relanzar la app más de una vez cada tanto
+        last = st.session_state.get('refresh_backoff_at', 0)
+        if now - last < REFRESH_BACKOFF_EVERY:
+            return
+        st.session_state.refresh_backoff_at = now
+    else:
+        # Acercar tampoco puede relanzar a todas las sesiones a la vez: cada una
+        # espera su turno y la sala reparte un cupo de ejecuciones completas.
+        # Mientras tanto el fragmento sigue con su intervalo y reintenta
+        last = st.session_state.get('refresh_tighten_at', 0)
+        if now - last < REFRESH_TIGHTEN_EVERY:
+            return
+        if not current_room().refresh.allow_rerun(now):
+            metrics.inc('refresh_reschedules_deferred_total', fragment=channel)
+            return
+        st.session_state.refresh_tighten_at = now
+    metrics.inc('refresh_reschedules_total', fragment=channel)
+    st.rerun()
+
+def allow_write(action):
+    """Token bucket del estudiante y de la sala (en memoria); avisa si hay que esperar"""
+    if st.session_state.user_type != "estudiante":
+        return True
+    allowed, wait = current_room().limiter.check(action, st.session_state.user_id)
+    if not allowed:
+        st.warning(f"⏳ Vas demasiado rápido: espera {max(wait, 1):.0f}s e inténtalo de nuevo")
+    return allowed
+
+def open_polls():
+    """Encuestas abiertas de la sala, en orden de lanzamiento (solo lectura)"""
+    return load_shared_data('polls', None) or []
+
+def poll_is_active():
+    return bool(get_dashboard()['polls'])
+
+def launch_poll(question, kind, **definition):
+    """Agregar una encuesta a las abiertas; ``ValueError`` si la definición no sirve"""
+    store = get_store()
+    with store.transaction():
+        current = store.get('polls', None) or []
+        # Ids en milisegundos, siempre crecientes aunque se lancen dos seguidas
+        poll_id = max(int(time.time() * 1000), max((p['id'] for p in current), default=0) + 1)
+        poll = polls.new_poll(poll_id, question, kind, **definition)
+        store.put('polls', current + [poll])
+    return poll
+
+def close_poll(poll_id):
+    """Quitar una encuesta de las abiertas y pasarla al historial"""
+    store = get_store()
+    with store.transaction():
+        current = store.get('polls', None) or []
+        closing = next((p for p in current if p['id'] == poll_id), None)
+        if closing is None:
+            return None
+        store.put('polls', [p for p in current if p['id'] != poll_id])
+    archive_poll(closing)
+    current_room().polls.forget(poll_id)
+    return closing
+
+def submit_vote(poll, answer):
+    """Registrar la respuesta del estudiante en el conteo compacto y relanzar"""
     try:
-        st.session_state.teacher_password = st.secrets["teacher_password"]
-    except KeyError:
-        # Si no está configurado en secrets, mostrar error
-        st.error("⚠️ ERROR: La contraseña del maestro no está configurada. Por favor configura 'teacher_password' en Streamlit Secrets.")
-        st.stop()
-if 'connected_students' not in st.session_state:
-    st.session_state.connected_students = {}  # {user_id: {'username': str, 'last_activity': datetime}}
+        accepted = current_room().polls.vote(poll, st.session_state.user_id, answer)
+    except ValueError as e:
+        st.warning(str(e))
+        return
+    
+    # Actualizar actividad del estudiante
+    register_activity()
+    
+    if accepted:
+        st.success("✅ ¡Voto registrado!")
+    else:
+        st.warning("Ya habías votado en esta encuesta")
+    time.sleep(1)
+    st.rerun()
+
+def get_view(name, version, build):
+    """Modelo de vista de un fragmento; solo se reconstruye si cambió la versión de sus datos"""
+    views = st.session_state.setdefault('views', {})
+    view = views.get(name)
+    if view is None or view[0] != version:
+        view = (version, build())
+        views[name] = view
+        metrics.inc('view_builds_total', view=name, result='rebuilt')
+    else:
+        metrics.inc('view_builds_total', view=name, result='reused')
+    return view[1]
+
+def get_chat_html_cache():
+    """HTML de cada mensaje de la sala, renderizado una vez y compartido entre sesiones"""
+    return current_room().html_cache
+
+def get_chat_view(chat_version):
+    """Ventana en vivo del chat de la sala: una sola por versión, compartida
+    por todas sus sesiones (solo lectura)"""
+    room = current_room()
+    return room.chat_view.get(chat_version, room.version(CHAT_DELETED_KEY), CHAT_WINDOW)
+
+def load_older_messages():
+    """Pedir una página más de mensajes anteriores a la ventana en vivo: la
+    sesión solo guarda desde dónde y cuántas páginas, no los mensajes"""
+    older = st.session_state.get('chat_older')
+    if older is None:
+        # En JSON el primer mensaje tiene offset 0: no confundirlo con "sin cursor"
+        before = st.session_state.get('chat_first')
+        if before is None:
+            before = get_store().message_bounds()[1]
+        older = {'before': before, 'pages': 0}
+    st.session_state.chat_older = {**older, 'pages': older['pages'] + 1}
+
+# CSS personalizado (minificado una vez por proceso en ``styles``)
+st.markdown(styles.PAGE_STYLE, unsafe_allow_html=True)
+
+# Inicializar session state: por sesión solo se guarda la identidad; los
+# datos compartidos viven en la sala y las vistas se crean al usarse
+for key in SESSION_IDENTITY:
+    st.session_state.setdefault(key, None)
+
+# Contraseña del maestro: SOLO desde secrets de Streamlit
+if get_teacher_password_hash() is None:
+    # Si no está configurado en secrets, mostrar error
+    st.error("⚠️ ERROR: La contraseña del maestro no está configurada. Por favor configura 'teacher_password' en Streamlit Secrets.")
+    st.stop()
 
 # Función para generar ID único de usuario
 def generate_user_id(username, user_type):
     # Usar solo el nombre de usuario para que sea consistente entre sesiones
-    return hashlib.md5(f"{username}_{user_type}".encode()).hexdigest()[:8]
+    return rooms.user_id_for(username, user_type)
+
+# Tras un reinicio del servidor el navegador se reconecta con el mismo link:
+# si el estudiante sigue presente en su sala (la presencia se restaura del
+# checkpoint) se reanuda su sesión sin volver a ingresar
+if st.session_state.user_type is None and st.query_params.get("student"):
+    resume_room = rooms.normalize_room_id(st.query_params.get("room", rooms.DEFAULT_ROOM))
+    resume_name = st.query_params["student"]
+    resume_id = generate_user_id(resume_name, "estudiante")
+    if resume_room and get_rooms().get(resume_room).presence.is_present(resume_id):
+        st.session_state.room_id = resume_room
+        st.session_state.user_type = "estudiante"
+        st.session_state.username = resume_name
+        st.session_state.user_id = resume_id
+        metrics.inc('sessions_resumed_total')
 
 # Pantalla de login
 if st.session_state.user_type is None:
@@ -141,13 +355,25 @@ if st.session_state.user_type is None:
         
         username = st.text_input("Nombre de usuario:", placeholder="Ingresa tu nombre")
         
+        # La sala puede venir en el link (?room=...) para compartirlo con la clase
+        room_input = st.text_input(
+            "Sala:",
+            value=st.query_params.get("room", rooms.DEFAULT_ROOM),
+            help="Cada sala tiene su propio chat, encuestas y estudiantes"
+        )
+        room_id = rooms.normalize_room_id(room_input)
+        
         if user_type == "👨‍🏫 Maestro":
             password = st.text_input("Contraseña del maestro:", type="password")
         
         if st.button("🚀 Ingresar", use_container_width=True):
-            if username:
+            if room_id is None:
+                st.error("Nombre de sala inválido: usa letras, números, guiones o guiones bajos")
+            elif username:
                 if user_type == "👨‍🏫 Maestro":
-                    if password == st.session_state.teacher_password:
+                    if check_teacher_password(password):
+                        st.session_state.room_id = room_id
+                        st.query_params["room"] = room_id
                         st.session_state.user_type = "maestro"
                         st.session_state.username = username
                         st.session_state.user_id = generate_user_id(username, "maestro")
@@ -157,17 +383,15 @@ if st.session_state.user_type is None:
                     else:
                         st.error("❌ Contraseña incorrecta")
                 else:
+                    st.session_state.room_id = room_id
+                    st.query_params["room"] = room_id
+                    st.query_params["student"] = username
                     st.session_state.user_type = "estudiante"
                     st.session_state.username = username
                     st.session_state.user_id = generate_user_id(username, "estudiante")
                     
-                    # Registrar estudiante conectado en archivo compartido
-                    connected = load_shared_data('connected_students', {})
-                    connected[st.session_state.user_id] = {
-                        'username': username,
-                        'last_activity': datetime.now().isoformat()
-                    }
-                    save_shared_data('connected_students', connected)
+                    # Registrar estudiante conectado
+                    register_activity()
                     
                     st.success("¡Bienvenido Estudiante!")
                     time.sleep(1)
@@ -182,32 +406,34 @@ if st.session_state.user_type is None:
 else:
     # Actualizar actividad del estudiante al cargar la página
     if st.session_state.user_type == "estudiante":
-        # Cargar estudiantes conectados
-        connected = load_shared_data('connected_students', {})
-        
-        if st.session_state.user_id not in connected:
-            # Re-registrar al estudiante si no está en la lista
-            connected[st.session_state.user_id] = {
-                'username': st.session_state.username,
-                'last_activity': datetime.now().isoformat()
-            }
-        else:
-            # Actualizar actividad (heartbeat)
-            connected[st.session_state.user_id]['last_activity'] = datetime.now().isoformat()
-        
-        # Guardar cambios
-        save_shared_data('connected_students', connected)
+        # Registrar o actualizar actividad (heartbeat)
+        register_activity()
     
-    # Heartbeat automático para estudiantes - actualizar cada 10 segundos
+    # Heartbeat automático para estudiantes (más espaciado cuanto más carga hay)
     if st.session_state.user_type == "estudiante":
-        @fragment(run_every="10s")
+        @fragment(run_every=schedule_fragment('heartbeat'))
+        @metrics.instrument_fragment('heartbeat')
         def student_heartbeat():
-            connected = load_shared_data('connected_students', {})
-            if st.session_state.user_id in connected:
-                connected[st.session_state.user_id]['last_activity'] = datetime.now().isoformat()
-                save_shared_data('connected_students', connected)
+            register_activity()
+            reschedule_if_needed('heartbeat')
         
         student_heartbeat()
+        
+        # Con el bus de cambios, una encuesta nueva o un link nuevo llegan en
+        # ~1s: este fragmento solo compara contadores en memoria (sin leer
+        # disco) y relanza la app cuando cambian
+        if current_room().bus is not None:
+            st.session_state.watched_version = current_room().version(*WATCHED_KEYS)
+            
+            @fragment(run_every=schedule_fragment('watch'))
+            @metrics.instrument_fragment('watch')
+            def watch_updates():
+                if current_room().version(*WATCHED_KEYS) != st.session_state.watched_version:
+                    metrics.inc('watch_reruns_total')
+                    st.rerun()
+                reschedule_if_needed('watch')
+            
+            watch_updates()
     
     # Header con información del usuario
     col_header1, col_header2, col_header3 = st.columns([2, 2, 1])
@@ -222,12 +448,13 @@ else:
         <div style='text-align: right; padding-top: 20px;'>
             <span class='user-badge {badge_class}'>{role_emoji} {st.session_state.user_type.upper()}</span>
             <br><strong>{st.session_state.username}</strong>
+            <br><small>🏫 Sala: {current_room().room_id}</small>
         </div>
         """, unsafe_allow_html=True)
     
     with col_header3:
         if st.button("🚪 Salir"):
-            # Si es maestro, limpiar toda la caché antes de salir
+            # Si es maestro, limpiar los datos de su sala antes de salir
             if st.session_state.user_type == "maestro":
                 clear_all_shared_data()
                 st.success("🗑️ Sesión cerrada y datos limpiados")
@@ -236,6 +463,12 @@ else:
             st.session_state.user_type = None
             st.session_state.username = None
             st.session_state.user_id = None
+            st.session_state.room_id = None
+            st.query_params.pop("student", None)
+            # Las vistas en caché pertenecen a la sala que se deja
+            st.session_state.pop('views', None)
+            st.session_state.pop('chat_older', None)
+            st.session_state.pop('chat_first', None)
             st.rerun()
         
         # Botón de actualizar para estudiantes
@@ -254,7 +487,7 @@ else:
             st.subheader("📹 Configuración del Stream")
             
             # Cargar link guardado
-            saved_link = load_shared_data('vdo_link', '')
+            saved_link = get_dashboard()['vdo_link']
             
             vdo_link = st.text_input(
                 "Link de VDO.Ninja",
@@ -265,7 +498,6 @@ else:
             
             if st.button("💾 Guardar Link"):
                 save_shared_data('vdo_link', vdo_link)
-                st.session_state.vdo_link = vdo_link
                 st.success("Link guardado y compartido con todos!")
             
             st.divider()
@@ -273,139 +505,368 @@ else:
             # Lanzar pregunta
             st.subheader("📊 Lanzar Pregunta")
             
-            # Mostrar si hay una encuesta activa
-            current_poll_status = load_shared_data('current_poll', None)
-            if current_poll_status and current_poll_status.get('active', False):
-                st.warning(f"⚠️ Ya hay una pregunta activa desde las {current_poll_status['timestamp']}")
-            
-            if st.button("🚀 Lanzar Pregunta ABCD", use_container_width=True):
-                new_poll = {
-                    'id': int(datetime.now().timestamp()),
-                    'question': 'Pregunta',
-                    'options': ['A', 'B', 'C', 'D'],
-                    'votes': {'A': 0, 'B': 0, 'C': 0, 'D': 0},
-                    'timestamp': datetime.now().strftime("%H:%M:%S"),
-                    'active': True,
-                    'voters': []
-                }
-                
-                # Guardar encuesta en archivo compartido
-                save_shared_data('current_poll', new_poll)
-                save_shared_data('poll_votes', {})
-                
-                st.session_state.current_poll = new_poll
-                st.success("¡Pregunta lanzada y visible para todos los estudiantes!")
-                time.sleep(1)
-                st.rerun()
+            # Nueva encuesta: se suma a las abiertas sin cerrar las anteriores
+            with st.form("new_poll", clear_on_submit=True):
+                poll_kind = st.selectbox("Tipo", list(polls.KINDS), format_func=polls.KINDS.get)
+                poll_question = st.text_input("Pregunta", placeholder="Pregunta")
+                poll_options = st.text_area(
+                    "Opciones (una por línea)",
+                    value="A\nB\nC\nD",
+                    help="Solo para opción única y selección múltiple"
+                )
+                col_low, col_high, col_buckets = st.columns(3)
+                poll_low = col_low.number_input("Mínimo", value=0.0)
+                poll_high = col_high.number_input("Máximo", value=10.0)
+                poll_buckets = col_buckets.number_input("Rangos", min_value=1, max_value=20, value=5)
+                st.caption("Mínimo, máximo y rangos solo aplican a las numéricas")
+                launched = st.form_submit_button("🚀 Lanzar Pregunta", use_container_width=True)
+            
+            if launched:
+                try:
+                    launch_poll(
+                        poll_question, poll_kind,
+                        options=poll_options.splitlines(),
+                        low=poll_low, high=poll_high, buckets=poll_buckets
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success("¡Pregunta lanzada y visible para todos los estudiantes!")
+                    time.sleep(1)
+                    st.rerun()
             
-            # Verificar si hay encuesta activa desde archivo compartido
-            shared_poll = load_shared_data('current_poll', None)
-            if shared_poll and shared_poll.get('active', False):
-                if st.button("❌ Cerrar Encuesta Actual"):
-                    shared_poll['active'] = False
-                    save_shared_data('current_poll', shared_poll)
-                    st.session_state.current_poll = None
+            # Encuestas abiertas: cada una se cierra por separado
+            for entry in get_dashboard()['polls']:
+                poll = entry['poll']
+                col_poll, col_close = st.columns([3, 1])
+                col_poll.caption(
+                    f"🟢 {poll['question']} · {polls.KINDS.get(poll.get('kind', 'choice'))} · {poll['timestamp']}"
+                )
+                if col_close.button("❌ Cerrar", key=f"close_poll_{poll['id']}"):
+                    close_poll(poll['id'])
                     st.success("Encuesta cerrada")
                     st.rerun()
             
             st.divider()
             
-            # Estudiantes conectados (con auto-refresh)
-            @fragment(run_every="5s")
+            # Estudiantes conectados (con auto-refresh adaptativo)
+            @fragment(run_every=schedule_fragment('presence'))
+            @metrics.instrument_fragment('presence')
             def mostrar_estudiantes_conectados():
                 st.subheader("👥 Estudiantes Conectados")
                 
-                # Cargar estudiantes conectados
-                connected_students = load_shared_data('connected_students', {})
-                
-                # Limpiar estudiantes inactivos (más de 30 segundos sin actividad)
-                # Cambiado de 5 minutos a 30 segundos para ser más preciso
-                current_time = datetime.now()
-                inactive_students = []
-                active_students = {}
+                # El snapshot barre inactivos (O(expirados)) y trae el conteo
+                registry = get_presence()
+                st.metric("Total de estudiantes", get_dashboard()['students'])
                 
-                for user_id, data in connected_students.items():
-                    try:
-                        last_activity = datetime.fromisoformat(data['last_activity'])
-                        time_diff = (current_time - last_activity).total_seconds()
-                        
-                        # Si tiene más de 30 segundos de inactividad, marcar como inactivo
-                        if time_diff > 30:
-                            inactive_students.append(user_id)
-                        else:
-                            active_students[user_id] = data
-                    except:
-                        inactive_students.append(user_id)
+                # La tabla solo se reconstruye si alguien entró o salió (o
+                # cada ROSTER_REFRESH segundos, para los "hace N s")
+                current_time = time.time()
+                roster = get_view(
+                    'roster',
+                    (registry.version, int(current_time // ROSTER_REFRESH)),
+                    lambda: registry.roster_frame(current_time)
+                )
                 
-                # Guardar solo estudiantes activos
-                if inactive_students:
-                    save_shared_data('connected_students', active_students)
-                    connected_students = active_students
-                
-                # Mostrar lista de estudiantes
-                num_students = len(connected_students)
-                st.metric("Total de estudiantes", num_students)
-                
-                if num_students > 0:
+                if len(roster):
+                    # Un solo elemento: ordenable y con búsqueda desde la barra de la tabla
                     st.markdown("**Lista de estudiantes:**")
-                    for user_id, data in connected_students.items():
-                        # Mostrar tiempo desde última actividad
-                        try:
-                            last_activity = datetime.fromisoformat(data['last_activity'])
-                            seconds_ago = int((current_time - last_activity).total_seconds())
-                            st.text(f"👨‍🎓 {data['username']} (hace {seconds_ago}s)")
-                        except:
-                            st.text(f"👨‍🎓 {data['username']}")
+                    st.dataframe(
+                        roster,
+                        column_order=['estudiante', 'hace (s)', 'última actividad'],
+                        column_config={
+                            'estudiante': st.column_config.TextColumn("👨‍🎓 Estudiante"),
+                            'hace (s)': st.column_config.NumberColumn("Hace", format="%d s"),
+                            'última actividad': st.column_config.DatetimeColumn("Última actividad", format="HH:mm:ss"),
+                        },
+                        hide_index=True,
+                        use_container_width=True,
+                        height=min(35 * (len(roster) + 1) + 3, 400)
+                    )
                 else:
                     st.info("No hay estudiantes conectados")
                 
                 # Botón para limpiar manualmente estudiantes inactivos
                 if st.button("🔄 Actualizar Lista", use_container_width=True):
                     st.rerun()
+                
+                reschedule_if_needed('presence', registry.version)
             
             mostrar_estudiantes_conectados()
             
             st.divider()
             
-            # Estadísticas de encuesta actual
+            # Estadísticas de las encuestas abiertas (precalculadas en el snapshot)
             st.subheader("📈 Estadísticas de Encuesta")
-            shared_poll = load_shared_data('current_poll', None)
-            if shared_poll and shared_poll.get('active', False):
-                total_votes = len(shared_poll.get('voters', []))
-                st.metric("Estudiantes que han votado", total_votes)
-                if num_students > 0:
-                    participation = (total_votes / num_students) * 100
-                    st.metric("Participación", f"{participation:.1f}%")
+            dashboard = get_dashboard()
+            if dashboard['polls']:
+                for entry in dashboard['polls']:
+                    col_voted, col_part = st.columns(2)
+                    col_voted.metric(f"Votaron · {entry['poll']['question']}", entry['voters'])
+                    if entry['participation'] is not None:
+                        col_part.metric("Participación", f"{entry['participation']:.1f}%")
             else:
                 st.info("No hay encuesta activa")
             
+            # Participación en el tiempo: la serie vive en un buffer circular de
+            # la sala, los gráficos solo se dibujan si el maestro los abre
+            if st.toggle("📈 Participación en el tiempo"):
+                window = st.select_slider(
+                    "Ventana",
+                    options=[5, 15, 30, 60],
+                    value=15,
+                    format_func=lambda minutes: f"{minutes} min"
+                )
+                
+                @fragment(run_every=ENGAGEMENT_REFRESH)
+                @metrics.instrument_fragment('engagement')
+                def mostrar_participacion():
+                    series = current_room().engagement.frame(seconds=window * 60)
+                    if series.empty:
+                        st.info("Todavía no hay muestras")
+                        return
+                    col_peak, col_votes = st.columns(2)
+                    col_peak.metric("Máximo de estudiantes", int(series['students'].max()))
+                    col_votes.metric("Votos/s (pico)", f"{series['votes_per_s'].max():.1f}")
+                    st.caption("👥 Estudiantes conectados")
+                    st.line_chart(series[['students']].rename(columns={'students': "estudiantes"}), height=150)
+                    st.caption("💬 Mensajes y 🗳️ votos por segundo")
+                    st.line_chart(
+                        series[['chat_per_s', 'votes_per_s', 'open_polls']].rename(columns={
+                            'chat_per_s': "mensajes/s", 'votes_per_s': "votos/s", 'open_polls': "encuestas abiertas"
+                        }),
+                        height=150
+                    )
+                    st.caption("⏱️ Duración media de los fragmentos (ms)")
+                    st.line_chart(series[['fragment_ms']].rename(columns={'fragment_ms': "ms"}), height=150)
+                
+                mostrar_participacion()
+                
+                # Serie completa del día desde disco para analizarla después de la clase
+                if st.button("📦 Preparar serie del día (CSV)", use_container_width=True):
+                    engagement = current_room().engagement
+                    engagement.flush()
+                    path = engagement.path_for(time.time())
+                    st.session_state.engagement_export = (
+                        path.name.replace('.series', '.csv'),
+                        telemetry.read_series(path).to_csv() if path.exists() else ""
+                    )
+                if st.session_state.get('engagement_export'):
+                    name, data = st.session_state.engagement_export
+                    st.download_button(
+                        "⬇️ Descargar serie",
+                        data,
+                        file_name=name,
+                        mime="text/csv",
+                        on_click=lambda: st.session_state.pop('engagement_export', None),
+                        use_container_width=True
+                    )
+            
+            # Historial de encuestas: solo se carga si el maestro lo abre
+            if st.toggle("📚 Historial de encuestas"):
+                history = current_room().history
+                with metrics.timer('poll_history_seconds', op='analytics'):
+                    stats = history.analytics()
+                
+                if stats['polls'] == 0:
+                    st.info("Aún no hay encuestas cerradas")
+                else:
+                    col_polls, col_votes = st.columns(2)
+                    col_polls.metric("Encuestas", stats['polls'])
+                    col_votes.metric("Votos", stats['votes'])
+                    if stats['response_p50'] is not None:
+                        st.caption(
+                            f"Tiempo de respuesta: p50 {stats['response_p50']:.1f}s · p90 {stats['response_p90']:.1f}s"
+                        )
+                    
+                    st.markdown("**Por encuesta**")
+                    st.dataframe(stats['per_poll'], hide_index=True, use_container_width=True)
+                    st.markdown("**Por estudiante**")
+                    st.dataframe(stats['per_student'], hide_index=True, use_container_width=True)
+                    if not stats['distribution'].empty:
+                        st.markdown("**Distribución de respuestas (%)**")
+                        st.dataframe(stats['distribution'], use_container_width=True)
+                    
+                    formats = ['csv', 'parquet'] if poll_history.HAS_PARQUET else ['csv']
+                    export_format = st.radio("Formato de exportación", formats, horizontal=True)
+                    for table, label in (('polls', "encuestas"), ('votes', "votos")):
+                        st.download_button(
+                            f"📥 Descargar {label}",
+                            data=history.export(table, export_format),
+                            file_name=f"{current_room().room_id}_{table}.{export_format}",
+                            mime="text/csv" if export_format == 'csv' else "application/octet-stream",
+                            key=f"poll_history_{table}",
+                            use_container_width=True
+                        )
+            
             st.divider()
             
             # Moderación
             st.subheader("🛡️ Moderación")
             if st.button("🗑️ Limpiar Chat"):
-                save_shared_data('messages', [])
-                st.success("Chat limpiado")
+                get_store().clear_messages()
+                st.success("Chat limpiado (los mensajes quedan en el historial archivado)")
                 st.rerun()
             
+            # Búsqueda en el chat en vivo: el índice se construye la primera vez que se abre
+            if st.toggle("🔎 Buscar en el chat"):
+                chat_index = current_room().chat_index
+                query = st.text_input("Palabras", placeholder="Buscar en los mensajes...")
+                authors = chat_index.authors()
+                author = st.selectbox(
+                    "Mensajes de",
+                    [None] + [user for user, _ in authors],
+                    format_func=lambda user: "Todos" if user is None else f"{user} ({dict(authors)[user]})"
+                )
+                if query.strip() or author is not None:
+                    with metrics.timer('chat_search_seconds'):
+                        results = chat_index.search(query, author)
+                    st.caption(f"{len(results)} mensajes (los más recientes primero)")
+                    table = st.dataframe(
+                        [{
+                            'hora': message.get('time', ''),
+                            'usuario': message.get('user', ''),
+                            'mensaje': message.get('text', ''),
+                        } for _, message in results],
+                        hide_index=True,
+                        use_container_width=True,
+                        on_select="rerun",
+                        selection_mode="multi-row",
+                        key="chat_search_results"
+                    )
+                    selected = [results[row][0] for row in table.selection.rows if row < len(results)]
+                    if st.button(f"🗑️ Borrar {len(selected)} seleccionados", disabled=not selected, use_container_width=True):
+                        deleted = get_store().delete_messages(selected)
+                        st.success(f"{deleted} mensajes borrados")
+                        st.rerun()
+            
+            # Límites de envío de la sala (contadores en memoria)
+            with st.expander("🚦 Límites de envío"):
+                limiter = current_room().limiter
+                limit_rows, throttled = limiter.stats()
+                st.dataframe(limit_rows, hide_index=True, use_container_width=True)
+                if throttled:
+                    names = {user_id: username for user_id, username, _ in get_presence().snapshot()}
+                    st.markdown("**Estudiantes más limitados:**")
+                    for user_id, count in throttled:
+                        st.text(f"👨‍🎓 {names.get(user_id, user_id)}: {count}")
+                st.caption(
+                    " · ".join(
+                        f"{action}: {rate:g}/s, ráfaga {burst}"
+                        for action, (rate, burst) in limiter.limits.items()
+                    ) + f" · sala (chat): {limiter.room_limit[0]:g}/s, ráfaga {limiter.room_limit[1]}"
+                )
+            
+            # Historial archivado: solo se lee del disco si el maestro lo abre
+            if st.toggle("🗄️ Historial archivado del chat"):
+                archive = get_store().archive
+                if st.button("📦 Archivar ahora", use_container_width=True):
+                    archived = get_store().rotate_messages(CHAT_WINDOW)
+                    st.success(f"{archived} mensajes archivados")
+                
+                segments = archive.segments()
+                if segments:
+                    st.dataframe(
+                        [{
+                            'desde': segment['first'],
+                            'hasta': segment['last'],
+                            'KB': round(segment['bytes'] / 1024, 1),
+                            'archivado': datetime.fromtimestamp(segment['archived_at']).strftime("%d/%m %H:%M"),
+                        } for segment in segments],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                    selected = st.selectbox(
+                        "Segmento",
+                        [segment['name'] for segment in reversed(segments)]
+                    )
+                    st.download_button(
+                        "📥 Descargar segmento",
+                        archive.segment_bytes(selected),
+                        file_name=f"chat_{selected}",
+                        mime="application/gzip",
+                        use_container_width=True
+                    )
+                    if st.checkbox("Ver mensajes del segmento"):
+                        entries = archive.read_segment(selected, limit=200)
+                        st.container(height=300).markdown(
+                            "\n".join(message_html(message) for _, message in entries),
+                            unsafe_allow_html=True
+                        )
+                    if st.button("🧳 Preparar exportación completa", use_container_width=True):
+                        st.session_state.chat_export = archive.export_all()
+                    if st.session_state.get('chat_export'):
+                        st.download_button(
+                            "📥 Descargar todo el historial",
+                            st.session_state.chat_export,
+                            file_name="chat_historial.jsonl.gz",
+                            mime="application/gzip",
+                            on_click=lambda: st.session_state.pop('chat_export', None),
+                            use_container_width=True
+                        )
+                else:
+                    st.info("Todavía no hay mensajes archivados")
+            
             st.divider()
             
             # Limpieza completa de sesión
             st.subheader("⚠️ Gestión de Sesión")
-            st.warning("Esto eliminará todos los datos: chat, encuestas, estudiantes conectados y configuración del stream.")
+            st.warning("Esto eliminará todos los datos: chat, encuestas, estudiantes conectados y configuración del stream. El chat y las encuestas se conservan en sus historiales.")
             
             if st.button("🔄 Reiniciar Sesión Completa", type="primary", use_container_width=True):
                 clear_all_shared_data()
                 st.success("✅ Sesión reiniciada. Todos los datos han sido eliminados.")
                 time.sleep(2)
                 st.rerun()
+            
+            st.divider()
+            
+            # Rendimiento del proceso (I/O compartido, fragmentos y caché)
+            with st.expander("⏱️ Rendimiento"):
+                if not metrics.ENABLED:
+                    st.info("Instrumentación desactivada (AULA_METRICS=0)")
+                else:
+                    cache_stats = get_shared_cache().stats()
+                    metrics.registry.set_gauge('shared_cache_hits', cache_stats['hits'])
+                    metrics.registry.set_gauge('shared_cache_misses', cache_stats['misses'])
+                    metrics.registry.set_gauge('shared_cache_entries', cache_stats['entries'])
+                    metrics.registry.set_gauge('students_active', get_dashboard()['students'])
+                    metrics.registry.set_gauge('rooms_open', len(get_rooms().open_rooms()))
+                    
+                    col_hits, col_misses = st.columns(2)
+                    col_hits.metric("Aciertos de caché", cache_stats['hits'])
+                    col_misses.metric("Fallos de caché", cache_stats['misses'])
+                    
+                    # Estado propio de cada sesión (identidad, vistas y widgets)
+                    session_stats = metrics.sessions.stats()
+                    col_sessions, col_avg, col_max = st.columns(3)
+                    col_sessions.metric("Sesiones medidas", session_stats['sessions'])
+                    col_avg.metric("Estado por sesión", f"{session_stats['avg'] / 1024:.1f} KB")
+                    col_max.metric("Sesión más pesada", f"{session_stats['max'] / 1024:.1f} KB")
+                    
+                    st.markdown("**Tiempos**")
+                    st.dataframe(metrics.registry.timing_rows(), hide_index=True, use_container_width=True)
+                    st.markdown("**Contadores**")
+                    st.dataframe(metrics.registry.counter_rows(), hide_index=True, use_container_width=True)
+                    
+                    prometheus_text = metrics.registry.render_prometheus()
+                    st.download_button(
+                        "📥 Descargar (Prometheus)",
+                        prometheus_text,
+                        file_name="aula_metrics.prom",
+                        mime="text/plain",
+                        use_container_width=True
+                    )
+                    if st.button("♻️ Reiniciar métricas", use_container_width=True):
+                        metrics.registry.reset()
+                        st.rerun()
     
     # Layout principal
     # Stream en la parte superior (ancho completo)
     st.header("📹 Stream en Vivo")
     
     # Cargar link compartido
-    shared_vdo_link = load_shared_data('vdo_link', '')
+    shared_vdo_link = get_dashboard()['vdo_link']
     
     if shared_vdo_link:
         # Incrustar iframe de VDO.Ninja con aspect ratio 16:9
@@ -440,30 +901,54 @@ else:
     with col1:
         st.subheader("💬 Chat en Vivo")
         
-        # Fragmento que se auto-actualiza cada 2 segundos
-        @fragment(run_every="2s")
+        # Mensajes anteriores: fragmento sin auto-refresh, solo cambia al pedir otra página
+        @fragment
+        @metrics.instrument_fragment('chat_history')
+        def mostrar_chat_anterior():
+            older = st.session_state.get('chat_older')
+            exhausted = False
+            if older and older['before'] <= get_store().message_bounds()[0]:
+                # No queda nada antes del cursor (chat corto, o se limpió desde
+                # que se pidieron): se descarta para que el próximo pedido parta
+                # de la ventana en vivo de ese momento
+                del st.session_state.chat_older
+                older = None
+                exhausted = True
+            
+            if older:
+                limit = older['pages'] * CHAT_WINDOW
+                entries = get_store().read_messages(before=older['before'], limit=limit)
+                exhausted = len(entries) < limit
+                if entries:
+                    with st.expander("🕘 Mensajes anteriores", expanded=True):
+                        st.container(height=300).markdown(
+                            get_chat_html_cache().render(entries), unsafe_allow_html=True
+                        )
+            
+            if exhausted:
+                st.caption("No hay mensajes más antiguos")
+            else:
+                # El callback corre antes del rerun del fragmento, que ya muestra la nueva página
+                st.button("⬆️ Cargar mensajes anteriores", on_click=load_older_messages, use_container_width=True)
+        
+        mostrar_chat_anterior()
+        
+        # Fragmento que se auto-actualiza: más seguido con el chat activo, menos en silencio
+        @fragment(run_every=schedule_fragment('chat'))
+        @metrics.instrument_fragment('chat')
         def mostrar_chat():
-            # Cargar mensajes compartidos
-            shared_messages = load_shared_data('messages', [])
+            # Si la versión del chat no cambió no se lee nada, y si cambió la
+            # sala solo lee los mensajes nuevos, una vez para todas las sesiones
+            chat_version = current_room().version(CHAT_KEY, CHAT_DELETED_KEY)
+            chat_view = get_chat_view(chat_version)
+            # La sesión solo recuerda dónde empieza lo que ya vio (para "anteriores")
+            st.session_state.chat_first = chat_view['first']
             
-            # Contenedor de mensajes
+            # Toda la ventana visible en un solo elemento
             chat_container = st.container(height=400)
+            chat_container.markdown(chat_view['html'], unsafe_allow_html=True)
             
-            with chat_container:
-                for msg in shared_messages[-50:]:  # Últimos 50 mensajes
-                    # Verificar si el mensaje tiene el campo 'type', si no, asignar 'estudiante' por defecto
-                    msg_type = msg.get('type', 'estudiante')
-                    msg_class = "teacher-message" if msg_type == "maestro" else "chat-message"
-                    badge_class = "teacher-badge" if msg_type == "maestro" else "student-badge"
-                    role_emoji = "👨‍🏫" if msg_type == "maestro" else "👨‍🎓"
-                    
-                    st.markdown(f"""
-                    <div class="chat-message {msg_class}">
-                        <span class='user-badge {badge_class}'>{role_emoji}</span>
-                        <strong>{msg['user']}</strong> <small>{msg['time']}</small><br>
-                        {msg['text']}
-                    </div>
-                    """, unsafe_allow_html=True)
+            reschedule_if_needed('chat', chat_version)
         
         mostrar_chat()
         
@@ -472,28 +957,22 @@ else:
             message = st.text_input("Mensaje", placeholder="Escribe un mensaje...", label_visibility="collapsed")
             submit = st.form_submit_button("Enviar")
             
-            if submit and message:
-                # Cargar mensajes actuales
-                shared_messages = load_shared_data('messages', [])
-                
-                # Agregar nuevo mensaje
+            if submit and message and allow_write('chat'):
+                # Agregar nuevo mensaje (una fila, sin reescribir el historial)
                 new_message = {
                     'user': st.session_state.username,
                     'type': st.session_state.user_type,
                     'text': message,
                     'time': datetime.now().strftime("%H:%M:%S")
                 }
-                shared_messages.append(new_message)
+                get_store().append_message(new_message)
                 
-                # Guardar mensajes
-                save_shared_data('messages', shared_messages)
+                # Mantener acotada la ventana caliente del chat
+                get_store().rotate_messages(CHAT_HOT_WINDOW)
                 
                 # Actualizar actividad del estudiante
                 if st.session_state.user_type == "estudiante":
-                    connected = load_shared_data('connected_students', {})
-                    if st.session_state.user_id in connected:
-                        connected[st.session_state.user_id]['last_activity'] = datetime.now().isoformat()
-                        save_shared_data('connected_students', connected)
+                    register_activity()
                 
                 st.rerun()
     
@@ -501,102 +980,102 @@ else:
     with col2:
         st.subheader("📊 Encuestas")
         
-        # Fragmento que se auto-actualiza cada 3 segundos para estudiantes
-        @fragment(run_every="3s" if st.session_state.user_type == "estudiante" else None)
-        def mostrar_encuestas():
-            # Cargar encuesta compartida
-            shared_poll = load_shared_data('current_poll', None)
+        def mostrar_encuesta(entry):
+            poll = entry['poll']
+            kind = poll.get('kind', 'choice')
+            st.markdown(f"### {poll['question']}")
+            st.caption(f"{polls.KINDS.get(kind)} · Creada a las {poll['timestamp']}")
             
-            if shared_poll and shared_poll.get('active', False):
-                poll = shared_poll
-                
-                st.markdown(f"### {poll['question']}")
-                st.caption(f"Creada a las {poll['timestamp']}")
-                
-                # Cargar votos compartidos
-                all_votes = load_shared_data('poll_votes', {})
-                
-                # Verificar si el usuario ya votó
-                user_has_voted = st.session_state.user_id in poll.get('voters', [])
-                
-                if st.session_state.user_type == "estudiante":
-                    if not user_has_voted:
-                        st.info("🗳️ Selecciona una opción para votar (solo puedes votar una vez)")
-                        
-                        # Opciones de votación
+            # Los resultados vienen en el snapshot; el voto propio sale del
+            # índice de votantes y solo se busca si cambió la versión del conteo
+            user_vote = get_view(
+                f"poll_{poll['id']}", entry['version'],
+                lambda: current_room().polls.tally(poll).vote_of(st.session_state.user_id)
+            )
+            
+            if st.session_state.user_type == "estudiante":
+                if user_vote is None:
+                    st.info("🗳️ Responde una sola vez: no podrás cambiar tu respuesta")
+                    
+                    if kind in ('choice', 'truefalse'):
                         for option in poll['options']:
-                            if st.button(option, key=f"vote_{poll['id']}_{option}", use_container_width=True):
-                                # Registrar voto
-                                poll['votes'][option] += 1
-                                poll['voters'].append(st.session_state.user_id)
-                                
-                                # Guardar voto del usuario
-                                all_votes[st.session_state.user_id] = {
-                                    'poll_id': poll['id'],
-                                    'option': option
-                                }
-                                
-                                # Guardar en archivos compartidos
-                                save_shared_data('current_poll', poll)
-                                save_shared_data('poll_votes', all_votes)
-                                
-                                # Actualizar actividad del estudiante
-                                connected = load_shared_data('connected_students', {})
-                                if st.session_state.user_id in connected:
-                                    connected[st.session_state.user_id]['last_activity'] = datetime.now().isoformat()
-                                    save_shared_data('connected_students', connected)
-                                
-                                st.success(f"✅ ¡Voto registrado para: {option}!")
-                                time.sleep(1)
-                                st.rerun()
+                            if st.button(option, key=f"vote_{poll['id']}_{option}", use_container_width=True) and allow_write('vote'):
+                                submit_vote(poll, option)
                     else:
-                        # Mostrar qué opción votó el estudiante
-                        user_vote = all_votes.get(st.session_state.user_id, {})
-                        voted_option = user_vote.get('option', '')
-                        st.success(f"✅ Ya has votado por: **{voted_option}**")
-                        st.info("No puedes cambiar tu voto")
-                
-                st.divider()
-                
-                # Resultados (visible para todos)
-                st.subheader("📊 Resultados en Vivo")
-                total_votes = sum(poll['votes'].values())
-                
-                if total_votes > 0:
-                    for option, votes in poll['votes'].items():
-                        percentage = (votes / total_votes) * 100
-                        
-                        # Mostrar barra de progreso y estadísticas
-                        col_opt, col_num = st.columns([3, 1])
-                        with col_opt:
-                            st.progress(percentage / 100)
-                            st.caption(f"{option}")
-                        with col_num:
-                            st.metric("", f"{votes}", f"{percentage:.1f}%")
-                    
-                    st.caption(f"Total de votos: {total_votes}")
+                        with st.form(f"vote_form_{poll['id']}"):
+                            if kind == 'multi':
+                                answer = st.multiselect("Marca todas las que apliquen", poll['options'])
+                            elif kind == 'numeric':
+                                low, high, _ = poll['range']
+                                answer = st.number_input(f"Valor entre {low:g} y {high:g}", min_value=float(low), max_value=float(high))
+                            else:
+                                answer = st.text_input("Tu respuesta", max_chars=80)
+                            if st.form_submit_button("Enviar respuesta", use_container_width=True) and allow_write('vote'):
+                                submit_vote(poll, answer)
                 else:
-                    st.info("Aún no hay votos")
+                    st.success(f"✅ Ya respondiste: **{', '.join(user_vote)}**")
+                    st.info("No puedes cambiar tu voto")
             
+            # Resultados (visibles para todos); en selección múltiple el
+            # porcentaje es de votantes que marcaron cada opción
+            st.markdown("**📊 Resultados en Vivo**")
+            voters = entry['voters']
+            if voters > 0:
+                results = entry['results']
+                if kind == 'short':
+                    results = sorted(results, key=lambda item: item[1], reverse=True)
+                for option, votes in results:
+                    percentage = (votes / voters) * 100
+                    
+                    # Mostrar barra de progreso y estadísticas
+                    col_opt, col_num = st.columns([3, 1])
+                    with col_opt:
+                        st.progress(min(percentage / 100, 1.0))
+                        st.caption(f"{option}")
+                    with col_num:
+                        st.metric("", f"{votes}", f"{percentage:.1f}%")
+                
+                st.caption(f"Total de votantes: {voters}")
+            else:
+                st.info("Aún no hay votos")
+        
+        # Fragmento que se auto-actualiza para estudiantes (al mínimo con una encuesta activa)
+        is_student = st.session_state.user_type == "estudiante"
+        @fragment(run_every=schedule_fragment('polls', hot=poll_is_active()) if is_student else None)
+        @metrics.instrument_fragment('polls')
+        def mostrar_encuestas():
+            # Encuestas abiertas del snapshot de la sala, cada una en su tarjeta
+            open_list = get_dashboard()['polls']
+            
+            if open_list:
+                for entry in open_list:
+                    with st.container(border=True):
+                        mostrar_encuesta(entry)
+                
+                # Olvidar las vistas de encuestas que ya se cerraron
+                views = st.session_state.get('views', {})
+                open_views = {f"poll_{entry['poll']['id']}" for entry in open_list}
+                for name in [name for name in views if name.startswith('poll_') and name not in open_views]:
+                    del views[name]
             else:
                 st.info("No hay encuestas activas en este momento")
                 if st.session_state.user_type == "estudiante":
                     st.caption("Espera a que el maestro lance una encuesta")
+            
+            if is_student:
+                reschedule_if_needed('polls', current_room().version('polls'), hot=bool(open_list))
         
         mostrar_encuestas()
     
     # Footer
     st.markdown("---")
     
-    # Indicador de actualización para estudiantes
-    if st.session_state.user_type == "estudiante":
-        col_f1, col_f2, col_f3 = st.columns([1, 2, 1])
-        with col_f2:
-            st.info("💡 Presiona 🔄 Actualizar en la esquina superior para ver nuevas encuestas")
-    
     footer_text = "👨‍🏫 **Panel del Maestro:** Controla el stream y crea encuestas desde el panel lateral" if st.session_state.user_type == "maestro" else "👨‍🎓 **Modo Estudiante:** Disfruta del stream y participa en las encuestas"
     st.markdown(f"""
     <div style='text-align: center; color: #666;'>
         <p>{footer_text}</p>
     </div>
     """, unsafe_allow_html=True)
+
+# Memoria por sesión: se mide al terminar cada ejecución completa
+measure_session()
@@ -0,0 +1,400 @@
+"""Simulación de carga de un aula con un maestro y N estudiantes.
+
+Dos modos:
+
+* ``store`` (por defecto): reproduce con hilos el camino de datos de cada
+  fragmento de app.py (heartbeat, chat, encuestas, lista de estudiantes)
+  sobre una sala de ``rooms`` (los mismos ``storage`` y ``presence``). Escala a miles de
+  estudiantes.
+* ``app``: ejecuta app.py sin navegador con ``streamlit.testing.v1.AppTest``,
+  una sesión por estudiante, en serie. Es más fiel pero mucho más lento (el
+  voto incluye ``time.sleep(1)``), así que conviene usarlo con pocos
+  estudiantes.
+
+Los envíos pasan por los límites de la sala igual que en ``allow_write``: un
+voto rechazado cuenta como perdido y los mensajes rechazados se reportan
+aparte (frenar el spam del chat es intencional).
+
+Se reportan latencias p50/p99 por fragmento, bytes de ``shared_data`` leídos
+y escritos por el backend durante la simulación (los contadores
+``shared_data_bytes_*`` de ``metrics``: claves, chat, votos, presencia y
+archivo, sin el ruido del resto del proceso), el tamaño final del directorio,
+votos perdidos y mensajes perdidos. El
+resultado es JSON y puede compararse con una línea base:
+
+    python benchmarks/classroom_load.py --students 50 500 2000 --output resultados.json
+    python benchmarks/classroom_load.py --compare benchmarks/baseline.json
+"""
+import argparse
+import hashlib
+import json
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import metrics  # noqa: E402
+import polls  # noqa: E402
+import rooms  # noqa: E402
+import storage  # noqa: E402
+
+CHAT_WINDOW = 50
+OPTIONS = ['A', 'B', 'C', 'D']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def io_counters():
+    """Bytes de ``shared_data`` leídos y escritos por el backend hasta ahora"""
+    return (
+        metrics.registry.counter_total('shared_data_bytes_read_total'),
+        metrics.registry.counter_total('shared_data_bytes_written_total'),
+    )
+
+
+def directory_size(path):
+    return sum(p.stat().st_size for p in Path(path).rglob('*') if p.is_file())
+
+
+def user_id(name, kind):
+    return hashlib.md5(f"{name}_{kind}".encode()).hexdigest()[:8]
+
+
+class Timings:
+    """Latencias por fragmento, seguras entre hilos"""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def measure(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._samples.setdefault(name, []).append(elapsed)
+        return result
+
+    def summary(self):
+        return {
+            name: {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            }
+            for name, samples in sorted(self._samples.items())
+        }
+
+
+class StoreClassroom:
+    """Camino de datos de los fragmentos de app.py sin Streamlit"""
+
+    def __init__(self, data_dir, backend):
+        self.room = rooms.Room(rooms.DEFAULT_ROOM, data_dir, presence_ttl=30, backend=backend)
+        self.store = self.room.store
+        self.cache = self.room.cache
+        self.presence = self.room.presence
+
+    @staticmethod
+    def get_view(session, name, version, build):
+        views = session.setdefault('views', {})
+        view = views.get(name)
+        if view is None or view[0] != version:
+            view = (version, build())
+            views[name] = view
+        return view[1]
+
+    def heartbeat(self, session):
+        self.presence.touch(session['user_id'], session['username'])
+
+    def chat_tick(self, session):
+        room = self.room
+        view = room.chat_view.get(
+            room.version(storage.CHAT_KEY, storage.CHAT_DELETED_KEY), room.version(storage.CHAT_DELETED_KEY), CHAT_WINDOW
+        )
+        session['chat_first'] = view['first']
+        return view
+
+    def poll_tick(self, session):
+        dashboard = self.room.dashboard.snapshot()
+        for entry in dashboard['polls']:
+            poll = entry['poll']
+            self.get_view(
+                session, f"poll_{poll['id']}", entry['version'],
+                lambda: self.room.polls.tally(poll).vote_of(session['user_id'])
+            )
+        return dashboard
+
+    def presence_tick(self, session):
+        return self.presence.active_count(), self.presence.roster_frame()
+
+    def allow_write(self, session, action):
+        """Mismo chequeo que ``allow_write`` de app.py"""
+        allowed, _ = self.room.limiter.check(action, session['user_id'])
+        return allowed
+
+    def send_message(self, session, text):
+        if not self.allow_write(session, 'chat'):
+            return False
+        self.store.append_message({
+            'user': session['username'],
+            'type': 'estudiante',
+            'text': text,
+            'time': time.strftime("%H:%M:%S")
+        })
+        self.presence.touch(session['user_id'], session['username'])
+        return True
+
+    def launch_poll(self):
+        poll = polls.new_poll(int(time.time() * 1000), 'Pregunta', 'choice', OPTIONS)
+        self.store.put('polls', [poll])
+        return poll
+
+    def vote(self, session, poll, option):
+        if not self.allow_write(session, 'vote'):
+            return False
+        self.room.polls.vote(poll, session['user_id'], option)
+        self.presence.touch(session['user_id'], session['username'])
+        return True
+
+
+def run_store(students, rounds, backend, chat_every, workers):
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as data_dir:
+        classroom = StoreClassroom(data_dir, backend)
+        sessions = [
+            {'username': f"estudiante{i}", 'user_id': user_id(f"estudiante{i}", 'estudiante')}
+            for i in range(students)
+        ]
+        teacher = {'username': 'maestro', 'user_id': user_id('maestro', 'maestro')}
+        sent = 0
+        throttled_messages = 0
+        votes_cast = 0
+        poll = None
+        read_before, written_before = io_counters()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda s: timings.measure('login', classroom.heartbeat, s), sessions))
+
+            for round_no in range(rounds):
+                if round_no == 1:
+                    poll = timings.measure('launch_poll', classroom.launch_poll)
+
+                def student_round(index):
+                    session = sessions[index]
+                    timings.measure('heartbeat', classroom.heartbeat, session)
+                    timings.measure('chat', classroom.chat_tick, session)
+                    timings.measure('poll', classroom.poll_tick, session)
+                    actions = [0, 0, 0]
+                    if index % chat_every == round_no % chat_every:
+                        if timings.measure('chat_send', classroom.send_message, session, f"mensaje {round_no}"):
+                            actions[0] = 1
+                        else:
+                            actions[1] = 1
+                    if poll is not None and round_no == 2:
+                        # Un voto frenado por el límite se pierde: cuenta como emitido
+                        timings.measure('vote', classroom.vote, session, poll, OPTIONS[index % len(OPTIONS)])
+                        actions[2] = 1
+                    return actions
+
+                for chat_sent, chat_throttled, voted in pool.map(student_round, range(students)):
+                    sent += chat_sent
+                    throttled_messages += chat_throttled
+                    votes_cast += voted
+                timings.measure('presence', classroom.presence_tick, teacher)
+
+        read_after, written_after = io_counters()
+        store = classroom.store
+        messages_stored = len(store.read_messages())
+        votes_stored = sum(store.get_tally(poll['id']).values()) if poll else 0
+        disk_bytes = directory_size(data_dir)
+        store.close()
+
+    return {
+        'fragments': timings.summary(),
+        'bytes_read': read_after - read_before,
+        'bytes_written': written_after - written_before,
+        'shared_data_bytes': disk_bytes,
+        'messages_sent': sent,
+        'throttled_messages': throttled_messages,
+        'lost_messages': sent - messages_stored,
+        'votes_cast': votes_cast,
+        'lost_votes': votes_cast - votes_stored,
+        'cache': classroom.cache.stats(),
+    }
+
+
+def run_app(students, rounds, backend, chat_every, workers):
+    import os
+    from streamlit.testing.v1 import AppTest
+
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as data_dir:
+        previous_cwd = os.getcwd()
+        os.environ['AULA_STORAGE'] = backend
+        os.chdir(data_dir)
+        try:
+            def new_session(name, kind):
+                at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=60)
+                at.secrets["teacher_password"] = "benchmark"
+                at.session_state["user_type"] = kind
+                at.session_state["username"] = name
+                at.session_state["user_id"] = user_id(name, kind)
+                timings.measure('login', at.run)
+                return at
+
+            def button(at, label):
+                for candidate in list(at.button) + list(at.sidebar.button):
+                    if candidate.label == label:
+                        return candidate
+                return None
+
+            read_before, written_before = io_counters()
+            teacher = new_session('maestro', 'maestro')
+            sessions = [new_session(f"estudiante{i}", 'estudiante') for i in range(students)]
+            sent = 0
+            votes_cast = 0
+
+            for round_no in range(rounds):
+                if round_no == 1:
+                    timings.measure('launch_poll', button(teacher, "🚀 Lanzar Pregunta").click().run)
+
+                def student_round(index):
+                    at = sessions[index]
+                    timings.measure('rerun', at.run)
+                    actions = [0, 0]
+                    if index % chat_every == round_no % chat_every:
+                        field = next(f for f in at.text_input if f.label == "Mensaje")
+                        field.set_value(f"mensaje {round_no}")
+                        timings.measure('chat_send', button(at, "Enviar").click().run)
+                        actions[0] = 1
+                    if round_no == 2:
+                        vote_button = button(at, OPTIONS[index % len(OPTIONS)])
+                        if vote_button is not None:
+                            timings.measure('vote', vote_button.click().run)
+                            actions[1] = 1
+                    return actions
+
+                # AppTest no es seguro entre hilos: las sesiones corren en serie
+                for chat_sent, voted in map(student_round, range(students)):
+                    sent += chat_sent
+                    votes_cast += voted
+                timings.measure('teacher_rerun', teacher.run)
+
+            read_after, written_after = io_counters()
+            room_dir = Path(data_dir) / "shared_data" / "rooms" / rooms.DEFAULT_ROOM
+            store = storage.create_store(room_dir, backend)
+            poll = next(iter(store.get('polls') or []), None)
+            messages_stored = len(store.read_messages())
+            votes_stored = sum(store.get_tally(poll['id']).values()) if poll else 0
+            disk_bytes = directory_size(Path(data_dir) / "shared_data")
+            store.close()
+        finally:
+            os.chdir(previous_cwd)
+
+    return {
+        'fragments': timings.summary(),
+        'bytes_read': read_after - read_before,
+        'bytes_written': written_after - written_before,
+        'shared_data_bytes': disk_bytes,
+        'messages_sent': sent,
+        'lost_messages': sent - messages_stored,
+        'votes_cast': votes_cast,
+        'lost_votes': votes_cast - votes_stored,
+    }
+
+
+def compare(current, baseline, tolerance, slack_ms, slack_bytes):
+    """Lista de regresiones de ``current`` respecto a ``baseline``.
+
+    Una latencia solo cuenta como regresión si empeora más que ``tolerance``
+    veces y además más de ``slack_ms``: en operaciones de microsegundos el p99
+    está dominado por el planificador de hilos. Con los bytes pasa lo mismo
+    con ``slack_bytes``: con las cachés son unas pocas lecturas por clave, y
+    un fallo de caché de más según cómo se intercalen los hilos no cuenta.
+    """
+    regressions = []
+    for scenario, base in baseline['scenarios'].items():
+        result = current['scenarios'].get(scenario)
+        if result is None:
+            continue
+        for key in ('lost_votes', 'lost_messages'):
+            if result[key] > base[key]:
+                regressions.append(f"{scenario}: {key} {base[key]} -> {result[key]}")
+        for name, stats in base['fragments'].items():
+            new_stats = result['fragments'].get(name)
+            if new_stats and new_stats['p99_ms'] > stats['p99_ms'] * tolerance \
+                    and new_stats['p99_ms'] - stats['p99_ms'] > slack_ms:
+                regressions.append(
+                    f"{scenario}: {name} p99 {stats['p99_ms']}ms -> {new_stats['p99_ms']}ms"
+                )
+        for key in ('bytes_read', 'bytes_written'):
+            if base[key] and result[key] > base[key] * tolerance and result[key] - base[key] > slack_bytes:
+                regressions.append(f"{scenario}: {key} {base[key]} -> {result[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--mode', choices=['store', 'app'], default='store')
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--chat-every', type=int, default=10,
+                        help="cada estudiante envía un mensaje cada N rondas")
+    parser.add_argument('--workers', type=int, default=32, help="hilos en modo store")
+    parser.add_argument('--output', help="guardar los resultados en este archivo JSON")
+    parser.add_argument('--compare', help="línea base JSON contra la cual comparar")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="factor de empeoramiento permitido en p99 y bytes")
+    parser.add_argument('--slack-ms', type=float, default=50.0,
+                        help="empeoramiento absoluto de p99 que se ignora")
+    parser.add_argument('--slack-bytes', type=int, default=4096,
+                        help="aumento absoluto de bytes leídos o escritos que se ignora")
+    args = parser.parse_args(argv)
+
+    runner = run_store if args.mode == 'store' else run_app
+    results = {
+        'mode': args.mode,
+        'backend': args.backend,
+        'rounds': args.rounds,
+        'chat_every': args.chat_every,
+        'scenarios': {},
+    }
+    for students in args.students:
+        scenario = f"{args.mode}-{args.backend}-{students}"
+        print(f"▶ {scenario}", file=sys.stderr)
+        results['scenarios'][scenario] = runner(
+            students, args.rounds, args.backend, args.chat_every, args.workers
+        )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance, args.slack_ms, args.slack_bytes)
+        for regression in regressions:
+            print(f"✗ {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✓ Sin regresiones respecto a la línea base", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Bus de avisos de cambios entre los caminos de escritura y los fragmentos.
+
+Cada backend avisa al bus de su sala qué claves cambió (``polls``,
+``tally_<id>``, ``messages``...). El bus lleva un contador por clave, así que
+saber si algo cambió desde la última vez cuesta una consulta a un dict en
+memoria en lugar de un ``stat`` o una fila de SQLite. ``wait`` bloquea hasta
+que cambie alguna de las claves pedidas.
+
+Los avisos llegan en dos momentos: ``changed`` cuando el proceso ya ve el
+valor nuevo y ``persisted`` cuando también pueden leerlo otros procesos (en
+JSON, después del volcado del write-behind). Con ``AULA_BUS``:
+
+* ``local`` (por defecto): un solo proceso; el bus es la fuente de verdad.
+* ``file``: varios workers sobre el mismo ``shared_data``. Los avisos
+  persistidos se agregan a un archivo de eventos de la sala y cada proceso
+  lo sigue desde un hilo. Hace de stand-in local de un broker externo con la
+  misma interfaz (``start``/``publish``/``close``).
+* ``off``: sin bus; las versiones se consultan al backend como antes.
+"""
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock entre procesos
+    fcntl = None
+
+# Clave comodín: "cambió todo" (reinicio de la sala)
+ALL = '*'
+
+
+class UpdateBus:
+    """Contadores de cambios por clave con espera bloqueante"""
+
+    def __init__(self, broker=None):
+        self._seq = {}
+        self._epoch = 0
+        self._cond = threading.Condition()
+        self._subscribers = []
+        self.broker = broker
+        if broker is not None:
+            broker.start(self._deliver)
+
+    def changed(self, keys):
+        """El proceso ya ve el valor nuevo de ``keys``"""
+        self._deliver(keys)
+
+    def persisted(self, keys):
+        """Otros procesos ya pueden leer ``keys``"""
+        if self.broker is not None:
+            self.broker.publish(keys)
+
+    def _deliver(self, keys):
+        with self._cond:
+            for key in keys:
+                if key == ALL:
+                    self._epoch += 1
+                else:
+                    self._seq[key] = self._seq.get(key, 0) + 1
+            self._cond.notify_all()
+        metrics.inc('bus_events_total', len(keys))
+        for callback in self._subscribers:
+            callback(keys)
+
+    def subscribe(self, callback):
+        """Llamar a ``callback(keys)`` en cada cambio"""
+        self._subscribers.append(callback)
+
+    def version(self, *keys):
+        """Versión conjunta de ``keys``; cambia cuando cambia cualquiera de ellas"""
+        return (self._epoch,) + tuple(self._seq.get(key, 0) for key in keys)
+
+    def wait(self, keys, since, timeout=None):
+        """Esperar a que la versión de ``keys`` deje de ser ``since``"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version(*keys) != since, timeout)
+            return self.version(*keys)
+
+    def close(self):
+        if self.broker is not None:
+            self.broker.close()
+
+
+class FileBroker:
+    """Eventos entre procesos a través de un archivo append-only.
+
+    Cada línea es ``[emisor, claves]``. El archivo se rota al pasar de
+    ``max_bytes``; los lectores terminan de leer el archivo viejo por su
+    descriptor abierto antes de pasar al nuevo.
+    """
+
+    def __init__(self, path, poll_interval=0.1, max_bytes=4 << 20):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self._sender = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self.path.touch()
+        self._file = open(self.path, 'rb')
+        self._file.seek(0, os.SEEK_END)
+        self._thread = threading.Thread(target=self._run, name=f"bus-{self.path.parent.name}", daemon=True)
+        self._thread.start()
+
+    def publish(self, keys):
+        line = json.dumps([self._sender, list(keys)]).encode() + b'\n'
+        # O_APPEND: cada línea corta llega entera aunque escriban varios procesos
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, line)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        with open(self.path.with_suffix('.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Sin flock, si dos procesos rotan a la vez el segundo casi
+            # siempre encuentra el archivo nuevo, chico, y no lo toca
+            try:
+                if self.path.stat().st_size > self.max_bytes:
+                    os.replace(self.path, self.path.with_suffix('.1'))
+            except FileNotFoundError:
+                pass
+
+    def _read_new(self, pending):
+        data = pending + self._file.read()
+        *lines, rest = data.split(b'\n')
+        for line in lines:
+            try:
+                sender, keys = json.loads(line)
+            except ValueError:
+                continue
+            if sender != self._sender:
+                self._deliver(keys)
+        return rest
+
+    def _run(self):
+        pending = b''
+        while not self._stop.wait(self.poll_interval):
+            try:
+                pending = self._read_new(pending)
+                try:
+                    rotated = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+                except FileNotFoundError:
+                    rotated = True
+                if rotated:
+                    pending = self._read_new(pending)
+                    self._file.close()
+                    self.path.touch()
+                    self._file = open(self.path, 'rb')
+                    pending = b''
+            except OSError:
+                metrics.inc('bus_broker_errors_total')
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._file.close()
+
+
+def create_bus(directory, mode=None):
+    """Bus de una sala según ``AULA_BUS`` (``None`` si está desactivado)"""
+    mode = mode or os.environ.get('AULA_BUS', 'local')
+    if mode == 'off':
+        return None
+    if mode == 'local':
+        return UpdateBus()
+    if mode == 'file':
+        return UpdateBus(FileBroker(Path(directory) / "events.log"))
+    raise ValueError(f"Modo de bus desconocido: {mode}")
@@ -0,0 +1,81 @@
+"""Archivo histórico del chat en segmentos comprimidos e inmutables.
+
+Los mensajes que salen de la ventana caliente se escriben en archivos
+``<primer offset>-<último offset>.jsonl.gz`` (una línea ``[offset, mensaje]``
+por mensaje). Cada segmento se escribe en un temporal y se publica con
+``os.replace``, y nunca se vuelve a modificar. Leerlos no pasa por el camino
+en vivo del chat: solo se abren cuando el maestro los consulta o exporta.
+"""
+import gzip
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+class ChatArchive:
+    """Directorio de segmentos archivados del chat"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def write_segment(self, entries):
+        """Archivar una lista de pares (offset, mensaje) como un segmento nuevo"""
+        if not entries:
+            return None
+        name = f"{entries[0][0]:012d}-{entries[-1][0]:012d}.jsonl.gz"
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                for offset, message in entries:
+                    f.write(json.dumps([offset, message]).encode() + b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp_path, self.directory / name)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return name
+
+    def segments(self):
+        """Metadatos de los segmentos, del más antiguo al más reciente"""
+        result = []
+        for path in sorted(self.directory.glob("*.jsonl.gz")):
+            first, last = path.name[:-len(".jsonl.gz")].split("-")
+            stat = path.stat()
+            result.append({
+                'name': path.name,
+                'first': int(first),
+                'last': int(last),
+                'bytes': stat.st_size,
+                'archived_at': stat.st_mtime,
+            })
+        return result
+
+    def _path(self, name):
+        path = self.directory / Path(name).name
+        if not path.name.endswith(".jsonl.gz") or not path.exists():
+            raise FileNotFoundError(name)
+        return path
+
+    def read_segment(self, name, limit=None):
+        """Pares (offset, mensaje) de un segmento, leyendo solo ese archivo"""
+        entries = []
+        with gzip.open(self._path(name), 'rt') as f:
+            for line in f:
+                offset, message = json.loads(line)
+                entries.append((offset, message))
+                if limit is not None and len(entries) >= limit:
+                    break
+        return entries
+
+    def segment_bytes(self, name):
+        """Contenido comprimido de un segmento, para descargarlo tal cual"""
+        return self._path(name).read_bytes()
+
+    def export_all(self):
+        """Todos los segmentos como un único .jsonl.gz (gzip multi-miembro)"""
+        return b"".join(
+            (self.directory / segment['name']).read_bytes() for segment in self.segments()
+        )
@@ -0,0 +1,121 @@
+"""Índice invertido del chat en vivo de una sala para la búsqueda del maestro.
+
+Se construye la primera vez que el maestro busca y desde entonces se
+mantiene al día como listener del backend: cada mensaje enviado agrega su
+offset a la lista de cada palabra que contiene y a la de su autor, en
+``array`` ordenados porque los offsets solo crecen. Buscar es intersectar
+las listas de las palabras pedidas (empezando por la más corta), así que no
+depende de cuántos mensajes hay sino de cuántos contienen esas palabras.
+
+Los mensajes archivados o borrados salen del índice: los archivados se
+descartan al avanzar el primer offset disponible y un borrado (o un
+reinicio de la sala) hace que se reconstruya en la siguiente búsqueda.
+"""
+import re
+import threading
+import unicodedata
+from array import array
+
+from bus import ALL
+from storage import CHAT_DELETED_KEY, CHAT_KEY
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Palabras normalizadas (minúsculas y sin tildes) de un texto"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().lower()
+    return set(_WORD.findall(text))
+
+
+class ChatIndex:
+    """Palabra -> offsets y autor -> offsets de los mensajes en vivo"""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}  # {palabra: array de offsets}
+        self._by_user = {}  # {autor: array de offsets}
+        self._messages = {}  # {offset: mensaje}
+        self._next = 0  # siguiente offset por indexar
+        self._first = 0  # primer offset todavía en vivo
+        self._stale = 0  # offsets archivados que siguen en las listas
+
+    # Listener del backend
+    def changed(self, keys):
+        if ALL in keys or CHAT_DELETED_KEY in keys:
+            with self._lock:
+                self._built = False
+                self._reset()
+        elif CHAT_KEY in keys and self._built:
+            self.catch_up()
+
+    def persisted(self, keys):
+        pass
+
+    def _add(self, offset, message):
+        self._messages[offset] = message
+        for word in tokenize(message.get('text', '')):
+            self._postings.setdefault(word, array('q')).append(offset)
+        self._by_user.setdefault(message.get('user', ''), array('q')).append(offset)
+
+    def catch_up(self):
+        """Indexar los mensajes nuevos (todos, la primera vez)"""
+        with self._lock:
+            if not self._built:
+                self._reset()
+                self._built = True
+                entries = self.store.read_messages()
+            else:
+                entries = self.store.read_messages(after=self._next - 1)
+            for offset, message in entries:
+                if offset >= self._next:
+                    self._add(offset, message)
+                    self._next = offset + 1
+            first = self.store.message_bounds()[0]
+            if first > self._first:
+                for offset in [offset for offset in self._messages if offset < first]:
+                    del self._messages[offset]
+                    self._stale += 1
+                self._first = first
+                if self._stale > len(self._messages):
+                    self._compact()
+
+    def _compact(self):
+        """Rehacer las listas sin los offsets archivados (en memoria)"""
+        messages = self._messages
+        self._postings, self._by_user, self._messages = {}, {}, {}
+        for offset, message in messages.items():
+            self._add(offset, message)
+        self._stale = 0
+
+    def search(self, query='', user=None, limit=200):
+        """Pares (offset, mensaje) que contienen todas las palabras de
+        ``query`` (y son de ``user``), del más nuevo al más viejo"""
+        self.catch_up()
+        with self._lock:
+            lists = [self._postings.get(word, ()) for word in tokenize(query)]
+            if user is not None:
+                lists.append(self._by_user.get(user, ()))
+            if not lists or not all(lists):
+                return []
+            lists.sort(key=len)
+            matches = set(lists[0])
+            for offsets in lists[1:]:
+                matches.intersection_update(offsets)
+            live = sorted((offset for offset in matches if offset in self._messages), reverse=True)
+            return [(offset, self._messages[offset]) for offset in live[:limit]]
+
+    def authors(self):
+        """Autores con mensajes en vivo y cuántos tiene cada uno"""
+        self.catch_up()
+        with self._lock:
+            counts = {
+                user: sum(1 for offset in offsets if offset in self._messages)
+                for user, offsets in self._by_user.items()
+            }
+        return sorted(((user, count) for user, count in counts.items() if count), key=lambda item: item[0].lower())
@@ -0,0 +1,103 @@
+"""Render del chat como un único bloque HTML.
+
+Cada mensaje se convierte a HTML una sola vez por proceso (el texto del
+usuario se escapa) y se guarda por offset en una caché LRU compartida por
+todas las sesiones. La ventana visible se arma concatenando esos fragmentos
+y se envía en un solo ``st.markdown``, en lugar de un elemento por mensaje.
+
+Esa ventana es la misma para todas las sesiones de una sala: ``LiveChatView``
+la arma una vez por versión del chat (agregando solo lo nuevo a la anterior)
+y las sesiones no guardan copias, solo hasta dónde llegaron.
+"""
+import html
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+def message_html(message):
+    """HTML de un mensaje con los datos del usuario escapados"""
+    # Verificar si el mensaje tiene el campo 'type', si no, asignar 'estudiante' por defecto
+    msg_type = message.get('type', 'estudiante')
+    msg_class = "teacher-message" if msg_type == "maestro" else "chat-message"
+    badge_class = "teacher-badge" if msg_type == "maestro" else "student-badge"
+    role_emoji = "👨‍🏫" if msg_type == "maestro" else "👨‍🎓"
+    user = html.escape(str(message.get('user', '')))
+    sent_at = html.escape(str(message.get('time', '')))
+    # Sin líneas en blanco: todo el bloque debe seguir siendo un solo bloque HTML
+    text = html.escape(str(message.get('text', ''))).replace("\n", "<br>")
+    return (
+        f'<div class="chat-message {msg_class}">'
+        f"<span class='user-badge {badge_class}'>{role_emoji}</span> "
+        f"<strong>{user}</strong> <small>{sent_at}</small><br>{text}"
+        f"</div>"
+    )
+
+
+class MessageHtmlCache:
+    """HTML ya renderizado por offset de mensaje, con desalojo LRU"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, offset, message):
+        with self._lock:
+            fragment = self._entries.get(offset)
+            if fragment is not None:
+                self._entries.move_to_end(offset)
+                return fragment
+        fragment = message_html(message)
+        with self._lock:
+            self._entries[offset] = fragment
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def render(self, entries):
+        """Un solo bloque HTML para una lista de pares (offset, mensaje)"""
+        return "\n".join(self.get(offset, message) for offset, message in entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LiveChatView:
+    """Últimos mensajes del chat de una sala y su HTML, compartidos por versión"""
+
+    def __init__(self, store, html_cache):
+        self.store = store
+        self.html_cache = html_cache
+        self._view = None
+        self._lock = threading.Lock()
+
+    def get(self, version, deleted_version, window):
+        """Vista ``{'tail', 'html', 'first'}`` de la versión pedida (compartida:
+        no modificar); con otra ``deleted_version`` se relee la ventana entera"""
+        key = (version, window)
+        view = self._view
+        if view is not None and view['key'] == key:
+            metrics.inc('view_builds_total', view='chat', result='reused')
+            return view
+        with self._lock:
+            view = self._view
+            if view is not None and view['key'] == key:
+                return view
+            first = self.store.message_bounds()[0]
+            previous = view['tail'] if view is not None and view['deleted'] == deleted_version else ()
+            tail = [entry for entry in previous if entry[0] >= first]
+            last_offset = tail[-1][0] if tail else None
+            tail.extend(self.store.read_messages(after=last_offset, limit=window))
+            tail = tuple(tail[-window:])
+            view = self._view = {
+                'key': key,
+                'deleted': deleted_version,
+                'tail': tail,
+                'html': self.html_cache.render(tail),
+                'first': tail[0][0] if tail else self.store.message_bounds()[1],
+            }
+            metrics.inc('view_builds_total', view='chat', result='rebuilt')
+        return view
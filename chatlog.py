@@ -0,0 +1,188 @@
+"""Log de chat append-only en segmentos JSONL.
+
+Cada segmento es un par de archivos nombrados por el offset de su primer
+mensaje:
+
+* ``000000000000.jsonl``: un mensaje JSON por línea.
+* ``000000000000.idx``: la posición en bytes de cada línea, 8 bytes por
+  mensaje. Es el índice que permite saltar directo al offset pedido.
+
+Enviar un mensaje es un append a cada archivo (O(1)) y leer "lo nuevo desde
+el offset N" solo toca los bytes posteriores a N, sin importar lo largo que
+sea el historial.
+
+Borrar un mensaje (moderación) reescribe en su lugar solo su línea con un
+marcador del mismo largo; las lecturas lo saltean y el resto del log y los
+índices no cambian.
+"""
+import bisect
+import json
+import struct
+import threading
+from pathlib import Path
+
+import metrics
+
+_POSITION = struct.Struct('<Q')
+
+# Marcador de un mensaje borrado (se completa con espacios hasta el largo original)
+_DELETED = b'{"_deleted":1}'
+
+
+class SegmentedChatLog:
+    """Log de mensajes con offsets globales crecientes"""
+
+    def __init__(self, directory, segment_size=1000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self._lock = threading.RLock()
+        self._segments = sorted(
+            int(path.stem) for path in self.directory.glob("*.jsonl")
+        )
+        if not self._segments:
+            self._create_segment(0)
+
+    def _jsonl(self, start):
+        return self.directory / f"{start:012d}.jsonl"
+
+    def _idx(self, start):
+        return self.directory / f"{start:012d}.idx"
+
+    def _create_segment(self, start):
+        self._jsonl(start).touch()
+        self._idx(start).touch()
+        self._segments.append(start)
+
+    def _count(self, start):
+        try:
+            return self._idx(start).stat().st_size // _POSITION.size
+        except FileNotFoundError:
+            return 0
+
+    def bounds(self):
+        """(primer offset disponible, siguiente offset a asignar)"""
+        with self._lock:
+            last = self._segments[-1]
+            return self._segments[0], last + self._count(last)
+
+    def append(self, message):
+        """Agregar un mensaje al final del log y devolver su offset"""
+        line = json.dumps(message).encode() + b'\n'
+        with self._lock:
+            start = self._segments[-1]
+            count = self._count(start)
+            if count >= self.segment_size:
+                start += count
+                count = 0
+                self._create_segment(start)
+            # Primero el dato y después el índice: si el proceso muere entre
+            # ambos, la línea huérfana simplemente nunca se indexa
+            with open(self._jsonl(start), 'ab') as f:
+                position = f.seek(0, 2)
+                f.write(line)
+            with open(self._idx(start), 'ab') as f:
+                f.write(_POSITION.pack(position))
+        metrics.inc('shared_data_bytes_written_total', len(line) + _POSITION.size, key='messages')
+        return start + count
+
+    def read(self, after=None, limit=None, before=None):
+        """Mensajes con offset entre ``after`` y ``before`` (como máximo los ``limit`` más recientes)"""
+        with self._lock:
+            first, end = self.bounds()
+            if before is not None:
+                end = min(end, before)
+            begin = first if after is None else max(after + 1, first)
+            if limit is not None:
+                begin = max(begin, end - limit)
+            if begin >= end:
+                return []
+            segments = list(self._segments)
+
+        entries = []
+        i = bisect.bisect_right(segments, begin) - 1
+        for start in segments[i:]:
+            if start >= end:
+                break
+            entries.extend(self._read_segment(start, max(begin - start, 0), end - start))
+        return entries
+
+    def _read_segment(self, start, first_line, stop_line):
+        with open(self._idx(start), 'rb') as f:
+            f.seek(first_line * _POSITION.size)
+            raw = f.read((stop_line - first_line) * _POSITION.size)
+        positions = [p for (p,) in _POSITION.iter_unpack(raw)]
+        if not positions:
+            return []
+        with open(self._jsonl(start), 'rb') as f:
+            f.seek(positions[0])
+            data = f.read()
+        metrics.inc('shared_data_bytes_read_total', len(raw) + len(data), key='messages')
+        entries = []
+        for line_no, position in enumerate(positions, start=first_line):
+            rel = position - positions[0]
+            message = json.loads(data[rel:data.index(b'\n', rel)])
+            if '_deleted' not in message:
+                entries.append((start + line_no, message))
+        return entries
+
+    def delete(self, offsets):
+        """Tachar mensajes en su lugar; devuelve cuántos se borraron"""
+        deleted = 0
+        with self._lock:
+            for offset in sorted(set(offsets)):
+                i = bisect.bisect_right(self._segments, offset) - 1
+                if i < 0:
+                    continue
+                start = self._segments[i]
+                line_no = offset - start
+                if line_no >= self._count(start):
+                    continue
+                with open(self._idx(start), 'rb') as f:
+                    f.seek(line_no * _POSITION.size)
+                    position, = _POSITION.unpack(f.read(_POSITION.size))
+                with open(self._jsonl(start), 'r+b') as f:
+                    f.seek(position)
+                    length = len(f.readline()) - 1
+                    if length < len(_DELETED):
+                        continue
+                    f.seek(position)
+                    f.write(_DELETED.ljust(length))
+                deleted += 1
+        return deleted
+
+    def sealed_segments(self, before):
+        """Segmentos cerrados cuyos mensajes son todos anteriores a ``before``"""
+        with self._lock:
+            return [
+                start for start, next_start in zip(self._segments, self._segments[1:])
+                if next_start <= before
+            ]
+
+    def read_segment(self, start):
+        with self._lock:
+            position = self._segments.index(start)
+            if position + 1 < len(self._segments):
+                stop = self._segments[position + 1] - start
+            else:
+                stop = self._count(start)
+        return self._read_segment(start, 0, stop)
+
+    def drop_segment(self, start):
+        """Borrar un segmento cerrado (nunca el activo)"""
+        with self._lock:
+            if start == self._segments[-1]:
+                raise ValueError("No se puede borrar el segmento activo")
+            self._segments.remove(start)
+            self._jsonl(start).unlink(missing_ok=True)
+            self._idx(start).unlink(missing_ok=True)
+
+    def clear(self):
+        """Vaciar el log conservando la numeración de offsets"""
+        with self._lock:
+            _, end = self.bounds()
+            for start in self._segments:
+                self._jsonl(start).unlink(missing_ok=True)
+                self._idx(start).unlink(missing_ok=True)
+            self._segments = []
+            self._create_segment(end)
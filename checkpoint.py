@@ -0,0 +1,250 @@
+"""Checkpoints binarios y journal de una sala para reanudar tras una caída.
+
+El backend ya guarda encuestas, votos y chat de forma duradera, pero parte
+del estado de la clase vive en memoria (la presencia, los conteos compactos)
+o tarda en llegar a disco (las escrituras diferidas). Cada sala guarda:
+
+* ``state.snap``: un snapshot consistente cada ``AULA_CHECKPOINT_SECONDS``
+  (30 por defecto; 0 lo desactiva) con la presencia, las encuestas abiertas
+  y sus conteos, el link del stream y la cola del chat. Formato: cabecera
+  ``MAGIC`` + CRC32 + largo, y el estado en JSON comprimido con zlib. Se
+  escribe en un temporal con fsync y ``os.replace``; el anterior queda como
+  ``state.snap.1`` por si el último no pasa la verificación.
+* ``state.journal``: los cambios desde ese snapshot (entradas y salidas de
+  estudiantes, votos, encuestas y link), un registro por línea binaria
+  ``largo + CRC32 + JSON``. Un registro cortado por la caída no pasa el CRC
+  y la reproducción se detiene ahí.
+
+Los registros fijan valores (quién votó qué, quién está conectado), así que
+reproducir dos veces el mismo cambio no lo duplica. Al abrir la sala se
+carga el snapshot, se le aplica el journal y el resultado completa lo que le
+falte al backend.
+"""
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import metrics
+from bus import ALL
+
+MAGIC = b'AULASNP1'
+_HEADER = struct.Struct('>8sII')  # magic, crc32, largo
+_RECORD = struct.Struct('>II')  # largo, crc32
+
+DEFAULT_INTERVAL = 30.0
+
+# Mensajes del chat que se guardan para recalentar el HTML al reanudar
+CHAT_TAIL = 50
+
+
+def empty_state():
+    """Estado vacío: ``tallies`` es ``{poll_id: {user_id: etiquetas}}``"""
+    return {'presence': {}, 'polls': [], 'tallies': {}, 'vdo_link': None, 'chat_tail': []}
+
+
+def apply_record(state, record):
+    """Aplicar un registro del journal al estado (idempotente)"""
+    kind = record.get('k')
+    if kind == 'join':
+        state['presence'][record['user_id']] = [record['username'], record['at']]
+    elif kind == 'expire':
+        for user_id in record['user_ids']:
+            state['presence'].pop(user_id, None)
+    elif kind == 'vote':
+        # Un voto por estudiante: el primero que se registró es el que vale
+        voters = state['tallies'].setdefault(str(record['poll_id']), {})
+        voters.setdefault(record['user_id'], record['labels'])
+    elif kind == 'key':
+        state[record['key']] = record['value']
+    elif kind == 'clear':
+        state.clear()
+        state.update(empty_state())
+    return state
+
+
+def encode_snapshot(state):
+    payload = zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+    return _HEADER.pack(MAGIC, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_snapshot(data):
+    """Estado de un snapshot; ``ValueError`` si está incompleto o corrupto"""
+    if len(data) < _HEADER.size:
+        raise ValueError("snapshot incompleto")
+    magic, crc, length = _HEADER.unpack_from(data)
+    payload = data[_HEADER.size:_HEADER.size + length]
+    if magic != MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError("snapshot corrupto")
+    return json.loads(zlib.decompress(payload))
+
+
+def read_journal(data):
+    """Registros válidos del journal, hasta el primero cortado o corrupto"""
+    records = []
+    position = 0
+    while position + _RECORD.size <= len(data):
+        length, crc = _RECORD.unpack_from(data, position)
+        payload = data[position + _RECORD.size:position + _RECORD.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            metrics.inc('checkpoint_journal_torn_total')
+            break
+        records.append(json.loads(payload))
+        position += _RECORD.size + length
+    return records
+
+
+class Checkpointer:
+    """Snapshot periódico más journal de los cambios de una sala"""
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / "state.snap"
+        self.journal_path = self.directory / "state.journal"
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._fd = None
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Journal
+    def log(self, kind, **fields):
+        """Agregar un registro al journal (sin fsync: sobrevive a la caída del proceso)"""
+        payload = json.dumps({'k': kind, **fields}, separators=(',', ':')).encode()
+        record = _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            os.write(self._fd, record)
+            self._dirty = True
+        metrics.inc('checkpoint_journal_records_total', kind=kind)
+
+    # Snapshot
+    def save(self, capture):
+        """Escribir un snapshot con el estado de ``capture()`` y recortar el journal.
+
+        ``capture()`` corre sin el lock del journal (toma los locks del
+        backend, que a su vez anotan en el journal). Por eso se marca antes
+        hasta dónde llega el journal y al final solo se descarta esa parte:
+        los registros que llegaron mientras tanto se conservan y, como
+        reproducirlos es idempotente, no importa si el snapshot ya los incluye.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            mark = os.fstat(self._fd).st_size if self._fd is not None else 0
+            self._dirty = False
+        try:
+            self._write_snapshot(encode_snapshot(capture()), mark)
+        except BaseException:
+            # Lo anotado hasta la marca sigue en el journal: reintentar después
+            self._dirty = True
+            raise
+        metrics.observe('checkpoint_save_seconds', time.perf_counter() - start)
+
+    def _write_snapshot(self, data, mark):
+        """Reemplazar el snapshot (con fsync) y quitar del journal lo anterior a ``mark``"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                if self.path.exists():
+                    os.replace(self.path, self.path.with_suffix('.snap.1'))
+                os.replace(tmp_path, self.path)
+                if self._fd is not None:
+                    tail = b''
+                    if os.fstat(self._fd).st_size > mark:
+                        with open(self.journal_path, 'rb') as journal:
+                            journal.seek(mark)
+                            tail = journal.read()
+                    os.ftruncate(self._fd, 0)
+                    if tail:
+                        os.write(self._fd, tail)
+        finally:
+            Path(tmp_path).unlink(missing_ok=True)
+        metrics.registry.set_gauge('checkpoint_bytes', len(data))
+
+    def load(self):
+        """Último estado bueno (snapshot + journal), o ``None`` si no hay nada guardado"""
+        start = time.perf_counter()
+        state = None
+        for path in (self.path, self.path.with_suffix('.snap.1')):
+            try:
+                state = decode_snapshot(path.read_bytes())
+                break
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                metrics.inc('checkpoint_corrupt_total')
+        try:
+            records = read_journal(self.journal_path.read_bytes())
+        except FileNotFoundError:
+            records = []
+        if state is None and not records:
+            return None
+        state = state or empty_state()
+        for record in records:
+            apply_record(state, record)
+        metrics.observe('checkpoint_load_seconds', time.perf_counter() - start)
+        return state
+
+    # Volcado periódico
+    def start(self, capture):
+        """Guardar un snapshot cada ``interval`` segundos si hubo cambios"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._capture = capture
+        self._thread = threading.Thread(
+            target=self._run, name=f"checkpoint-{self.directory.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._dirty:
+                try:
+                    self.save(self._capture)
+                except Exception:
+                    metrics.inc('checkpoint_errors_total')
+
+    def close(self, capture=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if capture is not None and self._dirty:
+            self.save(capture)
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class KeyJournal:
+    """Listener del backend que anota en el journal las claves del maestro"""
+
+    def __init__(self, checkpointer, store, keys=('polls', 'vdo_link')):
+        self.checkpointer = checkpointer
+        self.store = store
+        self.keys = keys
+
+    def changed(self, keys):
+        for key in keys:
+            if key == ALL:
+                self.checkpointer.log('clear')
+            elif key in self.keys:
+                self.checkpointer.log('key', key=key, value=self.store.get(key))
+
+    def persisted(self, keys):
+        pass
+
+
+def interval_from_env():
+    return float(os.environ.get('AULA_CHECKPOINT_SECONDS', DEFAULT_INTERVAL))
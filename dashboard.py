@@ -0,0 +1,79 @@
+"""Vista materializada del tablero de una sala.
+
+El sidebar del maestro y las encuestas de los estudiantes leen en cada tick
+un solo objeto pequeño: estudiantes activos, las encuestas abiertas con sus
+votos por opción y participación, el link del stream y el último offset del
+chat. ``Dashboard.snapshot`` solo comprueba contadores (presencia, bus o
+versiones del backend, versión de cada conteo) y rehace únicamente las
+partes que cambiaron; si nada cambió devuelve el mismo objeto.
+
+Los snapshots se comparten entre sesiones y no deben modificarse; ``seq``
+crece con cada snapshot nuevo y sirve como versión para las vistas.
+"""
+import threading
+
+import metrics
+from storage import CHAT_KEY
+
+
+class Dashboard:
+    """Snapshot del tablero de una sala, actualizado por partes"""
+
+    def __init__(self, room):
+        self.room = room
+        self._key = None
+        self._snapshot = None
+        self._entries = {}  # {poll_id: ((versión del conteo, estudiantes), entrada)}
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def _poll_entry(self, poll, students):
+        tally = self.room.polls.tally(poll)
+        key = (tally.version, students)
+        cached = self._entries.get(poll['id'])
+        if cached is not None and cached[0] == key and cached[1]['poll'] is poll:
+            return cached[1]
+        voters = tally.total_voters()
+        entry = {
+            'poll': poll,
+            'version': tally.version,
+            'voters': voters,
+            'results': tuple(tally.results()),
+            'participation': round(voters / students * 100, 1) if students else None,
+        }
+        self._entries[poll['id']] = (key, entry)
+        return entry
+
+    def snapshot(self):
+        room = self.room
+        students = room.presence.active_count()
+        shared_version = room.version('polls', 'vdo_link', CHAT_KEY)
+        open_polls = room.cache.get('polls') or []
+        tally_versions = tuple(room.polls.tally(poll).version for poll in open_polls)
+        key = (students, shared_version, tally_versions)
+        if key == self._key:
+            metrics.inc('dashboard_snapshots_total', result='reused')
+            return self._snapshot
+        with self._lock:
+            if key != self._key:
+                entries = tuple(self._poll_entry(poll, students) for poll in open_polls)
+                open_ids = {poll['id'] for poll in open_polls}
+                for poll_id in [poll_id for poll_id in self._entries if poll_id not in open_ids]:
+                    del self._entries[poll_id]
+                self._seq += 1
+                self._snapshot = {
+                    'seq': self._seq,
+                    'students': students,
+                    'polls': entries,
+                    'vdo_link': room.cache.get('vdo_link', '') or '',
+                    'chat_end': room.store.message_bounds()[1],
+                }
+                self._key = key
+                metrics.inc('dashboard_snapshots_total', result='rebuilt')
+            return self._snapshot
+
+    def reset(self):
+        with self._lock:
+            self._key = None
+            self._snapshot = None
+            self._entries.clear()
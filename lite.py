@@ -0,0 +1,481 @@
+"""Modo liviano para estudiantes: HTTP/JSON y SSE fuera de los reruns de Streamlit.
+
+Cada estudiante en la app mantiene una sesión de Streamlit completa, que
+relanza todo el script, reinyecta el CSS y el iframe y mantiene sus propios
+timers. Para los que solo miran el stream y de vez en cuando votan, este
+servidor (solo biblioteca estándar, un hilo por conexión) atiende sobre las
+mismas salas (``RoomRegistry``) que la app:
+
+* ``GET /lite/<sala>``: página mínima con el stream, las encuestas y el chat.
+* ``GET /lite/<sala>/state?student=<nombre>``: encuestas abiertas con sus
+  resultados, link del stream, cola del chat y las respuestas propias, en JSON.
+* ``GET /lite/<sala>/events?student=<nombre>``: el mismo JSON como
+  Server-Sent Events cada vez que algo cambia (con el bus de la sala la
+  conexión espera sin sondear) y un comentario cada ``KEEPALIVE`` segundos
+  que a la vez es el heartbeat de presencia.
+* ``POST /lite/<sala>/vote`` con ``{"student", "poll_id", "answer"}`` y
+  ``POST /lite/<sala>/chat`` con ``{"student", "text"}``: pasan por los mismos
+  límites de envío, presencia, conteos y journal que la app.
+
+La parte compartida del estado se serializa una vez por versión del tablero
+y se reutiliza para todos los visores; por estudiante solo se agregan sus
+respuestas.
+
+Con ``AULA_LITE_PORT`` la app lo levanta en un hilo de su propio proceso
+(estado compartido en memoria). También corre aparte con ``python lite.py``,
+pero solo con ``AULA_STORAGE=sqlite`` y ``AULA_BUS=file``, y la app tiene que
+usar lo mismo: las versiones de las vistas salen del bus, así que con el bus
+local ningún proceso ve nunca lo que escribe el otro (no es cuestión de
+demora). ``main`` no arranca con otra configuración.
+
+Aun así, aparte tiene sus limitaciones: la presencia es propia de cada
+proceso (la app no ve a los estudiantes del modo liviano como conectados ni
+al revés), y los checkpoints y la serie de participación quedan a cargo de
+la app, así que este proceso no los escribe ni los usa para reanudar.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+import rooms
+from storage import CHAT_DELETED_KEY, CHAT_KEY
+
+DEFAULT_PORT = 8502
+
+# Segundos entre comentarios de una conexión SSE sin cambios (menos que el
+# TTL de presencia: también mantienen al estudiante como conectado)
+KEEPALIVE = 10.0
+
+# Sin bus de cambios, cada cuánto una conexión SSE vuelve a comparar versiones
+POLL_INTERVAL = 2.0
+
+MAX_BODY = 4096
+MAX_NAME = 40
+MAX_MESSAGE = 500
+
+_ROUTE = re.compile(r'/lite/([^/]+)(?:/(state|events|vote|chat))?/?')
+
+# Claves de la sala que cambian lo que ve un estudiante
+_WATCHED = ('polls', 'vdo_link', CHAT_KEY, CHAT_DELETED_KEY)
+
+
+class LiteError(Exception):
+    """Petición rechazada, con su código HTTP"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def student_name(raw):
+    """Nombre del estudiante recortado; ``LiteError`` si falta o es muy largo"""
+    name = (raw or '').strip()
+    if not name or len(name) > MAX_NAME:
+        raise LiteError(HTTPStatus.BAD_REQUEST, f"Nombre de estudiante requerido (hasta {MAX_NAME} caracteres)")
+    return name
+
+
+class LiteApp:
+    """Estado y escrituras del modo liviano sobre las salas del proceso"""
+
+    def __init__(self, registry, chat_window=50, hot_window=2000):
+        self.registry = registry
+        self.chat_window = chat_window
+        self.hot_window = hot_window
+        self._shared = {}  # {sala: (versión, JSON compartido)}
+        self._lock = threading.Lock()
+        self.streams = 0
+
+    def room(self, raw_room_id):
+        room_id = rooms.normalize_room_id(raw_room_id)
+        if room_id is None:
+            raise LiteError(HTTPStatus.NOT_FOUND, "Sala inválida")
+        return self.registry.get(room_id)
+
+    def join(self, room, raw_name):
+        """Heartbeat del estudiante (lo registra si es nuevo); devuelve (nombre, user_id)"""
+        name = student_name(raw_name)
+        user_id = rooms.user_id_for(name, "estudiante")
+        room.presence.touch(user_id, name)
+        return name, user_id
+
+    # Lecturas
+    def shared(self, room):
+        """JSON de lo que ven todos los estudiantes de la sala, una vez por versión"""
+        snapshot = room.dashboard.snapshot()
+        version = (snapshot['seq'], room.version(CHAT_DELETED_KEY))
+        cached = self._shared.get(room.room_id)
+        if cached is not None and cached[0] == version:
+            metrics.inc('lite_state_builds_total', result='reused')
+            return cached[1]
+        state = {
+            'room': room.room_id,
+            'students': snapshot['students'],
+            'vdo_link': snapshot['vdo_link'],
+            'polls': [{
+                'id': entry['poll']['id'],
+                'question': entry['poll']['question'],
+                'kind': entry['poll'].get('kind', 'choice'),
+                'options': entry['poll'].get('options', []),
+                'range': entry['poll'].get('range'),
+                'timestamp': entry['poll']['timestamp'],
+                'voters': entry['voters'],
+                'results': entry['results'],
+            } for entry in snapshot['polls']],
+            'chat': [
+                {'offset': offset, **message}
+                for offset, message in room.chat_view.get(
+                    room.version(CHAT_KEY, CHAT_DELETED_KEY), room.version(CHAT_DELETED_KEY), self.chat_window
+                )['tail']
+            ],
+        }
+        data = json.dumps(state, separators=(',', ':')).encode()
+        with self._lock:
+            self._shared[room.room_id] = (version, data)
+        metrics.inc('lite_state_builds_total', result='rebuilt')
+        return data
+
+    def state(self, room, user_id):
+        """Estado compartido más las respuestas propias, en un solo objeto JSON"""
+        shared = self.shared(room)
+        votes = {}
+        for poll in room.cache.get('polls') or []:
+            vote = room.polls.tally(poll).vote_of(user_id)
+            if vote is not None:
+                votes[str(poll['id'])] = vote
+        mine = json.dumps({'user_id': user_id, 'votes': votes}, separators=(',', ':')).encode()
+        # Se agrega "me" al objeto compartido sin volver a serializarlo
+        return b'{"me":' + mine + b',' + shared[1:]
+
+    def wait(self, room, since, timeout):
+        """Esperar un cambio de la sala (o ``timeout``); devuelve la nueva versión"""
+        keys = self.watched_keys(room)
+        if room.bus is not None:
+            return room.bus.wait(keys, since, timeout)
+        time.sleep(min(POLL_INTERVAL, timeout))
+        return room.version(*keys)
+
+    @staticmethod
+    def watched_keys(room):
+        return _WATCHED + tuple(f"tally_{poll['id']}" for poll in room.cache.get('polls') or [])
+
+    # Escrituras
+    def _allow(self, room, action, user_id):
+        allowed, wait = room.limiter.check(action, user_id)
+        if not allowed:
+            raise LiteError(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                f"Vas demasiado rápido: espera {max(wait, 1):.0f}s e inténtalo de nuevo",
+                retry_after=max(int(wait + 0.999), 1)
+            )
+
+    def vote(self, room, user_id, poll_id, answer):
+        poll = next((p for p in room.cache.get('polls') or [] if p['id'] == poll_id), None)
+        if poll is None:
+            raise LiteError(HTTPStatus.NOT_FOUND, "La encuesta ya no está abierta")
+        if answer is None:
+            raise LiteError(HTTPStatus.BAD_REQUEST, "Falta la respuesta")
+        self._allow(room, 'vote', user_id)
+        try:
+            accepted = room.polls.vote(poll, user_id, answer)
+        except (TypeError, ValueError) as e:
+            raise LiteError(HTTPStatus.BAD_REQUEST, str(e))
+        if not accepted:
+            raise LiteError(HTTPStatus.CONFLICT, "Ya habías votado en esta encuesta")
+        return {'accepted': True, 'vote': room.polls.tally(poll).vote_of(user_id)}
+
+    def chat(self, room, name, user_id, text):
+        text = str(text or '').strip()
+        if not text or len(text) > MAX_MESSAGE:
+            raise LiteError(HTTPStatus.BAD_REQUEST, f"Mensaje vacío o de más de {MAX_MESSAGE} caracteres")
+        self._allow(room, 'chat', user_id)
+        offset = room.store.append_message({
+            'user': name,
+            'type': "estudiante",
+            'text': text,
+            'time': datetime.now().strftime("%H:%M:%S")
+        })
+        room.store.rotate_messages(self.hot_window)
+        return {'offset': offset}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "AulaLite/1"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def lite(self):
+        return self.server.lite
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self):
+        url = urlsplit(self.path)
+        match = _ROUTE.fullmatch(url.path)
+        if match is None:
+            raise LiteError(HTTPStatus.NOT_FOUND, "Ruta desconocida")
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return self.lite.room(match.group(1)), match.group(2) or 'page', query
+
+    def _send(self, status, body, content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, separators=(',', ':')).encode())
+
+    def _handle(self, method):
+        route = 'unknown'
+        status = HTTPStatus.OK
+        start = time.perf_counter()
+        try:
+            room, route, query = self._route()
+            if method == 'GET' and route == 'page':
+                self._send(status, _PAGE, "text/html; charset=utf-8")
+            elif method == 'GET' and route == 'state':
+                _, user_id = self.lite.join(room, query.get('student'))
+                self._send(status, self.lite.state(room, user_id))
+            elif method == 'GET' and route == 'events':
+                name, user_id = self.lite.join(room, query.get('student'))
+                self._stream(room.room_id, name, user_id)
+            elif method == 'POST' and route in ('vote', 'chat'):
+                body = self._read_json()
+                name, user_id = self.lite.join(room, body.get('student'))
+                if route == 'vote':
+                    result = self.lite.vote(room, user_id, body.get('poll_id'), body.get('answer'))
+                else:
+                    result = self.lite.chat(room, name, user_id, body.get('text'))
+                self._send_json(status, result)
+            else:
+                raise LiteError(HTTPStatus.METHOD_NOT_ALLOWED, "Método no permitido")
+        except LiteError as e:
+            status = e.status
+            # El cuerpo puede haber quedado sin leer: no reutilizar la conexión
+            self.close_connection = True
+            headers = [("Retry-After", str(e.retry_after))] if e.retry_after else []
+            self._send(status, json.dumps({'error': str(e)}, separators=(',', ':')).encode(), headers=headers)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        metrics.inc('lite_requests_total', route=route, status=int(status))
+        if route != 'events':
+            metrics.observe('lite_request_seconds', time.perf_counter() - start, route=route)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise LiteError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Petición demasiado grande")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise LiteError(HTTPStatus.BAD_REQUEST, "JSON inválido")
+        if not isinstance(body, dict):
+            raise LiteError(HTTPStatus.BAD_REQUEST, "Se esperaba un objeto JSON")
+        return body
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _stream(self, room_id, name, user_id):
+        """Enviar el estado en cada cambio hasta que el cliente se desconecte"""
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("X-Accel-Buffering", "no")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        lite = self.lite
+        with lite._lock:
+            lite.streams += 1
+            metrics.registry.set_gauge('lite_streams_open', lite.streams)
+        try:
+            last = None
+            last_write = 0.0
+            while not self.server.stopping.is_set():
+                # Volver a pedir la sala en cada vuelta marca el acceso y la
+                # reabre si se cerró; el touch es el heartbeat de presencia
+                room = lite.registry.get(room_id)
+                room.presence.touch(user_id, name)
+                since = room.version(*lite.watched_keys(room))
+                data = lite.state(room, user_id)
+                now = time.monotonic()
+                if data != last:
+                    self.wfile.write(b'data: ' + data + b'\n\n')
+                    last = data
+                    last_write = now
+                    metrics.inc('lite_events_total')
+                elif now - last_write >= KEEPALIVE:
+                    self.wfile.write(b': keepalive\n\n')
+                    last_write = now
+                self.wfile.flush()
+                lite.wait(room, since, KEEPALIVE)
+        finally:
+            with lite._lock:
+                lite.streams -= 1
+                metrics.registry.set_gauge('lite_streams_open', lite.streams)
+
+
+class LiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, lite):
+        super().__init__(address, _Handler)
+        self.lite = lite
+        self.stopping = threading.Event()
+
+    def shutdown(self):
+        self.stopping.set()
+        super().shutdown()
+
+
+def start(registry, host="0.0.0.0", port=DEFAULT_PORT, **options):
+    """Levantar el servidor en un hilo; devuelve el ``LiteServer``"""
+    server = LiteServer((host, port), LiteApp(registry, **options))
+    threading.Thread(target=server.serve_forever, name="aula-lite", daemon=True).start()
+    return server
+
+
+# Página del modo liviano: todo el render ocurre en el navegador
+_PAGE = """<!doctype html>
+<html lang="es"><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Aula Virtual (liviana)</title>
+<style>
+body{font-family:sans-serif;margin:0 auto;max-width:900px;padding:8px}
+.stream{position:relative;padding-bottom:56.25%}
+.stream iframe{position:absolute;inset:0;width:100%;height:100%;border:0;border-radius:10px}
+.card{border:1px solid #ccc;border-radius:8px;padding:8px;margin:8px 0}
+.bar{background:#4caf50;height:8px;border-radius:4px}
+#chat{height:300px;overflow-y:auto;border:1px solid #ccc;border-radius:8px;padding:4px}
+.teacher{border-left:4px solid #2196f3;padding-left:4px}
+button{margin:2px}
+</style></head><body>
+<h2>🎓 Aula Virtual</h2>
+<form id="login"><input id="name" placeholder="Tu nombre" maxlength="40" required> <button>Ingresar</button></form>
+<div id="main" hidden>
+<div id="stream"></div><p id="status"></p>
+<h3>📊 Encuestas</h3><div id="polls"></div>
+<h3>💬 Chat</h3><div id="chat"></div>
+<form id="send"><input id="text" maxlength="500" placeholder="Escribe un mensaje..."> <button>Enviar</button></form>
+</div>
+<script>
+const base = location.pathname.replace(/\\/$/, "");
+const params = new URLSearchParams(location.search);
+let student = params.get("student"), link = null, source = null;
+const el = (tag, text, cls) => { const e = document.createElement(tag); if (text != null) e.textContent = text; if (cls) e.className = cls; return e; };
+function show(msg) { document.getElementById("status").textContent = msg || ""; }
+async function post(route, body) {
+  const r = await fetch(base + "/" + route, {method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify({student, ...body})});
+  const data = await r.json(); show(r.ok ? "" : data.error); return r.ok;
+}
+function render(state) {
+  if (state.vdo_link !== link) {
+    link = state.vdo_link; const box = document.getElementById("stream"); box.replaceChildren();
+    if (link) { const f = el("iframe"); f.src = link; f.allow = "autoplay; fullscreen"; const d = el("div", null, "stream"); d.append(f); box.append(d); }
+    else box.append(el("p", "👨‍🏫 El maestro aún no ha configurado el stream"));
+  }
+  const polls = document.getElementById("polls"); polls.replaceChildren();
+  if (!state.polls.length) polls.append(el("p", "No hay encuestas activas en este momento"));
+  for (const p of state.polls) {
+    const card = el("div", null, "card"); card.append(el("strong", p.question));
+    const mine = state.me.votes[String(p.id)];
+    if (mine) card.append(el("p", "✅ Ya respondiste: " + mine.join(", ")));
+    else if (p.kind === "choice" || p.kind === "truefalse") {
+      for (const o of p.options) { const b = el("button", o); b.onclick = () => post("vote", {poll_id: p.id, answer: o}); card.append(b); }
+    } else {
+      const f = el("form"), i = el("input"); i.required = true;
+      if (p.kind === "multi") i.placeholder = "Opciones separadas por coma: " + p.options.join(", ");
+      if (p.kind === "numeric") { i.type = "number"; i.step = "any"; i.min = p.range[0]; i.max = p.range[1]; }
+      f.append(i, el("button", "Enviar respuesta"));
+      f.onsubmit = e => { e.preventDefault(); const v = p.kind === "multi" ? i.value.split(",").map(s => s.trim()) : p.kind === "numeric" ? Number(i.value) : i.value; post("vote", {poll_id: p.id, answer: v}); };
+      card.append(f);
+    }
+    for (const [label, votes] of p.results) {
+      const pct = p.voters ? votes / p.voters * 100 : 0, bar = el("div", null, "bar"); bar.style.width = pct + "%";
+      card.append(el("div", label + ": " + votes + " (" + pct.toFixed(1) + "%)"), bar);
+    }
+    card.append(el("small", "Total de votantes: " + p.voters)); polls.append(card);
+  }
+  const chat = document.getElementById("chat"), atBottom = chat.scrollTop + chat.clientHeight >= chat.scrollHeight - 5;
+  chat.replaceChildren(...state.chat.map(m => { const d = el("div", null, m.type === "maestro" ? "teacher" : ""); d.append(el("strong", m.user + " "), el("small", m.time), el("div", m.text)); return d; }));
+  if (atBottom) chat.scrollTop = chat.scrollHeight;
+}
+function connect() {
+  document.getElementById("login").hidden = true; document.getElementById("main").hidden = false;
+  source = new EventSource(base + "/events?student=" + encodeURIComponent(student));
+  source.onmessage = e => render(JSON.parse(e.data));
+  source.onerror = () => show("Reconectando...");
+  source.onopen = () => show("");
+}
+document.getElementById("login").onsubmit = e => {
+  e.preventDefault(); student = document.getElementById("name").value.trim();
+  params.set("student", student); history.replaceState(null, "", "?" + params); connect();
+};
+document.getElementById("send").onsubmit = async e => {
+  e.preventDefault(); const t = document.getElementById("text");
+  if (t.value.trim() && await post("chat", {text: t.value})) t.value = "";
+};
+if (student) connect();
+</script></body></html>
+""".encode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default="0.0.0.0")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('AULA_LITE_PORT') or DEFAULT_PORT))
+    parser.add_argument('--data', default="shared_data", help="Directorio de datos compartido con la app")
+    args = parser.parse_args(argv)
+    backend = os.environ.get('AULA_STORAGE', 'sqlite')
+    bus_mode = os.environ.get('AULA_BUS', 'local')
+    if backend != 'sqlite' or bus_mode != 'file':
+        parser.error(
+            f"aparte de la app hace falta AULA_STORAGE=sqlite y AULA_BUS=file (en los dos procesos); "
+            f"ahora: AULA_STORAGE={backend}, AULA_BUS={bus_mode}"
+        )
+    registry = rooms.RoomRegistry(
+        Path(args.data),
+        idle_seconds=int(os.environ.get('AULA_ROOM_IDLE', 900)),
+        # Un solo proceso por sala escribe checkpoints y telemetría: la app
+        recovery=False
+    )
+    server = LiteServer((args.host, args.port), LiteApp(
+        registry,
+        chat_window=int(os.environ.get('AULA_CHAT_WINDOW', 50)),
+        hot_window=int(os.environ.get('AULA_CHAT_HOT', 2000))
+    ))
+    print(f"Modo liviano en http://{args.host}:{args.port}/lite/{rooms.DEFAULT_ROOM}")
+    print("Proceso aparte: presencia propia (no compartida con la app), sin checkpoints ni telemetría")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stopping.set()
+        server.server_close()
+        for room in registry.open_rooms():
+            room.close()
+
+
+if __name__ == '__main__':
+    main()
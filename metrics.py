@@ -0,0 +1,310 @@
+"""Instrumentación de los caminos calientes del aula.
+
+Un único ``registry`` por proceso acumula contadores y tiempos etiquetados
+(llamadas, bytes, latencias, fallos de parseo, ejecuciones de fragmentos).
+Se muestra en el panel del maestro y se exporta en formato de texto de
+Prometheus.
+
+``sessions`` lleva además el tamaño del ``session_state`` de cada sesión
+(medido al final de cada ejecución completa) para ver cuánta memoria cuesta
+cada estudiante conectado.
+
+Con ``AULA_METRICS=0`` los decoradores devuelven la función original y
+``inc``/``observe`` retornan de inmediato, así que el costo es prácticamente
+nulo.
+"""
+import contextlib
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = os.environ.get('AULA_METRICS', '1') != '0'
+
+_PREFIX = "aula_"
+
+
+def normalize_key(key):
+    """Quitar ids numéricos de las claves para no crear una serie por encuesta"""
+    return re.sub(r'_\d+$', '', key)
+
+
+class Registry:
+    """Contadores, gauges y tiempos agregados por nombre y etiquetas"""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}  # {(name, labels): [count, sum, max]}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _series(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if not ENABLED:
+            return
+        series = self._series(name, labels)
+        with self._lock:
+            self._counters[series] = self._counters.get(series, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._gauges[self._series(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        if not ENABLED:
+            return
+        series = self._series(name, labels)
+        with self._lock:
+            stats = self._timings.get(series)
+            if stats is None:
+                self._timings[series] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+    def snapshot(self):
+        """Copia de las series: (counters, gauges, timings)"""
+        with self._lock:
+            return (
+                dict(self._counters),
+                dict(self._gauges),
+                {series: tuple(stats) for series, stats in self._timings.items()}
+            )
+
+    def counter_total(self, name):
+        """Valor de ``name`` sumando todas sus etiquetas"""
+        with self._lock:
+            return sum(value for (series_name, _), value in self._counters.items() if series_name == name)
+
+    def timing_total(self, name):
+        """(llamadas, segundos) de ``name`` sumando todas sus etiquetas"""
+        count = total = 0
+        with self._lock:
+            for (series_name, _), stats in self._timings.items():
+                if series_name == name:
+                    count += stats[0]
+                    total += stats[1]
+        return count, total
+
+    def timing_rows(self):
+        """Filas legibles de los tiempos, ordenadas por tiempo total"""
+        _, _, timings = self.snapshot()
+        rows = []
+        for (name, labels), (count, total, maximum) in timings.items():
+            rows.append({
+                'métrica': name,
+                'etiquetas': ", ".join(f"{k}={v}" for k, v in labels),
+                'llamadas': count,
+                'media ms': round(total / count * 1000, 3),
+                'máx ms': round(maximum * 1000, 3),
+                'total s': round(total, 3),
+            })
+        rows.sort(key=lambda row: row['total s'], reverse=True)
+        return rows
+
+    def counter_rows(self):
+        counters, gauges, _ = self.snapshot()
+        rows = []
+        for (name, labels), value in {**counters, **gauges}.items():
+            rows.append({
+                'métrica': name,
+                'etiquetas': ", ".join(f"{k}={v}" for k, v in labels),
+                'valor': value,
+            })
+        rows.sort(key=lambda row: (row['métrica'], row['etiquetas']))
+        return rows
+
+    def render_prometheus(self):
+        """Volcado en formato de texto de Prometheus"""
+        counters, gauges, timings = self.snapshot()
+        lines = []
+
+        def labels_text(labels):
+            if not labels:
+                return ""
+            pairs = ",".join(f'{k}="{v}"' for k, v in labels)
+            return "{" + pairs + "}"
+
+        def emit(kind, series_values):
+            by_name = {}
+            for (name, labels), value in series_values.items():
+                by_name.setdefault(name, []).append((labels, value))
+            for name in sorted(by_name):
+                lines.append(f"# TYPE {_PREFIX}{name} {kind}")
+                for labels, value in sorted(by_name[name]):
+                    lines.append(f"{_PREFIX}{name}{labels_text(labels)} {value}")
+
+        emit('counter', counters)
+        emit('gauge', gauges)
+        by_name = {}
+        for (name, labels), stats in timings.items():
+            by_name.setdefault(name, []).append((labels, stats))
+        for name in sorted(by_name):
+            lines.append(f"# TYPE {_PREFIX}{name} summary")
+            for labels, (count, total, maximum) in sorted(by_name[name]):
+                text = labels_text(labels)
+                lines.append(f"{_PREFIX}{name}_count{text} {count}")
+                lines.append(f"{_PREFIX}{name}_sum{text} {total:.6f}")
+                lines.append(f"{_PREFIX}{name}_max{text} {maximum:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+def timed(name, **labels):
+    """Decorador que mide la duración de cada llamada"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def _timer(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def timer(name, **labels):
+    """Context manager que mide la duración de un bloque"""
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _timer(name, labels)
+
+
+def instrument_fragment(name):
+    """Contar ejecuciones de un fragmento, su duración y la causa del rerun.
+
+    La causa es ``fragment`` cuando Streamlit reejecuta solo el fragmento (por
+    ``run_every`` o por un widget interno) y ``script`` cuando corre dentro de
+    una ejecución completa de la app.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            from streamlit.runtime.scriptrunner import get_script_run_ctx
+            ctx = get_script_run_ctx()
+            cause = 'fragment' if ctx is not None and ctx.fragment_ids_this_run else 'script'
+            registry.inc('fragment_runs_total', fragment=name, cause=cause)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe('fragment_seconds', time.perf_counter() - start, fragment=name)
+        return wrapper
+    return decorator
+
+
+def deep_sizeof(obj, _seen=None):
+    """Bytes de ``obj`` y de todo lo que contiene (cada objeto cuenta una vez)"""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+class SessionFootprints:
+    """Último tamaño medido del estado de cada sesión; las que dejan de
+    medirse por ``ttl`` segundos se olvidan.
+
+    Cada medición cuesta O(1): el total se lleva al día, las sesiones están
+    ordenadas por su última medición (las vencidas salen del principio) y el
+    máximo solo se recalcula recorriendo todas cada ``rescan_every`` segundos
+    (mientras tanto puede quedar alto por una sesión que achicó o se fue).
+    """
+
+    def __init__(self, ttl=300, rescan_every=60):
+        self.ttl = ttl
+        self.rescan_every = rescan_every
+        # {id de sesión: (bytes, hora)}, de la medición más vieja a la más nueva
+        self._sizes = OrderedDict()
+        self._total = 0
+        self._max = 0
+        self._rescanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, session_id, nbytes, now=None):
+        if not ENABLED:
+            return
+        now = now or time.time()
+        with self._lock:
+            previous = self._sizes.pop(session_id, None)
+            if previous is not None:
+                self._total -= previous[0]
+            self._sizes[session_id] = (nbytes, now)
+            self._total += nbytes
+            while True:
+                key, (size, seen) = next(iter(self._sizes.items()))
+                if now - seen <= self.ttl:
+                    break
+                del self._sizes[key]
+                self._total -= size
+            if now - self._rescanned_at >= self.rescan_every:
+                self._rescanned_at = now
+                self._max = max(size for size, _ in self._sizes.values())
+            else:
+                self._max = max(self._max, nbytes)
+            count, total, largest = len(self._sizes), self._total, self._max
+        registry.set_gauge('sessions_measured', count)
+        registry.set_gauge('session_state_bytes_avg', total // count)
+        registry.set_gauge('session_state_bytes_max', largest)
+
+    def stats(self):
+        with self._lock:
+            count, total, largest = len(self._sizes), self._total, self._max
+        return {
+            'sessions': count,
+            'avg': total // count if count else 0,
+            'max': largest if count else 0,
+            'total': total,
+        }
+
+
+sessions = SessionFootprints()
@@ -0,0 +1,231 @@
+"""Historial de encuestas cerradas y sus votos, en formato columnar.
+
+Cada encuesta que se cierra (o que queda reemplazada por otra) se agrega a dos
+tablas append-only dentro del directorio de la sala:
+
+* ``polls``: una fila por encuesta (id, pregunta, opciones, lanzamiento,
+  cierre y estudiantes conectados al cerrarse).
+* ``votes``: una fila por voto (encuesta, estudiante, opción y segundos desde
+  el lanzamiento); en selección múltiple, una por cada opción marcada.
+
+Con ``pyarrow`` instalado cada cierre escribe un archivo Parquet pequeño y
+los archivos se compactan en uno solo cuando pasan de ``COMPACT_PARTS``; sin
+``pyarrow`` se usa un CSV por tabla al que solo se le agregan filas. Las
+tablas se cargan una vez por cambio en disco y las analíticas son
+operaciones de pandas sobre columnas, así que siguen siendo rápidas con
+miles de encuestas.
+"""
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+# Archivos Parquet por tabla a partir de los cuales se compactan en uno
+COMPACT_PARTS = 32
+
+POLL_SCHEMA = {
+    'poll_id': 'int64',
+    'question': 'object',
+    'options': 'object',
+    'launched_at': 'float64',
+    'closed_at': 'float64',
+    'students_present': 'int64',
+}
+VOTE_SCHEMA = {
+    'poll_id': 'int64',
+    'user_id': 'object',
+    'username': 'object',
+    'option': 'object',
+    'seconds': 'float64',
+}
+_SCHEMAS = {'polls': POLL_SCHEMA, 'votes': VOTE_SCHEMA}
+
+
+def _frame(rows, table):
+    schema = _SCHEMAS[table]
+    return pd.DataFrame(rows, columns=list(schema)).astype(schema)
+
+
+class PollHistory:
+    """Tablas de encuestas y votos de una sala"""
+
+    def __init__(self, directory, use_parquet=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.use_parquet = HAS_PARQUET if use_parquet is None else use_parquet
+        self._lock = threading.Lock()
+        self._frames = {}  # {tabla: (firma en disco, DataFrame)}
+        self._analytics = None  # (firma, resultado)
+        self._exports = {}  # {(tabla, formato): (firma, bytes)}
+
+    # Escritura
+    def record_poll(self, poll, vote_records, usernames=None, students_present=0, closed_at=None):
+        """Agregar una encuesta y sus votos; no hace nada si ya estaba registrada"""
+        usernames = usernames or {}
+        closed_at = time.time() if closed_at is None else closed_at
+        launched_at = poll.get('launched_at', poll['id'])
+        with self._lock:
+            if poll['id'] in self._poll_ids():
+                return False
+            polls = _frame([(
+                poll['id'],
+                poll.get('question', ''),
+                "|".join(poll.get('options', [])),
+                launched_at,
+                closed_at,
+                students_present,
+            )], 'polls')
+            votes = _frame([
+                (poll['id'], user_id, usernames.get(user_id, user_id), label, max(voted_at - launched_at, 0.0))
+                for user_id, option, voted_at in vote_records
+                for label in (option if isinstance(option, list) else [option])
+            ], 'votes')
+            # Primero los votos: una encuesta registrada siempre tiene sus votos
+            if len(votes):
+                self._append('votes', votes)
+            self._append('polls', polls)
+        return True
+
+    def _append(self, table, frame):
+        if self.use_parquet:
+            table_dir = self.directory / table
+            table_dir.mkdir(exist_ok=True)
+            self._write_parquet(table_dir, frame)
+            parts = sorted(table_dir.glob("*.parquet"))
+            if len(parts) > COMPACT_PARTS:
+                merged = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+                self._write_parquet(table_dir, merged)
+                for part in parts:
+                    part.unlink()
+        else:
+            path = self.directory / f"{table}.csv"
+            frame.to_csv(path, mode='a', header=not path.exists(), index=False)
+
+    @staticmethod
+    def _write_parquet(table_dir, frame):
+        fd, tmp_path = tempfile.mkstemp(dir=table_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, table_dir / f"part-{time.time_ns():020d}.parquet")
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    # Lectura
+    def _signature(self, table):
+        if self.use_parquet:
+            return tuple(
+                (path.name, path.stat().st_size)
+                for path in sorted((self.directory / table).glob("*.parquet"))
+            )
+        path = self.directory / f"{table}.csv"
+        return path.stat().st_size if path.exists() else 0
+
+    def load(self, table):
+        """DataFrame completo de ``polls`` o ``votes`` (compartido: no modificar)"""
+        signature = self._signature(table)
+        cached = self._frames.get(table)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        if not signature:
+            frame = _frame([], table)
+        elif self.use_parquet:
+            frame = pd.concat(
+                [pd.read_parquet(path) for path in sorted((self.directory / table).glob("*.parquet"))],
+                ignore_index=True
+            )
+        else:
+            frame = pd.read_csv(self.directory / f"{table}.csv", dtype=_SCHEMAS[table], keep_default_na=False)
+        self._frames[table] = (signature, frame)
+        return frame
+
+    def _poll_ids(self):
+        return set(self.load('polls')['poll_id'])
+
+    def poll_count(self):
+        return len(self.load('polls'))
+
+    # Analíticas
+    def analytics(self):
+        """Resúmenes por encuesta y por estudiante y la distribución de respuestas"""
+        signature = (self._signature('polls'), self._signature('votes'))
+        if self._analytics is not None and self._analytics[0] == signature:
+            return self._analytics[1]
+        result = summarize(self.load('polls'), self.load('votes'))
+        self._analytics = (signature, result)
+        return result
+
+    # Exportación
+    def export(self, table, fmt='csv'):
+        """Bytes de una tabla en ``csv`` o ``parquet``"""
+        signature = self._signature(table)
+        cached = self._exports.get((table, fmt))
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        frame = self.load(table)
+        if fmt == 'parquet':
+            buffer = io.BytesIO()
+            frame.to_parquet(buffer, index=False)
+            data = buffer.getvalue()
+        else:
+            data = frame.to_csv(index=False).encode()
+        self._exports[(table, fmt)] = (signature, data)
+        return data
+
+
+def summarize(polls, votes):
+    """Analíticas vectorizadas sobre las tablas del historial"""
+    per_poll = polls.set_index('poll_id')[['question', 'launched_at', 'students_present']].copy()
+    grouped = votes.groupby('poll_id')
+    per_poll['votos'] = grouped['user_id'].nunique().reindex(per_poll.index, fill_value=0)
+    present = per_poll['students_present'].where(per_poll['students_present'] > 0)
+    per_poll['participación %'] = (per_poll['votos'] / present * 100).round(1)
+    per_poll['p50 s'] = grouped['seconds'].median().reindex(per_poll.index).round(1)
+    per_poll['p90 s'] = grouped['seconds'].quantile(0.9).reindex(per_poll.index).round(1)
+    top = (
+        votes.groupby(['poll_id', 'option']).size().rename('n').reset_index()
+        .sort_values('n', ascending=False).drop_duplicates('poll_id').set_index('poll_id')['option']
+    )
+    per_poll['más votada'] = top.reindex(per_poll.index)
+    local_tz = datetime.now().astimezone().tzinfo
+    per_poll['lanzada'] = (
+        pd.to_datetime(per_poll['launched_at'], unit='s', utc=True).dt.tz_convert(local_tz).dt.strftime("%d/%m %H:%M")
+    )
+    per_poll = per_poll.drop(columns=['launched_at']).sort_index(ascending=False).reset_index()
+
+    total_polls = len(polls)
+    per_student = votes.groupby('user_id').agg(
+        estudiante=('username', 'last'),
+        respuestas=('poll_id', 'nunique'),
+        mediana_s=('seconds', 'median'),
+    )
+    per_student['participación %'] = (per_student['respuestas'] / max(total_polls, 1) * 100).round(1)
+    per_student['mediana_s'] = per_student['mediana_s'].round(1)
+    per_student = per_student.sort_values('respuestas', ascending=False).reset_index()
+
+    distribution = (
+        pd.crosstab(votes['poll_id'], votes['option'], normalize='index').mul(100).round(1)
+        if len(votes) else pd.DataFrame()
+    )
+
+    return {
+        'polls': total_polls,
+        'votes': len(votes),
+        'per_poll': per_poll,
+        'per_student': per_student,
+        'distribution': distribution,
+        'response_p50': float(votes['seconds'].quantile(0.5)) if len(votes) else None,
+        'response_p90': float(votes['seconds'].quantile(0.9)) if len(votes) else None,
+    }
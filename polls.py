@@ -0,0 +1,219 @@
+"""Encuestas generalizadas y sus conteos compactos en memoria.
+
+Una sala puede tener varias encuestas abiertas a la vez, guardadas como una
+lista en la clave ``polls``. Cada encuesta tiene un tipo:
+
+* ``choice``: una opción entre N definidas por el maestro.
+* ``truefalse``: Verdadero / Falso.
+* ``multi``: selección múltiple; el estudiante cuenta una vez como votante y
+  suma en cada opción que marcó.
+* ``numeric``: un número que se cuenta en rangos iguales entre un mínimo y un
+  máximo.
+* ``short``: respuesta corta normalizada (minúsculas, sin tildes ni
+  puntuación); cada respuesta distinta es un grupo, hasta
+  ``MAX_SHORT_BUCKETS``, y el resto cae en "Otras".
+
+Los votos se siguen registrando en el backend (que garantiza un voto por
+estudiante). ``PollBook`` mantiene por encuesta un ``CompactTally``: los
+conteos en un ``array`` indexado por opción y un índice hash de votantes, así
+que los resultados y "¿ya votó?" no recorren votos ni consultan el backend.
+"""
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import datetime
+
+KINDS = {
+    'choice': "Opción única",
+    'truefalse': "Verdadero / Falso",
+    'multi': "Selección múltiple",
+    'numeric': "Numérica (por rangos)",
+    'short': "Respuesta corta",
+}
+
+TRUE_FALSE = ['Verdadero', 'Falso']
+
+MAX_SHORT_BUCKETS = 20
+OTHER = "Otras"
+
+
+def numeric_labels(low, high, buckets):
+    width = (high - low) / buckets
+    return [f"{low + i * width:g} – {low + (i + 1) * width:g}" for i in range(buckets)]
+
+
+def new_poll(poll_id, question, kind, options=None, low=None, high=None, buckets=None):
+    """Definición de una encuesta abierta; ``ValueError`` si los datos no sirven"""
+    question = (question or '').strip() or "Pregunta"
+    poll = {'id': poll_id, 'question': question, 'kind': kind}
+    if kind in ('choice', 'multi'):
+        labels = list(dict.fromkeys(option.strip() for option in options or [] if option.strip()))
+        if len(labels) < 2:
+            raise ValueError("La encuesta necesita al menos dos opciones distintas")
+        poll['options'] = labels
+    elif kind == 'truefalse':
+        poll['options'] = list(TRUE_FALSE)
+    elif kind == 'numeric':
+        if low is None or high is None or not high > low or not buckets or buckets < 1:
+            raise ValueError("El rango numérico necesita mínimo < máximo y al menos un intervalo")
+        poll['range'] = [low, high, int(buckets)]
+        poll['options'] = numeric_labels(low, high, int(buckets))
+    elif kind == 'short':
+        poll['options'] = []
+    else:
+        raise ValueError(f"Tipo de encuesta desconocido: {kind}")
+    poll.update({
+        'timestamp': datetime.now().strftime("%H:%M:%S"),
+        'launched_at': time.time(),
+        'active': True,
+    })
+    return poll
+
+
+def normalize_answer(text):
+    """Forma canónica de una respuesta corta para agruparla"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    text = re.sub(r'[^\w\s]', '', text.lower())
+    return re.sub(r'\s+', ' ', text).strip()[:40]
+
+
+def answer_labels(poll, answer, known=()):
+    """Opciones que suma una respuesta; ``ValueError`` si no es válida"""
+    kind = poll.get('kind', 'choice')
+    if kind in ('choice', 'truefalse'):
+        if answer not in poll['options']:
+            raise ValueError("Opción inválida")
+        return [answer]
+    if kind == 'multi':
+        selected = [option for option in poll['options'] if option in set(answer or ())]
+        if not selected:
+            raise ValueError("Marca al menos una opción")
+        return selected
+    if kind == 'numeric':
+        low, high, buckets = poll['range']
+        value = float(answer)
+        if not low <= value <= high:
+            raise ValueError(f"El valor debe estar entre {low:g} y {high:g}")
+        index = min(int((value - low) / (high - low) * buckets), buckets - 1)
+        return [poll['options'][index]]
+    if kind == 'short':
+        label = normalize_answer(answer)
+        if not label:
+            raise ValueError("Escribe una respuesta")
+        if label not in known and len(known) >= MAX_SHORT_BUCKETS:
+            return [OTHER]
+        return [label]
+    raise ValueError(f"Tipo de encuesta desconocido: {kind}")
+
+
+class CompactTally:
+    """Conteos por índice de opción y el índice de votantes de una encuesta"""
+
+    __slots__ = ('labels', 'index', 'counts', 'voters', 'version')
+
+    def __init__(self, labels, version=None):
+        self.labels = list(labels)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.counts = array('l', bytes(array('l').itemsize * len(self.labels)))
+        self.voters = {}  # {user_id: índices de las opciones que marcó}
+        self.version = version
+
+    def _slot(self, label):
+        slot = self.index.get(label)
+        if slot is None:
+            # Respuestas cortas: cada grupo nuevo agrega una posición al final
+            slot = self.index[label] = len(self.labels)
+            self.labels.append(label)
+            self.counts.append(0)
+        return slot
+
+    def add(self, user_id, labels):
+        if user_id in self.voters:
+            return False
+        slots = tuple(self._slot(label) for label in labels)
+        for slot in slots:
+            self.counts[slot] += 1
+        self.voters[user_id] = slots
+        return True
+
+    def total_voters(self):
+        return len(self.voters)
+
+    def results(self):
+        """Pares (opción, votos) en el orden de las opciones"""
+        return list(zip(self.labels, self.counts))
+
+    def vote_of(self, user_id):
+        slots = self.voters.get(user_id)
+        return None if slots is None else [self.labels[slot] for slot in slots]
+
+
+class PollBook:
+    """Conteos compactos de las encuestas de una sala.
+
+    Un conteo se reconstruye desde los votos del backend solo cuando la
+    versión de ``tally_<id>`` cambió por algo que este proceso no registró
+    (otro worker, o la primera vez); los votos propios se suman en el lugar.
+    """
+
+    def __init__(self, store, version, on_vote=None):
+        self.store = store
+        self._version = version  # callable(clave) -> versión
+        self.on_vote = on_vote  # callable(poll_id, user_id, etiquetas)
+        self._tallies = {}
+        self._lock = threading.RLock()
+
+    def tally(self, poll):
+        key = f"tally_{poll['id']}"
+        version = self._version(key)
+        entry = self._tallies.get(poll['id'])
+        if entry is None or entry.version != version:
+            with self._lock:
+                entry = self._tallies.get(poll['id'])
+                if entry is None or entry.version != version:
+                    entry = CompactTally(poll.get('options', []), version)
+                    for user_id, option, _ in self.store.get_vote_records(poll['id']):
+                        entry.add(user_id, option if isinstance(option, list) else [option])
+                    self._tallies[poll['id']] = entry
+        return entry
+
+    def vote(self, poll, user_id, answer):
+        """Registrar una respuesta; False si ya había votado, ``ValueError`` si no es válida"""
+        key = f"tally_{poll['id']}"
+        with self._lock:
+            entry = self.tally(poll)
+            labels = answer_labels(poll, answer, entry.index)
+            before = self._version(key)
+            option = labels if poll.get('kind') == 'multi' else labels[0]
+            accepted = self.store.record_vote(poll['id'], user_id, option)
+            if accepted and entry.version == before:
+                entry.add(user_id, labels)
+                entry.version = self._version(key)
+        if accepted and self.on_vote:
+            self.on_vote(poll['id'], user_id, labels)
+        return accepted
+
+    def restore(self, poll, voters):
+        """Sembrar el conteo con los votos guardados ``{user_id: etiquetas}``
+        (deben coincidir con los del backend)"""
+        entry = CompactTally(poll.get('options', []), self._version(f"tally_{poll['id']}"))
+        for user_id, labels in voters.items():
+            entry.add(user_id, labels)
+        with self._lock:
+            self._tallies[poll['id']] = entry
+
+    def export(self, poll):
+        """Copia ``{user_id: etiquetas}`` del conteo, consistente con sus votos"""
+        with self._lock:
+            entry = self.tally(poll)
+            return {user_id: [entry.labels[slot] for slot in slots] for user_id, slots in entry.voters.items()}
+
+    def forget(self, poll_id):
+        with self._lock:
+            self._tallies.pop(poll_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tallies.clear()
@@ -0,0 +1,121 @@
+"""Registro de presencia de estudiantes con expiración por TTL.
+
+Los heartbeats solo actualizan memoria: mover una entrada al final de un
+``OrderedDict`` cuesta O(1) y mantiene las entradas ordenadas por última
+actividad, así que las expiradas siempre están al principio y barrerlas
+cuesta O(expiradas). El almacenamiento persistente solo se toca cuando un
+estudiante entra o expira.
+
+Para mostrar la lista, ``roster_frame`` la copia a un DataFrame columnar con
+timestamps epoch (float) y calcula el vencimiento y los "hace N s" de todos
+los estudiantes en una sola operación vectorizada.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+
+class PresenceRegistry:
+    """Estudiantes activos del proceso, ordenados por última actividad"""
+
+    def __init__(self, ttl=30.0, on_join=None, on_expire=None):
+        self.ttl = ttl
+        self.on_join = on_join
+        self.on_expire = on_expire
+        self._entries = OrderedDict()  # {user_id: (username, last_seen)}
+        self._lock = threading.Lock()
+        # Cambia solo cuando alguien entra o sale, no con cada heartbeat
+        self.version = 0
+
+    def load(self, students, now=None):
+        """Cargar estudiantes persistidos dándoles un TTL completo de gracia"""
+        now = now or time.time()
+        with self._lock:
+            for user_id, data in students.items():
+                self._entries[user_id] = (data['username'], now)
+                self._entries.move_to_end(user_id)
+            self.version += 1
+
+    def touch(self, user_id, username, now=None):
+        """Registrar actividad; devuelve True si el estudiante es nuevo"""
+        now = now or time.time()
+        with self._lock:
+            is_new = user_id not in self._entries
+            self._entries[user_id] = (username, now)
+            self._entries.move_to_end(user_id)
+            if is_new:
+                self.version += 1
+        if is_new and self.on_join:
+            self.on_join(user_id, username)
+        return is_new
+
+    def is_present(self, user_id):
+        with self._lock:
+            return user_id in self._entries
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+
+    def sweep(self, now=None):
+        """Quitar a los inactivos por más de ``ttl`` segundos y devolver sus ids"""
+        deadline = (now or time.time()) - self.ttl
+        expired = []
+        with self._lock:
+            while self._entries:
+                user_id, (_, last_seen) = next(iter(self._entries.items()))
+                if last_seen >= deadline:
+                    break
+                self._entries.popitem(last=False)
+                expired.append(user_id)
+            if expired:
+                self.version += 1
+        if expired and self.on_expire:
+            self.on_expire(expired)
+        return expired
+
+    def active_count(self, now=None):
+        self.sweep(now)
+        return len(self._entries)
+
+    def snapshot(self, now=None, sweep=True):
+        """Lista de (user_id, username, last_seen), del más reciente al más antiguo
+        (con ``sweep=False`` no barre: no dispara ``on_expire``)"""
+        if sweep:
+            self.sweep(now)
+        with self._lock:
+            entries = [(user_id, username, last_seen)
+                       for user_id, (username, last_seen) in self._entries.items()]
+        entries.reverse()
+        return entries
+
+    def roster_frame(self, now=None):
+        """DataFrame del más reciente al más antiguo con ``user_id``,
+        ``estudiante``, ``última actividad`` y ``hace (s)``"""
+        now = time.time() if now is None else now
+        with self._lock:
+            user_ids = list(self._entries)
+            entries = list(self._entries.values())
+        frame = pd.DataFrame({
+            'user_id': pd.Series(user_ids, dtype='object'),
+            'estudiante': pd.Series([username for username, _ in entries], dtype='object'),
+            'last_seen': pd.Series([last_seen for _, last_seen in entries], dtype='float64'),
+        })
+        # Vencidos que todavía no barrió nadie: se descartan con la misma máscara
+        ago = now - frame['last_seen']
+        frame = frame[ago <= self.ttl].iloc[::-1].reset_index(drop=True)
+        local_tz = datetime.now().astimezone().tzinfo
+        frame['última actividad'] = (
+            pd.to_datetime(frame['last_seen'], unit='s', utc=True).dt.tz_convert(local_tz)
+        )
+        frame['hace (s)'] = (now - frame['last_seen']).clip(lower=0).round().astype('int64')
+        return frame.drop(columns=['last_seen'])
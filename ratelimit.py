@@ -0,0 +1,141 @@
+"""Límites de envío por estudiante y por sala con token buckets en memoria.
+
+Cada estudiante tiene un bucket por acción (``chat``, ``vote``) y la sala
+tiene uno global para el chat. Los votos no pasan por el de la sala: ya son
+uno por estudiante por encuesta, y la ráfaga de votos justo después de lanzar
+una pregunta es justamente la que no se puede rechazar. Un bucket guarda solo
+``[tokens, último relleno]``: cada consulta lo rellena según el tiempo
+transcurrido y consume un token, en O(1) y sin tocar disco. Los buckets
+llenos se descartan a lo sumo cada ``_PRUNE_EVERY`` segundos y los
+estudiantes más limitados se cuentan en un top acotado, así que ninguna
+consulta recorre todo lo que se acumuló.
+
+Los límites son ``(tasa por segundo, ráfaga)`` y se configuran con
+``AULA_RATE_CHAT``, ``AULA_RATE_VOTE`` y ``AULA_RATE_ROOM`` en la forma
+``"tasa,ráfaga"`` (p. ej. ``"0.5,5"``).
+"""
+import os
+import threading
+import time
+
+import metrics
+
+DEFAULT_LIMITS = {
+    'chat': (0.5, 5),
+    'vote': (1.0, 3),
+}
+DEFAULT_ROOM_LIMIT = (20.0, 60)
+
+# Acciones que además consumen del bucket de la sala
+ROOM_ACTIONS = ('chat',)
+
+# Buckets a partir de los cuales se descartan los que ya están llenos, y
+# segundos mínimos entre dos barridos (cada uno recorre todos los buckets)
+_PRUNE_AT = 10000
+_PRUNE_EVERY = 30.0
+
+# Estudiantes que se siguen en el top de los más limitados
+_TOP_THROTTLED = 100
+
+
+def parse_limit(text, default):
+    """``"0.5,5"`` -> ``(0.5, 5)``; ``default`` si no hay valor"""
+    if not text:
+        return default
+    rate, burst = text.split(',')
+    return float(rate), int(burst)
+
+
+def limits_from_env():
+    """Límites por acción y de la sala según las variables de entorno"""
+    limits = {
+        action: parse_limit(os.environ.get(f'AULA_RATE_{action.upper()}'), default)
+        for action, default in DEFAULT_LIMITS.items()
+    }
+    return limits, parse_limit(os.environ.get('AULA_RATE_ROOM'), DEFAULT_ROOM_LIMIT)
+
+
+class RateLimiter:
+    """Token buckets por (acción, estudiante) más uno global de la sala"""
+
+    def __init__(self, limits=None, room_limit=DEFAULT_ROOM_LIMIT):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.room_limit = room_limit
+        self._buckets = {}  # {clave: [tokens, último relleno]}
+        self._lock = threading.Lock()
+        self._counts = {}  # {(acción, resultado): n}
+        self._throttled_users = {}  # {user_id: veces limitado}, a lo sumo _TOP_THROTTLED
+        self._pruned_at = None
+
+    def _take(self, key, limit, now):
+        """Consumir un token del bucket; devuelve los segundos a esperar (0 si había)"""
+        rate, burst = limit
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+    def check(self, action, user_id, now=None):
+        """(permitido, segundos a esperar) para una escritura del estudiante"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            wait = self._take((action, user_id), self.limits[action], now)
+            scope = 'user'
+            if not wait and action in ROOM_ACTIONS:
+                wait = self._take(('room',), self.room_limit, now)
+                scope = 'room'
+                if wait:
+                    # La sala está saturada: devolver el token del estudiante
+                    self._buckets[(action, user_id)][0] += 1
+            result = scope if wait else 'allowed'
+            self._counts[(action, result)] = self._counts.get((action, result), 0) + 1
+            if wait:
+                self._count_throttled(user_id)
+            if len(self._buckets) > _PRUNE_AT and (
+                self._pruned_at is None or now - self._pruned_at >= _PRUNE_EVERY
+            ):
+                self._pruned_at = now
+                self._prune(now)
+        metrics.inc('rate_limit_checks_total', action=action, result=result)
+        return not wait, wait
+
+    def _count_throttled(self, user_id):
+        """Top acotado: con el top lleno, un estudiante nuevo reemplaza al de
+        menor cuenta. Los que insisten suben enseguida y no salen; las
+        cuentas mostradas nunca exageran (a lo sumo se pierde el principio)"""
+        users = self._throttled_users
+        if user_id not in users and len(users) >= _TOP_THROTTLED:
+            del users[min(users, key=users.get)]
+        users[user_id] = users.get(user_id, 0) + 1
+
+    def _prune(self, now):
+        """Olvidar los buckets que ya se rellenaron por completo"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            rate, burst = self.room_limit if key == ('room',) else self.limits[key[0]]
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+    def stats(self):
+        """Filas por acción y los estudiantes más limitados"""
+        with self._lock:
+            counts = dict(self._counts)
+            throttled = sorted(self._throttled_users.items(), key=lambda item: item[1], reverse=True)
+        rows = [{
+            'acción': action,
+            'permitidos': counts.get((action, 'allowed'), 0),
+            'limitados (estudiante)': counts.get((action, 'user'), 0),
+            'limitados (sala)': counts.get((action, 'room'), 0),
+        } for action in self.limits]
+        return rows, throttled[:10]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._counts.clear()
+            self._throttled_users.clear()
@@ -0,0 +1,128 @@
+"""Intervalos de refresco adaptativos para los fragmentos con ``run_every``.
+
+Cada canal (chat, encuestas, presencia, heartbeat) tiene un intervalo base y
+unos límites ``(base, mínimo, máximo)``. El intervalo efectivo:
+
+* baja al mínimo mientras el canal está "caliente": hay una encuesta activa o
+  sus datos cambiaron hace poco;
+* se duplica por cada ``idle_after`` segundos sin cambios en la versión de
+  sus datos compartidos;
+* se estira en proporción al número de sesiones conectadas para que el total
+  de ejecuciones de fragmentos por segundo no pase de ``budget``.
+
+Siempre queda dentro de ``[mínimo, máximo]``. Streamlit fija ``run_every`` al
+definir el fragmento, así que la app recalcula el intervalo en cada ejecución
+y solo provoca una ejecución completa cuando cambia de forma apreciable.
+Esas ejecuciones completas salen de un cupo por sala (``allow_rerun``): el
+primer mensaje tras un rato de calma vuelve caliente el canal para todas las
+sesiones a la vez, y sin cupo todas se relanzarían en el mismo segundo.
+"""
+import threading
+import time
+
+# (base, mínimo, máximo) en segundos. El heartbeat no puede pasar de la mitad
+# del TTL de presencia o los estudiantes aparecerían desconectados, y
+# ``watch`` (solo compara contadores del bus) se mantiene en torno al segundo.
+DEFAULT_BOUNDS = {
+    'watch': (1, 0.5, 2),
+    'heartbeat': (10, 5, 15),
+    'presence': (5, 2, 30),
+    'chat': (2, 1, 15),
+    'polls': (3, 1, 15),
+}
+
+# Cambio relativo a partir del cual vale la pena reprogramar un fragmento
+RESCHEDULE_RATIO = 1.5
+
+# Una ejecución completa (heartbeat, CSS, iframe y todos los fragmentos)
+# cuesta del presupuesto como esta cantidad de ejecuciones de fragmentos
+FULL_RUN_COST = 10
+
+
+class RefreshScheduler:
+    """Historial de versiones por canal e intervalos derivados de él"""
+
+    def __init__(self, bounds=None, budget=200.0, idle_after=30.0, hot_window=10.0, max_interval=None):
+        self.bounds = dict(DEFAULT_BOUNDS if bounds is None else bounds)
+        if max_interval is not None:
+            self.bounds = {
+                channel: (min(base, max_interval), min(low, max_interval), min(high, max_interval))
+                for channel, (base, low, high) in self.bounds.items()
+            }
+        self.budget = budget
+        self.idle_after = idle_after
+        self.hot_window = hot_window
+        self._seen = {}  # {canal: (versión, momento del último cambio)}
+        # Cupo de ejecuciones completas por reprogramación: token bucket
+        self.rerun_rate = budget / FULL_RUN_COST if budget > 0 else 0.0
+        self._rerun_tokens = self.rerun_rate
+        self._rerun_at = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, channel, version, now=None):
+        """Registrar la versión actual de los datos de un canal"""
+        now = time.time() if now is None else now
+        with self._lock:
+            seen = self._seen.get(channel)
+            if seen is None:
+                # La primera observación no cuenta como actividad reciente
+                self._seen[channel] = (version, now - self.hot_window)
+            elif seen[0] != version:
+                self._seen[channel] = (version, now)
+
+    def mark_changed(self, channel, now=None):
+        """Registrar un cambio avisado por el bus sin esperar a que un fragmento lo observe"""
+        now = time.time() if now is None else now
+        with self._lock:
+            seen = self._seen.get(channel)
+            self._seen[channel] = (seen[0] if seen else None, now)
+
+    def quiet_for(self, channel, now=None):
+        """Segundos desde el último cambio del canal (``None`` si nunca se observó)"""
+        seen = self._seen.get(channel)
+        if seen is None:
+            return None
+        return (time.time() if now is None else now) - seen[1]
+
+    def allow_rerun(self, now=None):
+        """True si la sala todavía tiene cupo para relanzar una sesión completa
+        (``rerun_rate`` por segundo, ráfaga de un segundo; sin presupuesto, siempre)"""
+        if self.rerun_rate <= 0:
+            return True
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rerun_tokens = min(
+                self.rerun_rate, self._rerun_tokens + max(now - self._rerun_at, 0) * self.rerun_rate
+            )
+            self._rerun_at = now
+            if self._rerun_tokens < 1:
+                return False
+            self._rerun_tokens -= 1
+            return True
+
+    def load_factor(self, sessions):
+        """Cuánto estirar los intervalos base para respetar el presupuesto"""
+        if self.budget <= 0:
+            return 1.0
+        runs_per_second = sessions * sum(1 / base for base, _, _ in self.bounds.values())
+        return max(1.0, runs_per_second / self.budget)
+
+    def interval(self, channel, sessions, hot=False, now=None):
+        """Intervalo en segundos (múltiplo de 0.5) para el fragmento del canal"""
+        base, low, high = self.bounds[channel]
+        quiet = self.quiet_for(channel, now)
+        if hot or (quiet is not None and quiet < self.hot_window):
+            interval = low
+        elif quiet is None:
+            interval = base
+        else:
+            interval = base * 2 ** min(int(quiet // self.idle_after), 8)
+        interval = min(max(interval * self.load_factor(sessions), low), high)
+        return round(interval * 2) / 2
+
+
+def needs_reschedule(registered, desired, ratio=RESCHEDULE_RATIO):
+    """True si el intervalo deseado se aleja lo suficiente del programado"""
+    if not registered or not desired:
+        return registered != desired
+    return max(registered, desired) / min(registered, desired) >= ratio
@@ -0,0 +1,273 @@
+"""Salas independientes dentro de un mismo proceso de Streamlit.
+
+Cada sala tiene su propio directorio ``shared_data/rooms/<sala>/`` con su
+backend de almacenamiento (una base SQLite propia, con su propio lock de
+escritura) y su bus de avisos de cambios. En memoria lleva sus límites de
+envío, su caché versionada, su registro de presencia, la caché de HTML, la
+ventana en vivo y el índice de búsqueda del chat, los conteos compactos de
+sus encuestas abiertas, el snapshot del tablero y el historial de versiones
+de los refrescos adaptativos. En disco guarda además el historial de
+encuestas cerradas, la serie de participación de la clase y los checkpoints
+para reanudar tras una caída.
+
+Así las escrituras de una sala ocupada no bloquean a las demás y reiniciar
+una sala no toca las otras.
+
+Las salas se abren bajo demanda y se cierran solas cuando pasan un tiempo
+sin accesos ni estudiantes conectados; sus datos quedan en disco.
+"""
+import hashlib
+import re
+import threading
+import time
+from pathlib import Path
+
+import checkpoint
+import metrics
+import storage
+import telemetry
+from bus import create_bus
+from chat_index import ChatIndex
+from chat_render import LiveChatView, MessageHtmlCache
+from dashboard import Dashboard
+from poll_history import PollHistory
+from polls import PollBook
+from presence import PresenceRegistry
+from ratelimit import RateLimiter, limits_from_env
+from refresh import RefreshScheduler
+
+DEFAULT_ROOM = "general"
+
+_ROOM_ID = re.compile(r'[a-z0-9][a-z0-9_-]{0,39}')
+
+# Canal de refresco al que afecta cada clave avisada por el bus
+_REFRESH_CHANNELS = {
+    storage.CHAT_KEY: 'chat',
+    'polls': 'polls',
+    'tally': 'polls',
+}
+
+
+def normalize_room_id(raw):
+    """Id de sala en minúsculas y con guiones; ``None`` si no es válido"""
+    room_id = re.sub(r'\s+', '-', (raw or '').strip().lower())
+    return room_id if _ROOM_ID.fullmatch(room_id) else None
+
+
+def user_id_for(username, user_type):
+    """Id estable de un usuario: el mismo nombre y rol dan el mismo id en
+    cualquier sesión (la app y el modo liviano)"""
+    return hashlib.md5(f"{username}_{user_type}".encode()).hexdigest()[:8]
+
+
+class Room:
+    """Todo el estado compartido de una sala.
+
+    Los checkpoints y la serie de participación son de un solo proceso por
+    directorio: con ``recovery=False`` la sala no los escribe ni los lee, y
+    su presencia arranca vacía en lugar de cargar la del backend.
+    """
+
+    def __init__(self, room_id, directory, presence_ttl=30, backend=None, refresh_options=None, recovery=True):
+        self.room_id = room_id
+        self.directory = Path(directory)
+        self.store = storage.create_store(self.directory, backend)
+        self.bus = create_bus(self.directory)
+        if self.bus is not None:
+            self.store.add_listener(self.bus)
+        self.cache = storage.VersionedCache(self.store, self.bus)
+        self.checkpoints = checkpoint.Checkpointer(self.directory, checkpoint.interval_from_env()) if recovery else None
+        self.presence = PresenceRegistry(
+            ttl=presence_ttl,
+            on_join=self._on_join,
+            on_expire=self._on_expire
+        )
+        self.html_cache = MessageHtmlCache()
+        self.chat_view = LiveChatView(self.store, self.html_cache)
+        self.chat_index = ChatIndex(self.store)
+        self.store.add_listener(self.chat_index)
+        self.limiter = RateLimiter(*limits_from_env())
+        self.refresh = RefreshScheduler(**(refresh_options or {}))
+        if self.bus is not None:
+            self.bus.subscribe(self._on_change)
+        self.polls = PollBook(self.store, self.version, on_vote=self._on_vote)
+        self.dashboard = Dashboard(self)
+        self.history = PollHistory(self.directory / "poll_history")
+        self.engagement = telemetry.EngagementRecorder(
+            self.directory, telemetry.interval_from_env() if recovery else 0
+        )
+        if self.checkpoints is not None:
+            with metrics.timer('checkpoint_restore_seconds'):
+                saved = self.checkpoints.load()
+                if saved is not None:
+                    self._restore(saved)
+            # Sin recuperación tampoco se adoptan los estudiantes de otro proceso:
+            # no llegan sus heartbeats y se los daría de baja al vencer
+            self.presence.load(self.store.get_students())
+            self.store.add_listener(checkpoint.KeyJournal(self.checkpoints, self.store))
+            self.checkpoints.start(self.checkpoint_state)
+        self.engagement.start(self._engagement_probe)
+        self.last_access = time.time()
+
+    # Journal de los cambios que no se pueden reconstruir desde el backend
+    def _on_join(self, user_id, username):
+        self.store.touch_student(user_id, username)
+        if self.checkpoints is not None:
+            self.checkpoints.log('join', user_id=user_id, username=username, at=time.time())
+
+    def _on_expire(self, user_ids):
+        self.store.remove_students(user_ids)
+        if self.checkpoints is not None:
+            self.checkpoints.log('expire', user_ids=list(user_ids))
+
+    def _on_vote(self, poll_id, user_id, labels):
+        if self.checkpoints is not None:
+            self.checkpoints.log('vote', poll_id=poll_id, user_id=user_id, labels=labels)
+        self.engagement.record_vote()
+
+    def _engagement_probe(self):
+        return (
+            self.presence.active_count(),
+            self.store.message_bounds()[1],
+            len(self.cache.get('polls') or [])
+        )
+
+    def checkpoint_state(self):
+        """Estado consistente de la sala para el snapshot"""
+        open_polls = self.store.get('polls', None) or []
+        return {
+            'presence': {
+                user_id: [username, last_seen]
+                # Sin barrer: las salidas escriben en el backend y en el journal
+                for user_id, username, last_seen in self.presence.snapshot(sweep=False)
+            },
+            'polls': open_polls,
+            'tallies': {str(poll['id']): self.polls.export(poll) for poll in open_polls},
+            'vdo_link': self.store.get('vdo_link', None),
+            'chat_tail': self.store.read_messages(limit=checkpoint.CHAT_TAIL),
+        }
+
+    def _restore(self, saved):
+        """Completar el backend y la memoria con el último estado guardado"""
+        # Estudiantes que entraron pero cuyo alta no llegó a volcarse
+        students = self.store.get_students()
+        for user_id, (username, _) in saved['presence'].items():
+            if user_id not in students:
+                self.store.touch_student(user_id, username)
+        # Encuestas y link: si la clave falta o quedó ilegible vale la guardada
+        for key in ('polls', 'vdo_link'):
+            if self.store.get(key, None) is None and saved.get(key):
+                self.store.put(key, saved[key])
+        # Votos: si el backend coincide se siembran los conteos sin releer los
+        # votos; si le faltan, se vuelven a registrar (los repetidos se ignoran)
+        for poll in self.store.get('polls', None) or []:
+            voters = saved['tallies'].get(str(poll['id']))
+            if not voters:
+                continue
+            expected = {}
+            for labels in voters.values():
+                for label in labels:
+                    expected[label] = expected.get(label, 0) + 1
+            if self.store.get_tally(poll['id']) == expected:
+                self.polls.restore(poll, voters)
+                continue
+            for user_id, labels in voters.items():
+                option = labels if poll.get('kind') == 'multi' else labels[0]
+                if self.store.record_vote(poll['id'], user_id, option):
+                    metrics.inc('checkpoint_votes_recovered_total')
+        # HTML del chat listo para las primeras sesiones
+        self.html_cache.render([tuple(entry) for entry in saved['chat_tail']])
+
+    def _on_change(self, keys):
+        for key in keys:
+            channel = _REFRESH_CHANNELS.get(metrics.normalize_key(key))
+            if channel is not None:
+                self.refresh.mark_changed(channel)
+
+    def clear(self):
+        """Reiniciar la sala (solo esta sala)"""
+        self.store.clear()
+        self.presence.clear()
+        self.polls.clear()
+        self.dashboard.reset()
+
+    def is_idle(self, now, idle_seconds):
+        return now - self.last_access > idle_seconds and self.presence.active_count(now) == 0
+
+    def version(self, *keys):
+        """Versión de ``keys`` para decidir si reconstruir una vista"""
+        if self.bus is not None:
+            return self.bus.version(*keys)
+        return tuple(
+            self.store.message_bounds() if key == storage.CHAT_KEY else self.store.version(key)
+            for key in keys
+        )
+
+    def close(self):
+        if self.checkpoints is not None:
+            self.checkpoints.close(self.checkpoint_state)
+        self.engagement.close()
+        self.store.close()
+        if self.bus is not None:
+            self.bus.close()
+
+
+class RoomRegistry:
+    """Salas abiertas del proceso, con cierre de las inactivas"""
+
+    def __init__(self, data_dir, presence_ttl=30, idle_seconds=900, sweep_every=60, refresh_options=None,
+                 recovery=True):
+        self.rooms_dir = Path(data_dir) / "rooms"
+        self.rooms_dir.mkdir(parents=True, exist_ok=True)
+        self.presence_ttl = presence_ttl
+        self.idle_seconds = idle_seconds
+        self.sweep_every = sweep_every
+        self.refresh_options = refresh_options
+        self.recovery = recovery
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def get(self, room_id):
+        """Sala abierta (la abre si hace falta) y marca el acceso"""
+        now = time.time()
+        room = self._rooms.get(room_id)
+        if room is None:
+            with self._lock:
+                room = self._rooms.get(room_id)
+                if room is None:
+                    room = Room(
+                        room_id, self.rooms_dir / room_id, self.presence_ttl,
+                        refresh_options=self.refresh_options, recovery=self.recovery
+                    )
+                    self._rooms[room_id] = room
+        room.last_access = now
+        if now - self._last_sweep > self.sweep_every:
+            self.sweep_idle(now)
+        return room
+
+    def sweep_idle(self, now=None):
+        """Cerrar las salas sin accesos ni estudiantes; devuelve sus ids"""
+        now = now or time.time()
+        self._last_sweep = now
+        with self._lock:
+            idle = [
+                room_id for room_id, room in self._rooms.items()
+                if room.is_idle(now, self.idle_seconds)
+            ]
+            closed = [self._rooms.pop(room_id) for room_id in idle]
+        for room in closed:
+            room.close()
+        return idle
+
+    def active_sessions(self):
+        """Estudiantes conectados en todas las salas abiertas"""
+        return sum(room.presence.active_count() for room in self.open_rooms())
+
+    def open_rooms(self):
+        with self._lock:
+            return list(self._rooms.values())
+
+    def known_room_ids(self):
+        """Salas con datos en disco, abiertas o no"""
+        return sorted(path.name for path in self.rooms_dir.iterdir() if path.is_dir())
@@ -0,0 +1,912 @@
+"""Capa de almacenamiento para los datos compartidos del aula.
+
+``SharedStore`` define la interfaz que usa app.py. Hay dos implementaciones:
+
+* ``JsonFileStore``: un archivo JSON por clave dentro de ``shared_data/`` (el
+  formato original, útil para depurar a mano).
+* ``SQLiteStore``: una base SQLite en modo WAL con transacciones reales,
+  actualizaciones por fila para estudiantes, mensajes y votos, y lectores
+  concurrentes que no bloquean a los escritores.
+
+El backend se elige con la variable de entorno ``AULA_STORAGE``
+(``sqlite`` por defecto, o ``json``).
+
+Las escrituras frecuentes pasan por un ``WriteBehind``: en JSON todas las
+claves (cada volcado es un temporal + ``os.replace``), en SQLite la
+actividad de los estudiantes. ``AULA_FLUSH_MS`` fija la latencia máxima de
+volcado por defecto y ``AULA_FLUSH_BUDGETS`` la de cada clave, en segundos
+(``"tally=0.1,connected_students=5"``; 0 escribe en el momento).
+
+Los backends avisan de cada cambio a sus listeners (el bus de la sala, ver
+bus.py) con la clave afectada; los cambios del chat usan ``CHAT_KEY``.
+"""
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+from bus import ALL
+from chat_archive import ChatArchive
+from chatlog import SegmentedChatLog
+from write_behind import WriteBehind, parse_budgets
+
+# Mensajes por segmento del archivo histórico del chat
+ARCHIVE_SEGMENT_SIZE = 1000
+
+# Latencia máxima de volcado (segundos) de las escrituras diferidas
+DEFAULT_FLUSH_BUDGET = 0.2
+
+# Las encuestas y el link del stream los escribe solo el maestro y otros
+# procesos deben verlos ya; la lista de estudiantes se reconstruye sola
+DEFAULT_FLUSH_BUDGETS = {
+    'polls': 0,
+    'vdo_link': 0,
+    'connected_students': 2.0,
+}
+
+# Clave con la que se avisan los cambios del chat, y la que cambia además
+# cuando se borran mensajes puntuales (las vistas deben releer, no solo agregar)
+CHAT_KEY = 'messages'
+CHAT_DELETED_KEY = 'messages_deleted'
+
+
+def _encode_option(option):
+    """Una opción, o la lista de opciones marcadas en selección múltiple,
+    siempre en JSON: al leer no hay que adivinar qué tipo de voto era"""
+    return json.dumps(option, ensure_ascii=False)
+
+
+def _decode_option(value):
+    if value is None:
+        return None
+    try:
+        decoded = json.loads(value)
+    except ValueError:
+        # Votos de versiones anteriores: la etiqueta tal cual
+        return value
+    if isinstance(decoded, str):
+        return decoded
+    if isinstance(decoded, list) and all(isinstance(label, str) for label in decoded):
+        return decoded
+    return value
+
+
+def _option_labels(option):
+    return option if isinstance(option, list) else [option]
+
+
+def _count(name, key, value=1):
+    if metrics.ENABLED:
+        metrics.inc(name, value, key=metrics.normalize_key(key))
+
+
+def _student_bytes(students):
+    """Bytes de filas ``(user_id, (nombre, última actividad))``: textos más 8 del timestamp"""
+    return sum(len(user_id) + len(username) + 8 for user_id, (username, _) in students)
+
+
+class SharedStore:
+    """Interfaz común de los backends de datos compartidos"""
+
+    _listeners = ()
+
+    def add_listener(self, listener):
+        """Avisar a ``listener.changed(keys)`` y ``listener.persisted(keys)`` de cada cambio"""
+        self._listeners = (*self._listeners, listener)
+
+    def _notify(self, keys, persisted=True):
+        for listener in self._listeners:
+            listener.changed(keys)
+            if persisted:
+                listener.persisted(keys)
+
+    # Valores genéricos (clave -> JSON)
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def put(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def version(self, key):
+        """Marca barata que cambia cada vez que cambia el valor de ``key``"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def transaction(self):
+        """Context manager que agrupa varias operaciones de forma atómica"""
+        raise NotImplementedError
+
+    # Estudiantes conectados
+    def touch_student(self, user_id, username, when=None):
+        raise NotImplementedError
+
+    def get_students(self):
+        raise NotImplementedError
+
+    def remove_students(self, user_ids):
+        raise NotImplementedError
+
+    # Chat (log append-only con offsets crecientes)
+    def append_message(self, message):
+        """Agregar un mensaje y devolver su offset"""
+        raise NotImplementedError
+
+    def read_messages(self, after=None, limit=None, before=None):
+        """Pares (offset, mensaje) entre ``after`` y ``before`` (exclusivos).
+
+        Con ``limit`` se devuelven los ``limit`` más recientes del rango.
+        """
+        raise NotImplementedError
+
+    def message_bounds(self):
+        """(primer offset disponible, siguiente offset a asignar)"""
+        raise NotImplementedError
+
+    def delete_messages(self, offsets):
+        """Borrar mensajes puntuales del chat en vivo sin reescribir el resto;
+        devuelve cuántos se borraron"""
+        raise NotImplementedError
+
+    def get_messages(self, limit=None):
+        return [message for _, message in self.read_messages(limit=limit)]
+
+    def clear_messages(self):
+        """Vaciar el chat en vivo; los mensajes pasan antes al archivo"""
+        raise NotImplementedError
+
+    # Retención: lo que sale de la ventana caliente va a ``self.archive``
+    def archive_messages(self, before):
+        """Mover al archivo los mensajes con offset menor que ``before``"""
+        raise NotImplementedError
+
+    def rotate_messages(self, keep):
+        """Dejar en vivo aproximadamente los últimos ``keep`` mensajes.
+
+        Solo se archivan segmentos completos de ``ARCHIVE_SEGMENT_SIZE``: la
+        ventana crece hasta ``keep`` más un segmento y recién ahí se rota, en
+        lugar de escribir un archivo por cada mensaje que sale de ella. Los
+        restos incompletos quedan para ``clear_messages``.
+        """
+        first, end = self.message_bounds()
+        if end - first < keep + ARCHIVE_SEGMENT_SIZE:
+            return 0
+        return self.archive_messages(end - keep)
+
+    def _archive_entries(self, entries):
+        for i in range(0, len(entries), ARCHIVE_SEGMENT_SIZE):
+            name = self.archive.write_segment(entries[i:i + ARCHIVE_SEGMENT_SIZE])
+            size = (self.archive.directory / name).stat().st_size
+            _count('shared_data_bytes_written_total', 'chat_archive', size)
+        return len(entries)
+
+    # Votos: un registro por votante más un conteo precalculado por opción.
+    # ``option`` es una etiqueta, o una lista de etiquetas en las encuestas de
+    # selección múltiple (el votante suma en cada una)
+    def record_vote(self, poll_id, user_id, option):
+        """Registrar un voto; devuelve False si el usuario ya había votado"""
+        raise NotImplementedError
+
+    def get_tally(self, poll_id):
+        """Conteo de votos por opción, sin recorrer los votos individuales.
+
+        Su versión se consulta con ``version(f"tally_{poll_id}")``.
+        """
+        raise NotImplementedError
+
+    def get_vote(self, poll_id, user_id):
+        raise NotImplementedError
+
+    def get_votes(self, poll_id):
+        raise NotImplementedError
+
+    def get_vote_records(self, poll_id):
+        """Lista de (user_id, opción, timestamp del voto) de una encuesta"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonFileStore(SharedStore):
+    """Un archivo JSON por clave, protegido con un lock del proceso.
+
+    ``put`` deja el valor en un buffer write-behind: las lecturas del proceso
+    lo ven al instante y el archivo se reemplaza de forma atómica dentro del
+    presupuesto de latencia de la clave.
+    """
+
+    def __init__(self, data_dir, flush_budget=DEFAULT_FLUSH_BUDGET, flush_budgets=None):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._writes = {}  # escrituras de este proceso por clave
+        self._buffer = WriteBehind(
+            self._write_files,
+            budget=flush_budget,
+            budgets={**DEFAULT_FLUSH_BUDGETS, **(flush_budgets or {})},
+            name='json'
+        )
+        self.chat = SegmentedChatLog(self.data_dir / "chat", segment_size=ARCHIVE_SEGMENT_SIZE)
+        self.archive = ChatArchive(self.data_dir / "chat_archive")
+        self._migrate_messages()
+        self._repair_tallies()
+
+    def _migrate_messages(self):
+        """Pasar un messages.json de versiones anteriores al log de chat"""
+        legacy = self.get('messages')
+        if legacy is None:
+            return
+        for message in legacy:
+            self.chat.append(message)
+        self.delete('messages')
+
+    def _repair_tallies(self):
+        """Recontar conteos que quedaron atrás de sus votos (p. ej. tras una caída)"""
+        votes_root = self.data_dir / "votes"
+        if not votes_root.exists():
+            return
+        for votes_dir in votes_root.iterdir():
+            poll_id = votes_dir.name
+            tally = self._count_votes(poll_id)
+            if self.get(f'tally_{poll_id}') != tally:
+                self.put(f'tally_{poll_id}', tally)
+
+    def _path(self, key):
+        return self.data_dir / f"{key}.json"
+
+    def get(self, key, default=None):
+        # El valor pendiente se guarda serializado: cada lectura devuelve un
+        # objeto nuevo, igual que al leer el archivo
+        data = self._buffer.get(key, None)
+        if data is None:
+            try:
+                with open(self._path(key), 'r') as f:
+                    data = f.read()
+            except OSError:
+                return default
+            _count('shared_data_bytes_read_total', key, len(data))
+        try:
+            return json.loads(data)
+        except ValueError:
+            _count('shared_data_parse_failures_total', key)
+            return default
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        with self._lock:
+            self._buffer.put(key, data)
+            self._writes[key] = self._writes.get(key, 0) + 1
+        # Otros procesos lo ven recién cuando se vuelca (ver _write_files)
+        self._emit([key], persisted=False)
+
+    @contextmanager
+    def _locked(self):
+        """Lock del store; los avisos de lo escrito adentro salen al soltarlo,
+        así ningún listener corre con el lock tomado"""
+        with self._lock:
+            outermost = getattr(self._local, 'pending', None) is None
+            if outermost:
+                self._local.pending = []
+            try:
+                yield
+            finally:
+                if outermost:
+                    pending, self._local.pending = self._local.pending, None
+        if outermost:
+            for keys, persisted in pending:
+                self._notify(keys, persisted)
+
+    def _emit(self, keys, persisted=True):
+        """Avisar de un cambio (al soltar el lock si se está dentro de ``_locked``)"""
+        if getattr(self._local, 'pending', None) is not None:
+            self._local.pending.append((keys, persisted))
+        else:
+            self._notify(keys, persisted)
+
+    def _write_files(self, batch):
+        """Volcar un lote: temporales con fsync, ``os.replace`` y un fsync del directorio"""
+        staged = []
+        try:
+            for key, data in batch.items():
+                fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix=".tmp")
+                staged.append((tmp_path, key))
+                with os.fdopen(fd, 'w') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                _count('shared_data_bytes_written_total', key, len(data))
+            for tmp_path, key in staged:
+                os.replace(tmp_path, self._path(key))
+        finally:
+            for tmp_path, _ in staged:
+                Path(tmp_path).unlink(missing_ok=True)
+        dir_fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        for listener in self._listeners:
+            listener.persisted(list(batch))
+
+    def flush(self):
+        """Escribir ya todo lo pendiente"""
+        self._buffer.flush()
+
+    def delete(self, key):
+        with self._lock:
+            self._buffer.discard([key])
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+            self._writes[key] = self._writes.get(key, 0) + 1
+        self._emit([key])
+
+    def close(self):
+        self._buffer.close()
+
+    def version(self, key):
+        # El mtime puede tener resolución de milisegundos, así que dos
+        # escrituras seguidas del mismo tamaño se distinguen por el contador
+        # local; el stat detecta las escrituras de otros procesos
+        writes = self._writes.get(key, 0)
+        try:
+            stat = self._path(key).stat()
+        except FileNotFoundError:
+            return (writes, None)
+        return (writes, stat.st_mtime_ns, stat.st_size)
+
+    def clear(self):
+        with self._locked():
+            self._buffer.discard()
+            self.clear_messages()
+            for file in self.data_dir.glob("*.json"):
+                try:
+                    file.unlink()
+                except OSError:
+                    pass
+            shutil.rmtree(self.data_dir / "votes", ignore_errors=True)
+            for key in self._writes:
+                self._writes[key] += 1
+        self._emit([ALL])
+
+    @contextmanager
+    def transaction(self):
+        with self._locked():
+            yield self
+
+    def touch_student(self, user_id, username, when=None):
+        when = when or datetime.now()
+        with self._locked():
+            connected = self.get('connected_students', {})
+            connected[user_id] = {
+                'username': username,
+                'last_activity': when.isoformat()
+            }
+            self.put('connected_students', connected)
+
+    def get_students(self):
+        return self.get('connected_students', {})
+
+    def remove_students(self, user_ids):
+        with self._locked():
+            connected = self.get('connected_students', {})
+            for user_id in user_ids:
+                connected.pop(user_id, None)
+            self.put('connected_students', connected)
+
+    def append_message(self, message):
+        offset = self.chat.append(message)
+        self._emit([CHAT_KEY])
+        return offset
+
+    def read_messages(self, after=None, limit=None, before=None):
+        return self.chat.read(after=after, limit=limit, before=before)
+
+    def message_bounds(self):
+        return self.chat.bounds()
+
+    def delete_messages(self, offsets):
+        with self._lock:
+            deleted = self.chat.delete(offsets)
+            self._writes[CHAT_DELETED_KEY] = self._writes.get(CHAT_DELETED_KEY, 0) + 1
+        if deleted:
+            self._emit([CHAT_KEY, CHAT_DELETED_KEY])
+        return deleted
+
+    def clear_messages(self):
+        with self._lock:
+            self._archive_entries(self.chat.read())
+            self.chat.clear()
+        self._emit([CHAT_KEY])
+
+    def archive_messages(self, before):
+        # Se rotan segmentos completos: cada uno se archiva y después se borra
+        archived = 0
+        with self._lock:
+            for start in self.chat.sealed_segments(before):
+                archived += self._archive_entries(self.chat.read_segment(start))
+                self.chat.drop_segment(start)
+        if archived:
+            self._emit([CHAT_KEY])
+        return archived
+
+    def _votes_dir(self, poll_id):
+        return self.data_dir / "votes" / str(poll_id)
+
+    def record_vote(self, poll_id, user_id, option):
+        votes_dir = self._votes_dir(poll_id)
+        votes_dir.mkdir(parents=True, exist_ok=True)
+        # Un archivo por votante creado con O_EXCL: la regla de un voto por
+        # estudiante la garantiza el sistema de archivos, sin leer una lista
+        try:
+            fd = os.open(votes_dir / user_id, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        encoded = _encode_option(option)
+        with os.fdopen(fd, 'w') as f:
+            f.write(encoded)
+        _count('shared_data_bytes_written_total', 'votes', len(encoded))
+        with self._locked():
+            tally = self.get(f'tally_{poll_id}')
+            if tally is None:
+                # El recuento desde los registros ya incluye este voto
+                tally = self._count_votes(poll_id)
+            else:
+                for label in _option_labels(option):
+                    tally[label] = tally.get(label, 0) + 1
+            self.put(f'tally_{poll_id}', tally)
+        return True
+
+    def _count_votes(self, poll_id):
+        tally = {}
+        for option in self.get_votes(poll_id).values():
+            for label in _option_labels(option):
+                tally[label] = tally.get(label, 0) + 1
+        return tally
+
+    def get_tally(self, poll_id):
+        tally = self.get(f'tally_{poll_id}')
+        return tally if tally is not None else self._count_votes(poll_id)
+
+    def _read_vote(self, path):
+        data = path.read_text()
+        _count('shared_data_bytes_read_total', 'votes', len(data))
+        return _decode_option(data)
+
+    def get_vote(self, poll_id, user_id):
+        try:
+            return self._read_vote(self._votes_dir(poll_id) / user_id)
+        except FileNotFoundError:
+            return None
+
+    def get_votes(self, poll_id):
+        votes_dir = self._votes_dir(poll_id)
+        if not votes_dir.exists():
+            return {}
+        return {path.name: self._read_vote(path) for path in votes_dir.iterdir()}
+
+    def get_vote_records(self, poll_id):
+        votes_dir = self._votes_dir(poll_id)
+        if not votes_dir.exists():
+            return []
+        # El archivo del votante se crea al votar y no se vuelve a escribir
+        return [
+            (path.name, self._read_vote(path), path.stat().st_mtime)
+            for path in votes_dir.iterdir()
+        ]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS students (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    last_activity REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS votes (
+    poll_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    option TEXT NOT NULL,
+    voted_at REAL NOT NULL,
+    PRIMARY KEY (poll_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS tallies (
+    poll_id INTEGER NOT NULL,
+    option TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (poll_id, option)
+);
+"""
+
+
+class SQLiteStore(SharedStore):
+    """SQLite en modo WAL: transacciones reales y lectores concurrentes.
+
+    La actividad de los estudiantes se acumula en un ``WriteBehind`` y se
+    escribe en una sola transacción por lote.
+    """
+
+    def __init__(self, path, timeout=30.0, flush_budget=DEFAULT_FLUSH_BUDGET, flush_budgets=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
+        budgets = {**DEFAULT_FLUSH_BUDGETS, **(flush_budgets or {})}
+        self._students = WriteBehind(
+            self._write_students,
+            budget=budgets.get('connected_students', flush_budget),
+            name='students'
+        )
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        self.archive = ChatArchive(self.path.parent / "chat_archive")
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Conexión de la transacción en curso o una del pool"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE toma el lock de escritura al inicio, así dos
+        # read-modify-write concurrentes se serializan en vez de perderse
+        if getattr(self._local, 'conn', None) is not None:
+            yield self
+            return
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.conn = conn
+            self._local.changed = []
+            try:
+                yield self
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+                # Los avisos salen después del COMMIT: quien reaccione ya lee el valor nuevo
+                if self._local.changed:
+                    self._notify(self._local.changed)
+            finally:
+                self._local.conn = None
+                self._local.changed = []
+
+    def _changed(self, key):
+        """Avisar de un cambio al terminar la transacción en curso"""
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.changed.append(key)
+        else:
+            self._notify([key])
+
+    def _execute(self, sql, params=()):
+        with self.transaction():
+            with self._connection() as conn:
+                return conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get(self, key, default=None):
+        rows = self._query("SELECT value FROM kv WHERE key = ?", (key,))
+        if not rows:
+            return default
+        _count('shared_data_bytes_read_total', key, len(rows[0][0]))
+        try:
+            return json.loads(rows[0][0])
+        except ValueError:
+            _count('shared_data_parse_failures_total', key)
+            return default
+
+    def _bump(self, conn, key):
+        conn.execute(
+            "INSERT INTO versions (key, version) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET version = version + 1",
+            (key,)
+        )
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        with self.transaction():
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT INTO kv (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, data)
+                )
+                self._bump(conn, key)
+                self._changed(key)
+        _count('shared_data_bytes_written_total', key, len(data))
+
+    def delete(self, key):
+        with self.transaction():
+            with self._connection() as conn:
+                conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                self._bump(conn, key)
+                self._changed(key)
+
+    def version(self, key):
+        rows = self._query("SELECT version FROM versions WHERE key = ?", (key,))
+        return rows[0][0] if rows else 0
+
+    def clear(self):
+        self._students.discard()
+        with self.transaction():
+            self.clear_messages()
+            with self._connection() as conn:
+                for table in ('kv', 'students', 'messages', 'votes', 'tallies'):
+                    conn.execute(f"DELETE FROM {table}")
+                # Las versiones nunca retroceden: una caché con una versión
+                # previa al reinicio no puede confundirse con un valor nuevo
+                conn.execute("UPDATE versions SET version = version + 1")
+            self._changed(ALL)
+
+    def touch_student(self, user_id, username, when=None):
+        when = when or datetime.now()
+        self._students.put(user_id, (username, when.timestamp()))
+
+    def _write_students(self, batch):
+        _count('shared_data_bytes_written_total', 'students', _student_bytes(batch.items()))
+        with self.transaction():
+            with self._connection() as conn:
+                conn.executemany(
+                    "INSERT INTO students (user_id, username, last_activity) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "username = excluded.username, last_activity = excluded.last_activity",
+                    [(user_id, username, when) for user_id, (username, when) in batch.items()]
+                )
+
+    def get_students(self):
+        rows = self._query("SELECT user_id, username, last_activity FROM students")
+        _count('shared_data_bytes_read_total', 'students', _student_bytes(
+            (user_id, (username, last_activity)) for user_id, username, last_activity in rows
+        ))
+        students = {user_id: (username, last_activity) for user_id, username, last_activity in rows}
+        students.update(self._students.pending())
+        return {
+            user_id: {
+                'username': username,
+                'last_activity': datetime.fromtimestamp(last_activity).isoformat()
+            }
+            for user_id, (username, last_activity) in students.items()
+        }
+
+    def remove_students(self, user_ids):
+        self._students.discard(user_ids)
+        with self.transaction():
+            with self._connection() as conn:
+                conn.executemany(
+                    "DELETE FROM students WHERE user_id = ?",
+                    [(user_id,) for user_id in user_ids]
+                )
+
+    def append_message(self, message):
+        with self.transaction():
+            payload = json.dumps(message)
+            cursor = self._execute("INSERT INTO messages (payload) VALUES (?)", (payload,))
+            self._changed(CHAT_KEY)
+        _count('shared_data_bytes_written_total', CHAT_KEY, len(payload))
+        return cursor.lastrowid
+
+    def read_messages(self, after=None, limit=None, before=None):
+        after = -1 if after is None else after
+        before = -1 if before is None else before
+        if limit is not None:
+            rows = self._query(
+                "SELECT id, payload FROM messages WHERE id > ? AND (? < 0 OR id < ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (after, before, before, limit)
+            )
+            rows.reverse()
+        else:
+            rows = self._query(
+                "SELECT id, payload FROM messages WHERE id > ? AND (? < 0 OR id < ?) ORDER BY id",
+                (after, before, before)
+            )
+        _count('shared_data_bytes_read_total', CHAT_KEY, sum(len(payload) for _, payload in rows))
+        return [(offset, json.loads(payload)) for offset, payload in rows]
+
+    def message_bounds(self):
+        with self._connection() as conn:
+            first, = conn.execute("SELECT MIN(id) FROM messages").fetchone()
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+        end = (row[0] if row else 0) + 1
+        return (first if first is not None else end), end
+
+    def delete_messages(self, offsets):
+        with self.transaction():
+            with self._connection() as conn:
+                deleted = conn.executemany(
+                    "DELETE FROM messages WHERE id = ?", [(offset,) for offset in offsets]
+                ).rowcount
+                if deleted:
+                    self._bump(conn, CHAT_DELETED_KEY)
+                    self._changed(CHAT_KEY)
+                    self._changed(CHAT_DELETED_KEY)
+        return deleted
+
+    def clear_messages(self):
+        with self.transaction():
+            self._archive_entries(self.read_messages())
+            self._execute("DELETE FROM messages")
+            self._changed(CHAT_KEY)
+
+    def archive_messages(self, before):
+        # El segmento se publica antes de borrar las filas: si el proceso muere
+        # en medio, la próxima rotación reescribe el mismo segmento (mismo nombre).
+        # Como en JSON, solo segmentos completos; el resto espera a llenarse
+        archived = 0
+        while True:
+            rows = self._query(
+                "SELECT id, payload FROM messages WHERE id < ? ORDER BY id LIMIT ?",
+                (before, ARCHIVE_SEGMENT_SIZE)
+            )
+            if len(rows) < ARCHIVE_SEGMENT_SIZE:
+                return archived
+            _count('shared_data_bytes_read_total', CHAT_KEY, sum(len(payload) for _, payload in rows))
+            entries = [(offset, json.loads(payload)) for offset, payload in rows]
+            self.archive.write_segment(entries)
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM messages WHERE id BETWEEN ? AND ?",
+                    (entries[0][0], entries[-1][0])
+                )
+                self._changed(CHAT_KEY)
+            archived += len(entries)
+
+    def record_vote(self, poll_id, user_id, option):
+        # La clave primaria (poll_id, user_id) descarta el segundo voto y el
+        # conteo se incrementa en la misma transacción que el registro
+        encoded = _encode_option(option)
+        with self.transaction():
+            with self._connection() as conn:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO votes (poll_id, user_id, option, voted_at) VALUES (?, ?, ?, ?)",
+                    (poll_id, user_id, encoded, datetime.now().timestamp())
+                )
+                if cursor.rowcount != 1:
+                    return False
+                _count('shared_data_bytes_written_total', 'votes', len(user_id) + len(encoded))
+                conn.executemany(
+                    "INSERT INTO tallies (poll_id, option, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT(poll_id, option) DO UPDATE SET count = count + 1",
+                    [(poll_id, label) for label in _option_labels(option)]
+                )
+                self._bump(conn, f'tally_{poll_id}')
+                self._changed(f'tally_{poll_id}')
+                return True
+
+    def get_tally(self, poll_id):
+        rows = self._query("SELECT option, count FROM tallies WHERE poll_id = ?", (poll_id,))
+        return dict(rows)
+
+    def get_vote(self, poll_id, user_id):
+        rows = self._query(
+            "SELECT option FROM votes WHERE poll_id = ? AND user_id = ?",
+            (poll_id, user_id)
+        )
+        if not rows:
+            return None
+        _count('shared_data_bytes_read_total', 'votes', len(rows[0][0]))
+        return _decode_option(rows[0][0])
+
+    def get_votes(self, poll_id):
+        rows = self._query("SELECT user_id, option FROM votes WHERE poll_id = ?", (poll_id,))
+        _count('shared_data_bytes_read_total', 'votes', sum(len(user_id) + len(option) for user_id, option in rows))
+        return {user_id: _decode_option(option) for user_id, option in rows}
+
+    def get_vote_records(self, poll_id):
+        rows = self._query("SELECT user_id, option, voted_at FROM votes WHERE poll_id = ?", (poll_id,))
+        _count('shared_data_bytes_read_total', 'votes', sum(
+            len(user_id) + len(option) + 8 for user_id, option, _ in rows
+        ))
+        return [(user_id, _decode_option(option), voted_at) for user_id, option, voted_at in rows]
+
+    def close(self):
+        self._students.close()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """Caché de valores decodificados compartida por todas las sesiones.
+
+    Cada lectura consulta solo la versión de la clave (un ``stat`` o una fila
+    de SQLite, o un contador en memoria si hay un bus de cambios) y decodifica
+    el valor únicamente cuando la versión cambió. Los valores devueltos se
+    comparten entre sesiones y no deben modificarse.
+    """
+
+    def __init__(self, store, bus=None):
+        self.store = store
+        self._version = bus.version if bus is not None else store.version
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        # La versión se lee antes que el valor: si hay una escritura en medio,
+        # la entrada queda con una versión vieja y la próxima lectura la renueva
+        version = self._version(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self.hits += 1
+            value = entry[1]
+        else:
+            value = self.store.get(key, _MISSING)
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = (version, value)
+        return default if value is _MISSING else value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def create_store(data_dir, backend=None):
+    """Crear el backend configurado en ``AULA_STORAGE``"""
+    backend = backend or os.environ.get('AULA_STORAGE', 'sqlite')
+    flush_budget = int(os.environ.get('AULA_FLUSH_MS', DEFAULT_FLUSH_BUDGET * 1000)) / 1000
+    flush_budgets = parse_budgets(os.environ.get('AULA_FLUSH_BUDGETS'))
+    if backend == 'json':
+        return JsonFileStore(data_dir, flush_budget, flush_budgets)
+    if backend == 'sqlite':
+        return SQLiteStore(Path(data_dir) / "aula.db", flush_budget=flush_budget, flush_budgets=flush_budgets)
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
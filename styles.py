@@ -0,0 +1,63 @@
+"""Estilos de la página, preparados una sola vez por proceso.
+
+Streamlit vuelve a ejecutar el script en cada interacción; el CSS vive en
+este módulo (que se importa una vez) ya minificado, así que cada ejecución
+completa solo envía ``PAGE_STYLE`` tal cual y los fragmentos no lo reenvían.
+"""
+import re
+
+PAGE_CSS = """
+.chat-message {
+    padding: 10px;
+    border-radius: 10px;
+    margin: 5px 0;
+    background-color: rgba(240, 242, 246, 0.1);
+    border: 1px solid rgba(128, 128, 128, 0.2);
+    color: inherit;
+}
+.teacher-message {
+    background-color: rgba(33, 150, 243, 0.15);
+    border-left: 4px solid #2196f3;
+    color: inherit;
+}
+.chat-message strong {
+    color: inherit;
+}
+.chat-message small {
+    color: rgba(128, 128, 128, 0.8);
+}
+.poll-option {
+    padding: 10px;
+    margin: 5px 0;
+    border-radius: 5px;
+    background-color: rgba(232, 234, 240, 0.1);
+}
+.stButton>button {
+    width: 100%;
+}
+.user-badge {
+    display: inline-block;
+    padding: 2px 8px;
+    border-radius: 12px;
+    font-size: 0.8em;
+    font-weight: bold;
+}
+.teacher-badge {
+    background-color: #ff9800;
+    color: white;
+}
+.student-badge {
+    background-color: #4caf50;
+    color: white;
+}
+"""
+
+
+def minify(css):
+    """Quitar espacios y saltos de línea que no cambian el CSS"""
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+PAGE_STYLE = f"<style>{minify(PAGE_CSS)}</style>"
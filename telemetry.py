@@ -0,0 +1,170 @@
+"""Serie de tiempo de la participación en una sala, en memoria fija.
+
+Cada ``AULA_TELEMETRY_SECONDS`` (1 por defecto; 0 lo desactiva) un hilo de
+la sala toma una muestra: estudiantes conectados, mensajes de chat y votos
+por segundo desde la muestra anterior, duración media de los fragmentos del
+proceso en ese intervalo y encuestas abiertas (cuando sube, el maestro lanzó
+una pregunta y los votos por segundo que siguen muestran cómo respondió la
+clase).
+
+Las muestras van a un buffer circular de ``CAPACITY`` filas (un array
+estructurado de numpy, ~26 bytes por fila), así que la memoria no crece
+durante la clase. Cada ``FLUSH_EVERY`` muestras las que todavía no están en
+disco se agregan tal cual, como registros binarios de largo fijo, a
+``engagement-<AAAAMMDD>.series`` en el directorio de la sala;
+``read_series`` los vuelve a cargar en un DataFrame para el análisis
+posterior a la clase.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('students', '<f4'),
+    ('chat_per_s', '<f4'),
+    ('votes_per_s', '<f4'),
+    ('fragment_ms', '<f4'),
+    ('open_polls', '<u2'),
+])
+
+DEFAULT_INTERVAL = 1.0
+
+# Una hora de muestras por segundo en memoria
+CAPACITY = 3600
+
+FLUSH_EVERY = 60
+
+
+def interval_from_env():
+    return float(os.environ.get('AULA_TELEMETRY_SECONDS', DEFAULT_INTERVAL))
+
+
+def to_frame(records):
+    """DataFrame con la hora local como índice a partir de registros ``RECORD``"""
+    frame = pd.DataFrame(records)
+    frame.index = pd.to_datetime(frame.pop('time'), unit='s', utc=True).dt.tz_convert(
+        datetime.now().astimezone().tzinfo
+    )
+    frame.index.name = 'hora'
+    return frame
+
+
+def read_series(path):
+    """Serie guardada en disco (un registro incompleto al final se descarta)"""
+    data = Path(path).read_bytes()
+    usable = len(data) - len(data) % RECORD.itemsize
+    return to_frame(np.frombuffer(data[:usable], dtype=RECORD))
+
+
+class EngagementRecorder:
+    """Buffer circular de muestras de una sala con volcado periódico a disco"""
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL, capacity=CAPACITY, flush_every=FLUSH_EVERY):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.flush_every = flush_every
+        self._buffer = np.zeros(capacity, dtype=RECORD)
+        self._written = 0  # muestras tomadas desde que se abrió la sala
+        self._flushed = 0  # de esas, cuántas ya están en disco
+        self._votes = 0
+        self._last = None  # (hora, fin del chat, votos, ejecuciones y segundos de fragmentos)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record_vote(self):
+        with self._lock:
+            self._votes += 1
+
+    def path_for(self, moment):
+        return self.directory / f"engagement-{datetime.fromtimestamp(moment):%Y%m%d}.series"
+
+    # Muestreo
+    def sample(self, students, chat_end, open_polls, now=None):
+        """Agregar una muestra; las tasas son desde la muestra anterior"""
+        now = now or time.time()
+        runs, seconds = metrics.registry.timing_total('fragment_seconds')
+        with self._lock:
+            votes = self._votes
+            last = self._last
+            self._last = (now, chat_end, votes, runs, seconds)
+            if last is None:
+                return
+            elapsed = max(now - last[0], 1e-6)
+            # Un reinicio de métricas o de la sala deja los contadores por debajo
+            fragment_runs = runs - last[3]
+            row = self._buffer[self._written % len(self._buffer)]
+            row['time'] = now
+            row['students'] = students
+            row['chat_per_s'] = max(chat_end - last[1], 0) / elapsed
+            row['votes_per_s'] = (votes - last[2]) / elapsed
+            row['fragment_ms'] = (seconds - last[4]) / fragment_runs * 1000 if fragment_runs > 0 else np.nan
+            row['open_polls'] = open_polls
+            self._written += 1
+            pending = self._written - self._flushed
+        if pending >= self.flush_every:
+            self.flush()
+
+    def frame(self, seconds=None):
+        """Muestras en memoria en orden cronológico (las de los últimos ``seconds``)"""
+        with self._lock:
+            size = min(self._written, len(self._buffer))
+            start = self._written - size
+            records = np.roll(self._buffer, -(start % len(self._buffer)))[:size]
+        if seconds is not None:
+            records = records[records['time'] >= time.time() - seconds]
+        return to_frame(records)
+
+    def flush(self):
+        """Agregar a disco las muestras que todavía no se guardaron"""
+        with self._lock:
+            capacity = len(self._buffer)
+            lost = max(self._written - self._flushed - capacity, 0)
+            if lost:
+                metrics.inc('telemetry_samples_lost_total', lost)
+            first = self._flushed + lost
+            indexes = np.arange(first, self._written) % capacity
+            records = self._buffer[indexes]
+            self._flushed = self._written
+        if not len(records):
+            return 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Una clase que pasa la medianoche reparte sus muestras por día
+        days = np.array([str(self.path_for(moment)) for moment in records['time']])
+        for path in dict.fromkeys(days):
+            with open(path, 'ab') as f:
+                f.write(records[days == path].tobytes())
+        metrics.inc('telemetry_samples_flushed_total', len(records))
+        return len(records)
+
+    def start(self, probe):
+        """Muestrear cada ``interval`` segundos; ``probe()`` devuelve
+        (estudiantes, fin del chat, encuestas abiertas)"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._probe = probe
+        self._thread = threading.Thread(
+            target=self._run, name=f"telemetry-{self.directory.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample(*self._probe())
+            except Exception:
+                metrics.inc('telemetry_errors_total')
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,162 @@
+"""Escrituras diferidas (write-behind) con commit agrupado.
+
+Las escrituras frecuentes a una misma clave (el conteo de una encuesta
+durante una votación, la lista de estudiantes conectados) no necesitan
+llegar al disco una por una: ``WriteBehind`` guarda el último valor de cada
+clave y lo escribe como mucho ``budget`` segundos después de la primera
+escritura pendiente. Las escrituras que llegan dentro de esa ventana se
+fusionan, y todo lo pendiente se vuelca junto en una sola llamada a
+``flush`` (commit agrupado).
+
+Las lecturas del proceso ven sus propias escrituras de inmediato mediante
+``get``. Una clave con presupuesto 0 se escribe en el momento.
+"""
+import atexit
+import threading
+import time
+import weakref
+
+import metrics
+
+_MISSING = object()
+
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for buffer in list(_buffers):
+        buffer.flush()
+
+
+def parse_budgets(text):
+    """``"tally=0.2,connected_students=2"`` -> ``{'tally': 0.2, 'connected_students': 2.0}``"""
+    budgets = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            budgets[key.strip()] = float(value)
+    return budgets
+
+
+class WriteBehind:
+    """Último valor pendiente por clave, volcado en lotes por un hilo"""
+
+    def __init__(self, flush, budget=0.2, budgets=None, name='kv'):
+        self._flush_batch = flush  # callable({clave: valor})
+        self.budget = budget
+        self.budgets = dict(budgets or {})
+        self.name = name
+        self._pending = {}
+        self._deadlines = {}
+        self._inflight = {}  # lote que se está escribiendo, todavía visible para get
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # un solo volcado a la vez, en orden
+        self._thread = None
+        self._closed = False
+        _buffers.add(self)
+
+    def budget_for(self, key):
+        """Latencia máxima de volcado de la clave (por nombre sin id numérico)"""
+        return self.budgets.get(metrics.normalize_key(key), self.budget)
+
+    def put(self, key, value):
+        budget = self.budget_for(key)
+        if budget <= 0 or self._closed:
+            with self._flush_lock:
+                with self._cond:
+                    self._pending.pop(key, None)
+                    self._deadlines.pop(key, None)
+                self._write({key: value})
+            return
+        with self._cond:
+            if key in self._pending:
+                metrics.inc('write_behind_coalesced_total', buffer=self.name)
+            else:
+                self._deadlines[key] = time.monotonic() + budget
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"write-behind-{self.name}", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def get(self, key, default=_MISSING):
+        """Valor pendiente de la clave, o ``default`` si no hay ninguno"""
+        with self._cond:
+            if key in self._pending:
+                return self._pending[key]
+            return self._inflight.get(key, default)
+
+    def pending(self):
+        with self._cond:
+            return {**self._inflight, **self._pending}
+
+    def discard(self, keys=None):
+        """Olvidar escrituras pendientes (todas si ``keys`` es None)"""
+        with self._flush_lock:
+            with self._cond:
+                if keys is None:
+                    self._pending.clear()
+                    self._deadlines.clear()
+                else:
+                    for key in keys:
+                        self._pending.pop(key, None)
+                        self._deadlines.pop(key, None)
+
+    def flush(self):
+        """Volcar ya todo lo pendiente en un solo lote"""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = {}
+                self._deadlines.clear()
+                self._inflight = batch
+            if batch:
+                try:
+                    self._write(batch)
+                except BaseException:
+                    # Lo que no se pudo escribir vuelve a quedar pendiente,
+                    # salvo las claves que ya tienen un valor más nuevo
+                    with self._cond:
+                        for key, value in batch.items():
+                            if key not in self._pending:
+                                self._pending[key] = value
+                                self._deadlines[key] = time.monotonic() + self.budget_for(key)
+                    raise
+                finally:
+                    with self._cond:
+                        self._inflight = {}
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        self._flush_batch(batch)
+        metrics.observe('write_behind_flush_seconds', time.perf_counter() - start, buffer=self.name)
+        metrics.inc('write_behind_keys_flushed_total', len(batch), buffer=self.name)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._deadlines:
+                        wait = min(self._deadlines.values()) - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            # Al vencer la primera clave se vuelca todo lo pendiente junto
+            try:
+                self.flush()
+            except Exception:
+                metrics.inc('write_behind_errors_total', buffer=self.name)
+                time.sleep(self.budget)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()